@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+# bench/bench.py [--sizes N,N,...] [-j jobs] [--output report.json]
+#   Measure the overhead of the drivers themselves, without needing a real
+#   LLVM build.  For each corpus size, a synthetic corpus of .ll, .c and .s
+#   tests is generated, and run against a fake build directory whose tools
+#   are all stub_tool.py.  Times rescanning the corpus, run_test,
+#   run_and_form_record, a full manage-corpus.py run to its fixed point (and
+#   a second run, where everything is already known), and run_many.py.
+#
+#   The report is JSON, written to stdout unless --output is given, so that
+#   runs before and after a change can be compared.  stub_exec is the time
+#   to simply run a stub tool, which bounds how fast a test run can be.
+#
+#   With --workdir, everything is generated there and kept, otherwise in a
+#   temporary directory.
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_dir)
+from common import *
+
+stub_tools = ["opt", "llc", "clang", "llvm-reduce", "bugpoint", "creduce"]
+
+def make_stub_build(builddir):
+    bindir = os.path.join(builddir, "bin")
+    os.makedirs(bindir)
+    for tool in stub_tools:
+        os.symlink(os.path.join(bench_dir, "stub_tool.py"),
+                   os.path.join(bindir, tool))
+        pass
+    with open(os.path.join(builddir, "CMakeCache.txt"), 'w') as f:
+        f.write("CMAKE_BUILD_TYPE:STRING=Release\n")
+        pass
+    pass
+
+# (extension, RUN line, filler line, marker line) for each kind of test.
+# Names are made unique per test so that no two tests have the same content.
+test_kinds = [
+    (".ll", "; RUN: opt -S -instcombine < %s",
+     "@filler_%d_%d = global i32 0", "@%s = global i32 0"),
+    (".ll", "; RUN: opt -S -gvn < %s",
+     "@filler_%d_%d = global i32 0", "@%s = global i32 0"),
+    (".ll", "; RUN: opt -S -O2 < %s",
+     "@filler_%d_%d = global i32 0", "@%s = global i32 0"),
+    (".ll", "; RUN: llc < %s",
+     "@filler_%d_%d = global i32 0", "@%s = global i32 0"),
+    (".c", "// RUN: clang -O2 -c %s -o /dev/null",
+     "int filler_%d_%d;", "int %s;"),
+    (".s", "# RUN: clang -c %s -o /dev/null",
+     "filler_%d_%d: nop", "%s: nop"),
+]
+
+# Generate count tests in corpusdir.  Returns the paths of those which don't
+# hang.
+def make_corpus(corpusdir, count, seed, crash_fraction, hang_fraction,
+                filler, buckets):
+    rng = random.Random(seed)
+    os.makedirs(corpusdir)
+    finishing = []
+    for i in range(count):
+        ext, runline, filler_line, marker_line = test_kinds[i % len(test_kinds)]
+        chance = rng.random()
+        marker = None
+        if chance < hang_fraction:
+            marker = "stub_hang"
+        elif chance < hang_fraction + crash_fraction:
+            marker = "stub_crash_%d" % rng.randrange(buckets)
+            pass
+        lines = [runline]
+        for k in range(filler):
+            lines.append(filler_line % (i, k))
+            pass
+        if None != marker:
+            lines.insert(1 + filler // 2, marker_line % marker)
+            pass
+        path = os.path.join(corpusdir, "test%d%s" % (i, ext))
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+            pass
+        if "stub_hang" != marker:
+            finishing.append(path)
+            pass
+        pass
+    return finishing
+
+def write_config(workdir, builddir, corpusdir):
+    config = {
+        "LLVM_BUILD_DIR": builddir,
+        "LLVM_BUILD_REVISION": "bench",
+        "LLVM_SOURCE_DIR": workdir,
+        "CORPUS_DIR": corpusdir,
+    }
+    with open(os.path.join(workdir, "config.json"), 'w') as f:
+        json.dump(config, f, indent=2)
+        pass
+    pass
+
+@contextlib.contextmanager
+def quietly():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+        pass
+    pass
+
+# Time fn(*args), returning seconds.
+def timed(fn, *args, **kwargs):
+    start = time.monotonic()
+    fn(*args, **kwargs)
+    return time.monotonic() - start
+
+# Mean time per call of fn over each of the tests.
+def time_per_test(tests, fn, *args, **kwargs):
+    if 0 == len(tests):
+        return None
+    total = 0
+    for test in tests:
+        total += timed(fn, test, *args, **kwargs)
+        pass
+    return total / len(tests)
+
+def time_stub_exec(builddir, test):
+    opt = os.path.join(builddir, "bin", "opt")
+    with open(test, 'rb') as f:
+        return timed(subprocess.run, [opt, "-S"], stdin=f,
+                     stdout=subprocess.DEVNULL)
+
+def count_files(corpusdir):
+    return len([name for name in os.listdir(corpusdir)
+                if None != get_comment_prefix(name)])
+
+def run_script(workdir, env, argv):
+    start = time.monotonic()
+    completed = subprocess.run([sys.executable] + argv, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    duration = time.monotonic() - start
+    if completed.returncode != 0:
+        print (completed.stderr.decode(errors="replace"), file=sys.stderr)
+        raise RuntimeError("%s failed" % argv[0])
+    return duration
+
+def bench_size(args, workdir, builddir, size):
+    sizedir = os.path.join(workdir, "size%d" % size)
+    corpusdir = os.path.join(sizedir, "corpus")
+    os.makedirs(sizedir)
+    finishing = make_corpus(corpusdir, size, args.seed, args.crash_fraction,
+                            args.hang_fraction, args.filler, args.buckets)
+    sample = finishing[:args.samples]
+    result = {"size": size}
+
+    index = get_corpus_index(corpusdir)
+    result["rescan_cold"] = timed(refresh_corpus_index, index, corpusdir)
+    result["rescan_warm"] = timed(refresh_corpus_index, index, corpusdir)
+    result["rescan_trusted"] = timed(refresh_corpus_index, index, corpusdir,
+                                     trust_dir_mtimes=True)
+
+    with quietly():
+        result["run_test_direct"] = time_per_test(sample, run_test, builddir,
+                                                  runner="direct")
+        result["run_test_shell"] = time_per_test(sample, run_test, builddir,
+                                                 runner="shell")
+        result["run_and_form_record"] = time_per_test(
+            sample, lambda test: run_and_form_record("bench", builddir, test))
+        pass
+
+    # The drivers need config.json in their working directory, and creduce
+    # on the PATH.
+    write_config(sizedir, builddir, corpusdir)
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(builddir, "bin") + os.pathsep + env["PATH"]
+    manage = [os.path.join(repo_dir, "manage-corpus.py"), "-j", str(args.jobs)]
+    result["manage_corpus"] = run_script(sizedir, env, manage)
+    result["corpus_size_after"] = count_files(corpusdir)
+    result["manage_corpus_rerun"] = run_script(sizedir, env, manage)
+
+    if 0 != len(sample):
+        run_many = [os.path.join(repo_dir, "run_many.py"), "-j",
+                    str(args.jobs), "bench", builddir, str(args.runs),
+                    sample[0]]
+        result["run_many_per_run"] = (run_script(sizedir, env, run_many) /
+                                      args.runs)
+        pass
+    return result
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", default="10,50,200",
+                    help="comma separated corpus sizes")
+parser.add_argument("-j", dest="jobs", type=int, default=1)
+parser.add_argument("--samples", type=int, default=20,
+                    help="tests to time run_test etc. on")
+parser.add_argument("--runs", type=int, default=20,
+                    help="runs for run_many.py")
+parser.add_argument("--crash-fraction", type=float, default=0.2)
+parser.add_argument("--hang-fraction", type=float, default=0.0)
+parser.add_argument("--filler", type=int, default=8,
+                    help="reducible lines per test")
+parser.add_argument("--buckets", type=int, default=5,
+                    help="distinct crashes")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--workdir", default=None)
+parser.add_argument("--output", default=None)
+args = parser.parse_args()
+
+if None != args.workdir:
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir)
+else:
+    workdir = tempfile.mkdtemp(prefix="triage-bench-")
+    pass
+
+try:
+    builddir = os.path.join(workdir, "build")
+    make_stub_build(builddir)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "results": [],
+    }
+    sizes = [int(size) for size in args.sizes.split(",")]
+    for size in sizes:
+        print ("Benchmarking a corpus of %d tests" % size, file=sys.stderr)
+        result = bench_size(args, workdir, builddir, size)
+        report["results"].append(result)
+        pass
+    report["stub_exec"] = time_stub_exec(
+        builddir, os.path.join(workdir, "size%d" % sizes[0], "corpus",
+                               "test0.ll"))
+finally:
+    if None == args.workdir:
+        shutil.rmtree(workdir)
+        pass
+    pass
+
+if None != args.output:
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+        pass
+else:
+    json.dump(report, sys.stdout, indent=2)
+    print ()
+    pass
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+# bench/run_test.py build-dir testfile [N]
+#   Run a single standalone test N times (default 100) with each of the
+#   runners run_test supports, and report the mean wall time per run.  Using
+#   a build-dir whose tools do (almost) nothing, e.g. bin/opt being a symlink
+#   to /bin/true, measures the per-run overhead of the runner itself.
+
+import os
+import io
+import sys
+import contextlib
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import *
+
+builddir = sys.argv[1]
+test = sys.argv[2]
+count = 100
+if len(sys.argv) > 3:
+    count = int(sys.argv[3])
+    pass
+
+results = {}
+for runner in ["shell", "direct"]:
+    # Warm up (e.g. tool lookup, and the page cache) before timing.
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_test(test, builddir, runner)
+        start = time.monotonic()
+        for i in range(0, count):
+            run_test(test, builddir, runner)
+            pass
+        elapsed = time.monotonic() - start
+        pass
+    results[runner] = elapsed / count
+    print("%s: %.2f ms/run" % (runner, results[runner] * 1000))
+    pass
+
+print("speedup: %.1fx" % (results["shell"] / results["direct"]))
@@ -0,0 +1,262 @@
+#!/usr/bin/python3 -S
+# A stand-in for the LLVM tools (and creduce) used by the drivers, for
+# benchmarking without a real LLVM build.  bench.py symlinks it into a fake
+# build directory as opt, llc, clang, llvm-reduce and bugpoint, and it acts
+# according to the name it's run under.
+#
+# What happens is decided by the content of the input:
+#   a line containing stub_crash_N - compiling it fails with an assertion,
+#     whose message depends on N (so crashes can be bucketed)
+#   a line containing stub_hang - compiling it never finishes
+#   otherwise, compiling it succeeds
+# Only opt runs which are given a pass compile anything; opt -S alone just
+# prints its input, like the real thing.  The reducers keep every line
+# mentioning stub_ and drop half of the rest (i.e. the filler), so repeated
+# reduction reaches a fixed point.
+
+import os
+import re
+import sys
+import time
+import shutil
+import subprocess
+
+def get_comment_prefix(path):
+    if path.endswith(".ll"):
+        return ";"
+    if path.endswith(".s"):
+        return "#"
+    return "//"
+
+def read_input(inputs):
+    if 0 == len(inputs):
+        return sys.stdin.read()
+    with open(inputs[0], 'r') as f:
+        return f.read()
+
+def write_output(content, output):
+    if output == None or output == "-":
+        sys.stdout.write(content)
+        return
+    with open(output, 'w') as f:
+        f.write(content)
+        pass
+    pass
+
+def strip_comments(content, comment_prefix):
+    lines = content.splitlines(True)
+    return "".join(line for line in lines
+                   if not line.strip().startswith(comment_prefix))
+
+def crash(tool, content):
+    match = re.search(r"stub_crash_(\d+)", content)
+    number = int(match.group(1))
+    sys.stderr.write("%s: StubPass%d.cpp:%d: void stub%d(): Assertion "
+                     "`stub invariant %d' failed.\n" %
+                     (tool, number, 100 + number, number, number))
+    sys.stderr.write("PLEASE submit a bug report to "
+                     "https://github.com/llvm/llvm-project/issues/ and "
+                     "include the crash backtrace.\n")
+    sys.stderr.write("Stack dump:\n")
+    sys.stderr.write("0.\tProgram arguments: %s\n" % " ".join(sys.argv))
+    frames = ["llvm::sys::PrintStackTrace(llvm::raw_ostream&, int)",
+              "SignalHandler(int)",
+              "stub%d()" % number,
+              "StubPass%d::run()" % number,
+              "main"]
+    for i, frame in enumerate(frames):
+        sys.stderr.write("#%d 0x%016x %s\n" % (i, 0x400000 + 16 * i, frame))
+        pass
+    sys.stderr.flush()
+    os.abort()
+    pass
+
+def compile(tool, content):
+    if "stub_hang" in content:
+        while True:
+            time.sleep(3600)
+            pass
+        pass
+    if None != re.search(r"stub_crash_\d+", content):
+        crash(tool, content)
+        pass
+    pass
+
+# Split arguments into the input files, the -o output, and everything else.
+def parse_args(args):
+    inputs = []
+    output = None
+    options = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-o":
+            output = args[i + 1]
+            i += 2
+            continue
+        if arg.startswith("-o="):
+            output = arg[len("-o="):]
+        elif arg.startswith("-") and arg != "-":
+            options.append(arg)
+        else:
+            inputs.append(arg)
+            pass
+        i += 1
+        pass
+    return inputs, output, options
+
+# The passes the stub opt claims to have, and what it claims -O<n> runs
+stub_passes = ["instcombine", "gvn", "sroa", "early-cse", "simplifycfg",
+               "globaldce", "licm", "indvars"]
+stub_default_pipeline = ("function(sroa,early-cse,simplifycfg,instcombine),"
+                         "function(loop(licm,indvars)),function(gvn),"
+                         "globaldce")
+
+def print_pipeline(options):
+    pipeline = []
+    for option in options:
+        if option.startswith("-passes="):
+            pipeline.append(option[len("-passes="):].strip("'"))
+        elif None != re.match(r"^-O[0-3sz]$", option):
+            pipeline.append(stub_default_pipeline)
+        elif option[1:] in stub_passes:
+            pipeline.append("function(%s)" % option[1:])
+            pass
+        pass
+    print (",".join(["verify"] + pipeline + ["verify"]))
+    pass
+
+def run_opt(args):
+    inputs, output, options = parse_args(args)
+    if "-print-passes" in options:
+        print ("Module passes:")
+        for name in stub_passes:
+            print ("  %s" % name)
+            pass
+        return 0
+    if "-print-pipeline-passes" in options:
+        print_pipeline(options)
+        return 0
+    content = read_input(inputs)
+    if any(option not in ["-S", "-disable-output"] for option in options):
+        compile("opt", content)
+        pass
+    if "-disable-output" not in options and ("-S" in options or
+                                            None != output):
+        write_output(strip_comments(content, ";"), output)
+        pass
+    return 0
+
+def run_llc(args):
+    inputs, output, options = parse_args(args)
+    compile("llc", read_input(inputs))
+    return 0
+
+def run_clang(args):
+    inputs, output, options = parse_args(args)
+    content = read_input(inputs)
+    if "-emit-llvm" in options:
+        # Pretend the frontend lowered it
+        write_output(strip_comments(content, "//"), output)
+        return 0
+    compile("clang", content)
+    return 0
+
+# Keep lines mentioning stub_, and every other filler line.
+def reduce_content(content, comment_prefix):
+    lines = []
+    filler = 0
+    for line in strip_comments(content, comment_prefix).splitlines(True):
+        if "stub_" not in line:
+            filler += 1
+            if 0 == filler % 2:
+                continue
+            pass
+        lines.append(line)
+        pass
+    return "".join(lines)
+
+def is_interesting(script, path):
+    return 0 == subprocess.run([script, path]).returncode
+
+def run_llvm_reduce(args):
+    inputs, output, options = parse_args(args)
+    script = None
+    for option in options:
+        if option.startswith("-test=") or option.startswith("--test="):
+            script = option.split("=", 1)[1]
+            pass
+        pass
+    path = inputs[0]
+    if not is_interesting(script, path):
+        sys.stderr.write("Error: input isn't interesting! Verify "
+                         "interesting-ness test\n")
+        return 1
+    with open(path, 'r') as f:
+        content = f.read()
+        pass
+    reduced = reduce_content(content, ";")
+    with open("reduced.ll", 'w') as f:
+        f.write(reduced)
+        pass
+    if not is_interesting(script, "reduced.ll"):
+        with open("reduced.ll", 'w') as f:
+            f.write(strip_comments(content, ";"))
+            pass
+        pass
+    return 0
+
+def run_bugpoint(args):
+    inputs, output, options = parse_args(args)
+    with open(inputs[0], 'r') as f:
+        content = f.read()
+        pass
+    passes = [option for option in options if option != "--safe-run-llc"]
+    if 0 == len(passes) or None == re.search(r"stub_crash_\d+", content):
+        sys.stderr.write("*** Debugging optimizer crash!\n"
+                         "Checking to see if these passes crash: "
+                         "*** Found no crash\n")
+        return 1
+    # Note: not really bitcode, but the stub opt doesn't care
+    with open("bugpoint-reduced-simplified.bc", 'w') as f:
+        f.write(reduce_content(content, ";"))
+        pass
+    return 0
+
+def run_creduce(args):
+    # Note: the value of --n ends up in inputs, after these two
+    inputs, output, options = parse_args(args)
+    script, path = inputs[0], inputs[1]
+    if not is_interesting(script, path):
+        sys.stderr.write("C-Reduce fatal error:\n"
+                         "interestingness test does not return zero\n")
+        return 1
+    with open(path, 'r') as f:
+        content = f.read()
+        pass
+    shutil.copy(path, path + ".orig")
+    with open(path, 'w') as f:
+        f.write(reduce_content(content, get_comment_prefix(path)))
+        pass
+    if not is_interesting(script, path):
+        shutil.copy(path + ".orig", path)
+        pass
+    os.unlink(path + ".orig")
+    return 0
+
+tools = {
+    "opt": run_opt,
+    "llc": run_llc,
+    "clang": run_clang,
+    "clang++": run_clang,
+    "llvm-reduce": run_llvm_reduce,
+    "bugpoint": run_bugpoint,
+    "creduce": run_creduce,
+}
+
+if __name__ == "__main__":
+    tool = os.path.basename(sys.argv[0])
+    if tool not in tools:
+        sys.stderr.write("stub_tool.py: unknown tool %s\n" % tool)
+        sys.exit(1)
+    sys.exit(tools[tool](sys.argv[1:]))
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# bisect-builds.py [-j jobs] [--corpus-dir dir] testfile builds
+#   Find where in a sequence of builds the behavior of a test changes, e.g.
+#   which revision introduced (or fixed) a crash.  builds is a file (or -
+#   for stdin) listing one "revision build-dir" pair per line, oldest
+#   first.  Blank lines and lines starting with # are ignored.
+#
+#   The first and last builds are run first, and must behave differently.
+#   Two runs behave the same if they have the same outcome and, for
+#   failures, the same crash signature (or output, if there's no crash).
+#   Each step then runs the test on up to jobs builds spread evenly across
+#   the remaining range at once (a k-ary rather than binary search), and
+#   narrows the range to between the last build which behaves like the
+#   first one and the build after it.  Assumes there's a single change
+#   somewhere in the sequence; if there are several, one of them is found.
+#
+#   If given a corpus directory, the observation store in it is consulted
+#   first, and the test is only run on builds where its outcome is not
+#   already known.  Every run is reported as an observation log record (see
+#   run-one.py), and the two builds either side of the change, with their
+#   output signatures, at the end.  Exits with 1 if the first and last
+#   builds behave the same.
+#
+#   IMPORTANT: Assumes (but does not check) that binaries in each build-dir
+#   correspond to a build of the source at the paired revision.
+
+import argparse
+import concurrent.futures
+from common import *
+from events import set_event_log
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", dest="jobs", type=int, default=1)
+parser.add_argument("--corpus-dir", default=None)
+parser.add_argument("test")
+parser.add_argument("builds")
+args = parser.parse_args()
+
+def read_builds(f):
+    builds = []
+    for line in f:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        parts = line.split(None, 1)
+        if len(parts) != 2:
+            raise ValueError("expected \"revision build-dir\", got: %s" %
+                             line)
+        builds.append((parts[0], parts[1]))
+        pass
+    return builds
+
+if args.builds == "-":
+    builds = read_builds(sys.stdin)
+else:
+    with open(args.builds, 'r') as f:
+        builds = read_builds(f)
+        pass
+    pass
+if len(builds) < 2:
+    print ("Need at least two builds to bisect", file=sys.stderr)
+    sys.exit(2)
+
+if args.corpus_dir != None:
+    set_event_log(args.corpus_dir)
+    pass
+
+# What a run is compared by
+def get_behavior(obs):
+    if obs.outcome != "fail":
+        return obs.outcome
+    return (obs.outcome, obs.crashsig or obs.outputsig)
+
+# Observations by index into builds
+observed = {}
+
+def observe(i):
+    revision, builddir = builds[i]
+    # Note: connections to the store are per thread
+    store = None
+    if args.corpus_dir != None:
+        store = get_observation_store(args.corpus_dir)
+        pass
+    return observe_test(builddir, args.test, store, revision)
+
+# Run the test on each of the builds (by index) not already observed, up to
+# jobs at a time.  Note: Each run is a child process, so threads are enough
+# to keep jobs cores busy.
+def observe_all(indices, executor):
+    futures = {}
+    for i in indices:
+        if i not in observed:
+            futures[executor.submit(observe, i)] = i
+            pass
+        pass
+    for future in concurrent.futures.as_completed(futures):
+        i = futures[future]
+        observed[i] = future.result()
+        print (", ".join(form_record(observed[i], builds[i][1], args.test)),
+               flush=True)
+        pass
+    pass
+
+# Up to k indices spread evenly strictly between lo and hi
+def pick_probes(lo, hi, k):
+    probes = []
+    for i in range(1, k + 1):
+        probe = lo + (i * (hi - lo)) // (k + 1)
+        if probe > lo and probe < hi and probe not in probes:
+            probes.append(probe)
+            pass
+        pass
+    return probes
+
+def describe(i):
+    obs = observed[i]
+    revision, builddir = builds[i]
+    text = "  %s (%s): %s, output %s" % (revision, builddir, obs.outcome,
+                                          obs.outputsig)
+    if None != obs.crashsig:
+        text += ", crash %s" % obs.crashsig
+        pass
+    return text
+
+lo = 0
+hi = len(builds) - 1
+steps = 0
+with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    observe_all([lo, hi], executor)
+    before = get_behavior(observed[lo])
+    if before == get_behavior(observed[hi]):
+        print ("No change between the first and last builds:")
+        print (describe(lo))
+        print (describe(hi))
+        sys.exit(1)
+    while hi - lo > 1:
+        steps += 1
+        probes = pick_probes(lo, hi, max(1, args.jobs))
+        observe_all(probes, executor)
+        # The range is now from the last probe which behaves like the first
+        # build to the first which doesn't.
+        for probe in probes:
+            if get_behavior(observed[probe]) != before:
+                hi = probe
+                break
+            lo = probe
+            pass
+        print ("Step %d: between %s and %s (%d builds apart)" %
+               (steps, builds[lo][0], builds[hi][0], hi - lo))
+        pass
+    pass
+
+print ("Behavior changes between %s and %s (%d builds tried, %d steps):" %
+       (builds[lo][0], builds[hi][0], len(observed), steps))
+print (describe(lo))
+print (describe(hi))
@@ -0,0 +1,146 @@
+# A content hash for textual LLVM IR which ignores differences that don't
+# change what a test tests.  Two .ll files get the same canonical hash if
+# they differ only in:
+#   - the names of named (or numbered) struct types, e.g. the %struct.S.0
+#     opt produces when it has to remangle %struct.S
+#   - the names of local values and basic blocks
+#   - the numbering of metadata nodes (!N) and attribute groups (#N)
+#   - comments, blank lines and whitespace
+# The directive comments (RUN, REQUIRES, etc.) do matter, so they're hashed
+# separately, before the IR.  Global names are left alone, as they can
+# matter (e.g. intrinsics, or a RUN line naming a function).
+#
+# Names are replaced by their order of first appearance, which makes this a
+# (conservative) approximation: reordering anything makes a difference.
+#
+# Both the type names and the directives are needed before any IR can be
+# hashed, so a file is read twice: once to gather those (see IRScan), and
+# again to canonicalize and hash the IR a line at a time.  Neither pass keeps
+# more than the type names and directives in memory.
+
+import hashlib
+import re
+
+directive_re = re.compile(r"^\s*;\s*(RUN|REQUIRES|XFAIL|UNSUPPORTED):")
+
+# Quoted strings (optionally as a name), local names, metadata and attribute
+# group numbers, and comments, in that order so that e.g. a ';' or '%' in a
+# string isn't mistaken for anything else.
+token_re = re.compile(r'''(?P<string>[%@!]?"(?:[^"\\]|\\.)*")'''
+                      r'''|(?P<local>%[-a-zA-Z$._0-9]+)'''
+                      r'''|(?P<metadata>![0-9]+\b)'''
+                      r'''|(?P<attrs>#[0-9]+\b)'''
+                      r'''|(?P<comment>;.*$)''')
+
+type_def_re = re.compile(r'''^\s*(%[-a-zA-Z$._0-9]+|%"(?:[^"\\]|\\.)*")'''
+                         r'''\s*=\s*type\b''')
+label_re = re.compile(r'''^\s*([-a-zA-Z$._0-9]+|"(?:[^"\\]|\\.)*")\s*:''')
+define_re = re.compile(r"^\s*define\b")
+space_re = re.compile(r"\s+")
+
+class Renamer:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.names = {}
+        pass
+
+    def rename(self, name):
+        if name not in self.names:
+            self.names[name] = "%s%d" % (self.prefix, len(self.names))
+            pass
+        return self.names[name]
+    pass
+
+# What has to be known about some IR before it can be canonicalized: the
+# names of the types it defines, and its directive comments.  Fed one line
+# (a str) at a time.
+class IRScan:
+    def __init__(self):
+        self.types = set()
+        self.directives = []
+        pass
+
+    def feed(self, line):
+        m = type_def_re.match(line)
+        if None != m:
+            self.types.add(m.group(1))
+            pass
+        if directive_re.match(line):
+            self.directives.append(line.strip())
+            pass
+        pass
+
+    # The canonical hash of lines, the same IR as was fed (but read again).
+    def hexdigest(self, lines):
+        hash = hashlib.sha1()
+        for line in self.directives:
+            hash.update(line.encode() + b"\n")
+            pass
+        hash.update(b"\n")
+        for line in canonicalize_ir(lines, self.types):
+            hash.update(line.encode() + b"\n")
+            pass
+        return hash.hexdigest()
+    pass
+
+# Yield the canonical form of the IR in lines (an iterable of str), a line
+# at a time, without the directive comments.  types holds the names of the
+# types it defines (see IRScan); without it, lines are read into memory to
+# find them.
+def canonicalize_ir(lines, types=None):
+    if None == types:
+        lines = list(lines)
+        types = scan_ir(lines).types
+        pass
+
+    type_names = Renamer("%T")
+    metadata_names = Renamer("!M")
+    attrs_names = Renamer("#A")
+    local_names = Renamer("%v")
+
+    def replace_token(m):
+        kind = m.lastgroup
+        token = m.group(0)
+        if kind == "comment":
+            return ""
+        if kind == "metadata":
+            return metadata_names.rename(token)
+        if kind == "attrs":
+            return attrs_names.rename(token)
+        if kind == "string" and not token.startswith("%"):
+            return token
+        if token in types:
+            return type_names.rename(token)
+        return local_names.rename(token)
+
+    for line in lines:
+        if define_re.match(line):
+            # Local names are scoped to the function
+            local_names = Renamer("%v")
+            pass
+        label = ""
+        m = label_re.match(line)
+        if None != m:
+            label = local_names.rename("%" + m.group(1)) + ":"
+            line = line[m.end():]
+            pass
+        line = label + token_re.sub(replace_token, line)
+        line = space_re.sub(" ", line).strip()
+        if line != "":
+            yield line
+            pass
+        pass
+    pass
+
+def scan_ir(lines):
+    scan = IRScan()
+    for line in lines:
+        scan.feed(line)
+        pass
+    return scan
+
+# The canonical hash of the IR in lines (an iterable of str), which is read
+# into memory.  See IRScan for hashing IR without doing so.
+def get_canonical_ir_hash(lines):
+    lines = list(lines)
+    return scan_ir(lines).hexdigest(lines)
@@ -1,16 +1,216 @@
 import hashlib
+import builtins
 import os
 import sys
 import subprocess
 import shutil
-import contextlib
 import stat
 import tempfile
 import json
+import concurrent.futures
+import time
+import shlex
+import signal
+import ctypes
+import collections
+import re
+import functools
+import threading
+import random
+import resource
+import gzip
+import lzma
+import contextlib
+from triage_db import Observation, outcome_for_returncode, get_observation_store
+from triage_db import CorpusEntry, CorpusIndex, CrashBuckets, DB_NAME
+from triage_db import ReducerAttempt, ReducerLedger, ToolFingerprints
+from jobserver import job_token, extra_job_tokens
+from events import timed_event, is_logging_events, set_event_log
+from canonical_ir import IRScan, scan_ir
+from scheduler import get_size_band
+from testheader import HeaderParser, parse_header, rewrite_file
+from testheader import replace_header_runs
+
+# Corpus entries may be stored compressed (see set_corpus_compression), as
+# e.g. <sha1>.ll.xz.  Everything which reads a test goes through open_test,
+# so hashes, RUN lines and so on are always of the uncompressed content.
+compressors = {".gz": gzip, ".xz": lzma}
+
+def get_compression_suffix(path):
+    suffix = os.path.splitext(path)[1]
+    if suffix in compressors:
+        return suffix
+    return ""
+
+def is_compressed_test(path):
+    return "" != get_compression_suffix(path)
+
+# The name of the test without any compression suffix
+def get_plain_name(path):
+    return path[:len(path) - len(get_compression_suffix(path))]
+
+# The extension which says what kind of test this is, e.g. ".ll" for both
+# foo.ll and foo.ll.xz
+def get_test_ext(path):
+    return os.path.splitext(get_plain_name(path))[1]
+
+# Open a test for reading, decompressing it as it's read if need be.
+def open_test(path, mode='rb', errors=None):
+    module = compressors.get(get_compression_suffix(path))
+    if None == module:
+        return open(path, mode, errors=errors)
+    if 'b' not in mode and 't' not in mode:
+        # Unlike open, gzip.open and lzma.open default to binary
+        mode += 't'
+        pass
+    return module.open(path, mode, errors=errors)
+
+# Content sizes of compressed tests by path, along with the stat key of the
+# file they were measured from (as for test_headers).
+test_sizes = {}
+MAX_CACHED_TEST_SIZES = 4096
+
+def cache_test_size(test, key, size):
+    if len(test_sizes) >= MAX_CACHED_TEST_SIZES:
+        test_sizes.clear()
+        pass
+    test_sizes[test] = (key, size)
+    pass
+
+# The corpus a file is in (possibly in a subdirectory), i.e. the nearest
+# directory above it with a triage.db, or None.
+def find_corpus_dir(path):
+    dirpath = os.path.dirname(path)
+    while not os.path.exists(os.path.join(dirpath, DB_NAME)):
+        parent = os.path.dirname(dirpath)
+        if parent == dirpath:
+            return None
+        dirpath = parent
+        pass
+    return dirpath
+
+# The content size of a compressed test as recorded in the index of the
+# corpus it's in, or None if it isn't indexed (as it is now).
+def get_indexed_test_size(path, key):
+    path = os.path.abspath(path)
+    corpusdir = find_corpus_dir(path)
+    if None == key or None == corpusdir:
+        return None
+    entry = get_corpus_index(corpusdir).lookup(path)
+    if None == entry or (entry.size, entry.mtime_ns) != key[1:]:
+        return None
+    return entry.content_size
+
+# The size of the test's content, uncompressed.  For a compressed test, that
+# means decompressing it, unless it's already known.
+def get_test_size(path):
+    if not is_compressed_test(path):
+        return os.path.getsize(path)
+    key = get_stat_key(path)
+    cached = test_sizes.get(path)
+    if None != cached and cached[0] == key:
+        return cached[1]
+    size = get_indexed_test_size(path, key)
+    if None == size:
+        size = 0
+        with open_test(path) as f:
+            while chunk := f.read(65536):
+                size += len(chunk)
+                pass
+            pass
+        pass
+    cache_test_size(path, key, size)
+    return size
+
+# Write the content of test to dest, compressed as dest's suffix says.
+def write_test(test, dest):
+    module = compressors.get(get_compression_suffix(dest), builtins)
+    with open_test(test) as f, module.open(dest, 'wb') as out:
+        shutil.copyfileobj(f, out, 65536)
+        pass
+    pass
+
+# A path to the content of test as a plain file, for tools which need one.
+# Compressed tests are decompressed into workingdir, keeping their name
+# (which e.g. clang needs for the extension).
+def get_plain_test(test, workingdir):
+    if not is_compressed_test(test):
+        return test
+    plain = os.path.join(workingdir, os.path.basename(get_plain_name(test)))
+    write_test(test, plain)
+    return plain
+
+# A pipe a thread fills with the decompressed content of a test, for use as
+# a child's stdin without decompressing the whole test first.
+class DecompressingPipe:
+    def __init__(self, path):
+        rfd, wfd = os.pipe()
+        self.reader = os.fdopen(rfd, 'rb')
+        self.thread = threading.Thread(target=self.feed, args=(path, wfd),
+                                       daemon=True)
+        self.thread.start()
+        pass
+
+    def feed(self, path, wfd):
+        try:
+            with open_test(path) as f, os.fdopen(wfd, 'wb') as out:
+                shutil.copyfileobj(f, out, 65536)
+                pass
+        except BrokenPipeError:
+            # The tool exited (or was killed) without reading everything
+            pass
+        pass
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def close(self):
+        # Note: the tool has finished by now, so closing our end unblocks the
+        # writer if it's still going.
+        self.reader.close()
+        self.thread.join()
+        pass
+    pass
+
+def open_test_stdin(path):
+    if is_compressed_test(path):
+        return DecompressingPipe(path)
+    return open(path, 'rb')
+
+# How large corpus entries are stored: None to store everything as is, or
+# the (suffix, min_size) to compress entries of at least min_size bytes
+# with.  See set_corpus_compression.
+corpus_compression = None
+
+# setting is the (optional) CORPUS_COMPRESSION from config.json, e.g.
+# {"format": "xz", "min_size": 65536}.  format is "gz" or "xz".
+def set_corpus_compression(setting):
+    global corpus_compression
+    corpus_compression = None
+    if None != setting:
+        corpus_compression = ("." + setting["format"],
+                              setting.get("min_size", 0))
+        pass
+    pass
+
+# The suffix to store a new corpus entry of size bytes with
+def get_storage_suffix(size):
+    if None == corpus_compression:
+        return ""
+    suffix, min_size = corpus_compression
+    if size < min_size:
+        return ""
+    return suffix
+
+# Set up a worker process of a driver's pool: see make_executor.
+def init_corpus_worker(corpusdir, compression):
+    set_event_log(corpusdir)
+    set_corpus_compression(compression)
+    pass
 
 def append_file_contents_to_hash(hash, fname):
     assert os.path.exists(fname)
-    with open(fname,'rb') as f:
+    with open_test(fname) as f:
         while chunk := f.read(8192):
             hash.update(chunk)
             pass
@@ -18,11 +218,15 @@ def append_file_contents_to_hash(hash, fname):
     pass
 
 def sha1_of_files(files):
-    hash = hashlib.sha1()
-    for f in files:
-        append_file_contents_to_hash(hash, f)
-        pass
-    return hash.hexdigest()
+    with timed_event("hash") as event:
+        hash = hashlib.sha1()
+        for f in files:
+            append_file_contents_to_hash(hash, f)
+            pass
+        if is_logging_events():
+            event["input_size"] = sum(os.path.getsize(f) for f in files)
+            pass
+        return hash.hexdigest()
 
 
 def get_machine_config_hash():
@@ -45,12 +249,170 @@ def find_on_path(binary):
         return candidate
     return None
 
-def get_build_config_hash(builddir):
-    files = [builddir + "CMakeCache.txt"]
+def get_build_config_files(builddir):
+    files = [os.path.join(builddir, "CMakeCache.txt")]
     alive_tv = find_on_path("alive-tv")
     if None != alive_tv:
         files.append(alive_tv)
-    return sha1_of_files(files)
+    return files
+
+def get_build_config_hash(builddir):
+    return sha1_of_files(get_build_config_files(builddir))
+
+def get_stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+# Tool fingerprints outlive any one corpus (or run), so are kept in a
+# database of their own (see ToolFingerprints), in TRIAGE_FINGERPRINT_DIR if
+# set.
+FINGERPRINT_DIR_ENV = "TRIAGE_FINGERPRINT_DIR"
+
+def get_fingerprint_dir():
+    path = os.environ.get(FINGERPRINT_DIR_ENV)
+    if None == path:
+        cache = os.environ.get("XDG_CACHE_HOME",
+                               os.path.expanduser("~/.cache"))
+        path = os.path.join(cache, "llvm-auto-triage")
+        pass
+    os.makedirs(path, exist_ok=True)
+    return path
+
+# Fingerprints already looked up by this process, by path, along with the
+# stat key they're for.
+tool_fingerprints = {}
+
+# The content hash of the tool binary at path.  A binary is only hashed in
+# full when its stat key (see get_stat_key) isn't one seen before, and the
+# result is remembered across runs (see ToolFingerprints), so after the
+# first run on a build this costs a stat.
+def get_tool_fingerprint(path):
+    path = os.path.realpath(path)
+    key = get_stat_key(path)
+    assert None != key
+    cached = tool_fingerprints.get(path)
+    if None != cached and cached[0] == key:
+        return cached[1]
+    known = ToolFingerprints(get_fingerprint_dir())
+    sha1 = known.lookup(path, key)
+    if None == sha1:
+        sha1 = sha1_of_files([path])
+        known.record(path, key, sha1)
+        pass
+    tool_fingerprints[path] = (key, sha1)
+    return sha1
+
+# Everything about running tests against a build directory which is costly to
+# compute, but rarely changes: the location of each tool, and the machine
+# and build signatures.  Each is computed once, and then reused until a
+# stat of the files it was derived from shows a change.  Use
+# get_run_environment to share one instance per build directory.
+class RunEnvironment:
+    def __init__(self, builddir):
+        self.builddir = os.path.abspath(builddir)
+        self.bindir = self.builddir + "/bin"
+        self.tools = {}
+        self.tools_key = None
+        self.child_environ = None
+        self.child_environ_key = None
+        self.build_files = None
+        self.build_files_key = None
+        self.buildsig = None
+        self.buildsig_key = None
+        pass
+
+    # Tools are found in bindir first, then on PATH.  The results are
+    # reused until something is added to or removed from bindir (which
+    # changes its mtime), or PATH changes.
+    def find_tool(self, cmd):
+        key = (get_stat_key(self.bindir), os.environ['PATH'])
+        if key != self.tools_key:
+            self.tools = {}
+            self.tools_key = key
+            pass
+        if cmd not in self.tools:
+            fullcmd = self.bindir + "/" + cmd
+            if not os.path.exists(fullcmd):
+                fullcmd = find_on_path(cmd)
+                pass
+            self.tools[cmd] = fullcmd
+            pass
+        return self.tools[cmd]
+
+    # The environment for running tools directly, with bindir prepended to
+    # PATH like substitute_runline does.
+    def get_child_environ(self):
+        key = os.environ['PATH']
+        if key != self.child_environ_key:
+            self.child_environ = dict(os.environ)
+            self.child_environ["PATH"] = self.bindir + ":" + key
+            self.child_environ_key = key
+            pass
+        return self.child_environ
+
+    # The machine can't change under a running process, so this is only
+    # ever computed once per process.
+    def get_machine_signature(self):
+        global machine_signature
+        if machine_signature == None:
+            machine_signature = get_machine_config_hash()
+            pass
+        return machine_signature
+
+    # Same as get_build_config_hash, but the files are only rehashed if
+    # they've changed.
+    def get_build_signature(self):
+        if self.build_files_key != os.environ['PATH']:
+            self.build_files = get_build_config_files(self.builddir)
+            self.build_files_key = os.environ['PATH']
+            pass
+        files = self.build_files
+        key = [(f, get_stat_key(f)) for f in files]
+        if key != self.buildsig_key:
+            self.buildsig = sha1_of_files(files)
+            self.buildsig_key = key
+            pass
+        return self.buildsig
+
+    # The tool test's RUN line invokes, and its fingerprint (see
+    # get_tool_fingerprint), or (None, None) if there's no usable RUN line
+    # or the tool can't be found.
+    def get_test_tool(self, test):
+        runline = get_valid_run_line(test)
+        if None == runline:
+            return None, None
+        fullcmd = self.find_tool(runline.split(' ')[0])
+        if None == fullcmd:
+            return None, None
+        return fullcmd, get_tool_fingerprint(fullcmd)
+
+    # The build signature observations of test are recorded under:
+    # get_build_signature, plus the fingerprint of the tool test runs.
+    # CMakeCache.txt doesn't change when a build directory is rebuilt at
+    # another revision, but the tools do.
+    def get_test_build_signature(self, test):
+        buildsig = self.get_build_signature()
+        fullcmd, fingerprint = self.get_test_tool(test)
+        if None == fingerprint:
+            return buildsig
+        hash = hashlib.sha1()
+        hash.update(("%s %s %s" % (buildsig, os.path.basename(fullcmd),
+                                   fingerprint)).encode())
+        return hash.hexdigest()
+    pass
+
+machine_signature = None
+run_environments = {}
+
+def get_run_environment(builddir):
+    builddir = os.path.abspath(builddir)
+    if builddir not in run_environments:
+        run_environments[builddir] = RunEnvironment(builddir)
+        pass
+    return run_environments[builddir]
 
 def substitute_runline(runline, builddir, testsub):
     assert runline != None
@@ -59,12 +421,10 @@ def substitute_runline(runline, builddir, testsub):
     cmd = runline.split(' ')[0]
     # Try to hardcode the run directory - yes, even though we modify PATH
     # just below - to make commands easier to copy.
-    bindir = os.path.abspath(builddir) + "/bin"
-    fullcmd = bindir + "/" + cmd
-    if not os.path.exists(fullcmd):
-        fullcmd = find_on_path(cmd)
-        assert fullcmd != None
-        pass
+    env = get_run_environment(builddir)
+    bindir = env.bindir
+    fullcmd = env.find_tool(cmd)
+    assert fullcmd != None
     runline = fullcmd + runline[len(cmd):]
 
     runline = runline.replace("%s", testsub)
@@ -86,110 +446,747 @@ def get_full_runline(builddir, test, testsub):
     assert runline != None
     return substitute_runline(runline, builddir, testsub)
 
-def run_test(test, builddir):
-    runline = get_full_runline(builddir, test, os.path.abspath(test))
-    print(runline)
-    
-    # todo: catch the timeout exception and return a hash of that too
-    completed = subprocess.run(runline, capture_output=True,
-                               timeout=30, shell=True)
-    #print(completed.returncode.to_bytes(4, byteorder='little'))
-    #print(completed.stdout)
-    #print(completed.stderr)
+# The argv (and file to redirect stdin from, if any) for running a test
+# without a shell.  PATH is the same as the shell would see given
+# substitute_runline's runline.
+DirectCommand = collections.namedtuple("DirectCommand",
+                                       ["argv", "stdin", "env"])
+
+# Perform the same substitutions as substitute_runline, but produce a
+# DirectCommand instead.  Returns None if the RUN line uses anything beyond a
+# plain command with an optional "< %s" style redirect, in which case it
+# needs a real shell.
+def get_direct_command(runline, builddir, testsub):
+    assert runline != None
+    tokens = split_runline(runline)
+    if None == tokens:
+        return None
+    tokens = list(tokens)
+    argv = []
+    stdin = None
+    while 0 != len(tokens):
+        token = tokens.pop(0)
+        if token == "<":
+            if 0 == len(tokens) or None != stdin:
+                return None
+            stdin = tokens.pop(0).replace("%s", testsub)
+            continue
+        # Other redirects, pipes, command lists, subshells, and anything
+        # which needs expanding
+        if token[0] in "<>|&;()" or any(c in token for c in "$`*?[~"):
+            return None
+        argv.append(token.replace("%s", testsub))
+        pass
+    if 0 == len(argv):
+        return None
+    runenv = get_run_environment(builddir)
+    fullcmd = runenv.find_tool(argv[0])
+    assert fullcmd != None
+    argv[0] = fullcmd
+    return DirectCommand(argv, stdin, runenv.get_child_environ())
+
+@functools.lru_cache(maxsize=1024)
+def split_runline(runline):
+    lexer = shlex.shlex(runline, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        return tuple(lexer)
+    except ValueError:
+        return None
+
+ADDR_NO_RANDOMIZE = 0x0040000
+# The personality is per thread, so whether it's been set is too.
+aslr_state = threading.local()
+
+# Disable aslr for all future children of the calling thread, which is what
+# "setarch `uname -m` -R" does for the command it runs.  Setting it on
+# ourselves (rather than in a preexec_fn) keeps process creation cheap.  Our
+# own address space is unaffected until exec.  Note: the personality only
+# applies to the calling thread (and the children it forks), so this must be
+# called from every thread which runs tests.
+def disable_aslr_for_children():
+    if getattr(aslr_state, "disabled", False):
+        return True
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        persona = libc.personality(0xffffffff)
+        if persona == -1:
+            return False
+        if -1 == libc.personality(persona | ADDR_NO_RANDOMIZE):
+            return False
+    except (OSError, AttributeError):
+        return False
+    aslr_state.disabled = True
+    return True
+
+# When a command run through /bin/sh is killed by a signal, the shell
+# reports that as 128+signal, and (for dash, which is what /bin/sh is on
+# the Debian/Ubuntu boxes we run on) prints the signal description to
+# stderr.  Do the same for direct runs so that output signatures don't
+# depend on the runner used.
+#
+# If stderr is a file rather than captured, the message is appended to the
+# file instead.
+def make_shell_compatible(completed, stderr=None):
+    if completed.returncode >= 0:
+        return completed
+    sig = -completed.returncode
+    completed.returncode = 128 + sig
+    if sig not in [signal.SIGINT, signal.SIGPIPE]:
+        description = signal.strsignal(sig) or ("Signal %d" % sig)
+        message = (description + "\n").encode()
+        if None != stderr:
+            # The child shared our file offset, so seek to find where it
+            # left off.
+            stderr.seek(0, os.SEEK_END)
+            stderr.write(message)
+            stderr.flush()
+        else:
+            completed.stderr += message
+            pass
+        pass
     return completed
-    
 
-def run_and_form_record(revision, builddir, test):
-    machinesig = get_machine_config_hash()
-    testsig = sha1_of_files([test])
-    buildsig = get_build_config_hash(builddir)
+# Like subprocess.run(capture_output=True, timeout=timeout), but without the
+# polling subprocess uses to implement a timeout on wait, which costs about
+# a millisecond per run.  Instead, a timer kills the process if it's still
+# running when the timeout expires.  If stdout and stderr are given (as
+# files), output goes straight there instead of being captured.
+#
+# The command is run in a process group of its own, and the whole group is
+# killed on timeout.  Otherwise, killing e.g. a shell or script would leave
+# the opt or clang it started running.
+def run_with_kill_timer(argv, timeout, stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE, **kwargs):
+    timed_out = []
+    out = None
+    err = None
+    with subprocess.Popen(argv, stdout=stdout, stderr=stderr,
+                          process_group=0, **kwargs) as proc:
+        def on_timeout():
+            timed_out.append(True)
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            pass
+        timer = threading.Timer(timeout, on_timeout)
+        timer.start()
+        try:
+            if stdout == subprocess.PIPE:
+                out, err = proc.communicate()
+            else:
+                proc.wait()
+                pass
+        finally:
+            timer.cancel()
+            pass
+        pass
+    if 0 != len(timed_out):
+        raise subprocess.TimeoutExpired(argv, timeout, out, err)
+    return subprocess.CompletedProcess(argv, proc.returncode, out, err)
+
+# Run a shell command line (e.g. a reducer) with a timeout, killing
+# everything it started if the timeout expires.  Otherwise like
+# subprocess.run(cmd, shell=True, ...).
+def run_tool(cmd, timeout, check=False, capture_output=True, **kwargs):
+    if capture_output:
+        completed = run_with_kill_timer(cmd, timeout, shell=True, **kwargs)
+    else:
+        completed = run_with_kill_timer(cmd, timeout, None, None, shell=True,
+                                        **kwargs)
+        pass
+    if check:
+        completed.check_returncode()
+        pass
+    return completed
 
-    completed = run_test(test, builddir)
-    #print (completed)
+def run_direct(command, timeout, stdout=subprocess.PIPE,
+               stderr=subprocess.PIPE):
+    stdin = None
+    try:
+        if None != command.stdin:
+            stdin = open_test_stdin(command.stdin)
+            pass
+        completed = run_with_kill_timer(command.argv, timeout, stdout,
+                                        stderr, stdin=stdin, env=command.env)
+    finally:
+        if None != stdin:
+            stdin.close()
+            pass
+        pass
+    if stderr == subprocess.PIPE:
+        return make_shell_compatible(completed)
+    return make_shell_compatible(completed, stderr)
+
+# How run_test executes tests.  "direct" execs the tool itself when the RUN
+# line allows it (falling back to "shell" otherwise), which avoids spawning
+# a shell, uname and setarch for every run.
+default_runner = "direct"
+
+# Yields the runline (for display) and, if the test can be run directly,
+# the DirectCommand for it.  A compressed test is streamed to the tool if
+# it's only read as stdin (see open_test_stdin), and otherwise decompressed
+# to a temporary file for the duration.
+@contextlib.contextmanager
+def prepared_test(test, builddir, runner):
+    if runner == None:
+        runner = default_runner
+        pass
+    testsub = os.path.abspath(test)
+    plain_runline = get_valid_run_line(test)
+    assert plain_runline != None
+    command = None
+    if runner == "direct" and disable_aslr_for_children():
+        command = get_direct_command(plain_runline, builddir, testsub)
+        pass
+    with contextlib.ExitStack() as stack:
+        if is_compressed_test(test) and (
+                None == command or any(testsub in arg for arg in command.argv)):
+            workingdir = stack.enter_context(tempfile.TemporaryDirectory())
+            testsub = get_plain_test(testsub, workingdir)
+            if None != command:
+                command = get_direct_command(plain_runline, builddir, testsub)
+                pass
+            pass
+        # Note: this is printed even for direct runs as it's the easiest form
+        # to copy and paste.
+        runline = substitute_runline(plain_runline, builddir, testsub)
+        print(runline)
+        yield runline, command
+        pass
+    pass
+
+# Default limit on how long one run of a test may take, in seconds.  See
+# get_test_timeout for how this is adjusted per test.
+DEFAULT_TIMEOUT = 30
+
+# The fields of a run_test event (see events.py) known before the run.
+def get_run_event_fields(test, command):
+    fields = {"test": test, "ext": get_test_ext(test), "runner": "shell"}
+    if None != command:
+        fields["runner"] = "direct"
+        pass
+    if is_logging_events():
+        fields["input_size"] = get_test_size(test)
+        pass
+    return fields
+
+def note_run_outcome(event, returncode, output_size):
+    event["returncode"] = returncode
+    event["output_size"] = output_size
+    if None == returncode:
+        event["outcome"] = "timeout"
+    else:
+        event["outcome"] = outcome_for_returncode(returncode)
+        pass
+    pass
+
+# Note: raises subprocess.TimeoutExpired if the test times out.
+def run_test(test, builddir, runner=None, timeout=DEFAULT_TIMEOUT):
+    with prepared_test(test, builddir, runner) as (runline, command), \
+         timed_event("run_test",
+                     **get_run_event_fields(test, command)) as event:
+        try:
+            if None != command:
+                completed = run_direct(command, timeout)
+            else:
+                completed = run_with_kill_timer(runline, timeout, shell=True)
+                pass
+        except subprocess.TimeoutExpired:
+            note_run_outcome(event, None, 0)
+            raise
+        #print(completed.returncode.to_bytes(4, byteorder='little'))
+        #print(completed.stdout)
+        #print(completed.stderr)
+        note_run_outcome(event, completed.returncode,
+                         len(completed.stdout) + len(completed.stderr))
+        return completed
+
+# How much of the end of stderr run_test_hashed keeps.  That's where the
+# assertion message and stack trace are.
+STDERR_TAIL_SIZE = 64 * 1024
+
+# The result of run_test_hashed.  outputsig is exactly what
+# get_output_signature would give for the equivalent run_test result.  If
+# the test timed out, returncode is None, and outputsig is TIMEOUT_SIGNATURE.
+RunResult = collections.namedtuple("RunResult",
+                                   ["returncode", "outputsig", "stdout_size",
+                                    "stderr_size", "stderr_tail"])
+
+# Any partial output from a test which timed out is not meaningful, so all
+# timeouts share one signature.
+TIMEOUT_SIGNATURE = hashlib.sha1(b"timeout").hexdigest()
+
+# Did the test fail (as opposed to pass, or time out)?
+def is_failure(result):
+    return result.returncode != None and result.returncode != 0
+
+def hash_open_file(hash, f):
+    f.seek(0)
+    size = 0
+    while chunk := f.read(65536):
+        hash.update(chunk)
+        size += len(chunk)
+        pass
+    return size
+
+def read_tail(f, size, tail_size):
+    f.seek(max(0, size - tail_size))
+    return f.read()
+
+# Like run_test, but never holds the test's output in memory.  The output
+# signature hashes the return code first, and that's only known once the
+# test has finished, so stdout and stderr go directly to (unlinked)
+# temporary files, and are hashed from there in bounded size chunks.  Only
+# the last STDERR_TAIL_SIZE bytes of stderr are kept.
+def run_test_hashed(test, builddir, runner=None, timeout=DEFAULT_TIMEOUT):
+    with prepared_test(test, builddir, runner) as (runline, command), \
+         timed_event("run_test",
+                     **get_run_event_fields(test, command)) as event, \
+         tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        try:
+            if None != command:
+                completed = run_direct(command, timeout, out, err)
+            else:
+                completed = run_with_kill_timer(runline, timeout, out, err,
+                                                shell=True)
+                pass
+        except subprocess.TimeoutExpired:
+            print("Timed out after %.1fs: %s" % (timeout, test))
+            note_run_outcome(event, None, 0)
+            return RunResult(None, TIMEOUT_SIGNATURE, 0, 0, b"")
+        hash = hashlib.sha1()
+        hash.update(completed.returncode.to_bytes(4, byteorder='little'))
+        stdout_size = hash_open_file(hash, out)
+        stderr_size = hash_open_file(hash, err)
+        stderr_tail = read_tail(err, stderr_size, STDERR_TAIL_SIZE)
+        note_run_outcome(event, completed.returncode,
+                         stdout_size + stderr_size)
+        pass
+    return RunResult(completed.returncode, hash.hexdigest(), stdout_size,
+                     stderr_size, stderr_tail)
+
+def get_output_signature(completed):
     hash = hashlib.sha1()
     hash.update(completed.returncode.to_bytes(4, byteorder='little'))
     hash.update(completed.stdout)
     hash.update(completed.stderr)
-    outputsig = hash.hexdigest()
+    return hash.hexdigest()
 
-    return ["+1", revision, testsig, outputsig, buildsig, machinesig]
+# How many stack frames (after dropping the crash handling ones) are part of
+# a crash signature.
+CRASH_SIGNATURE_FRAMES = 5
+
+# Frames from the crash handling machinery itself, which say nothing about
+# where the crash was.
+crash_handler_frames = ["llvm::sys::PrintStackTrace",
+                        "llvm::sys::RunSignalHandlers",
+                        "llvm::sys::CleanupOnSignal",
+                        "SignalHandler",
+                        "__restore_rt",
+                        "raise",
+                        "gsignal",
+                        "__GI_raise",
+                        "abort",
+                        "__GI_abort",
+                        "pthread_kill",
+                        "__pthread_kill_implementation",
+                        "__assert_fail",
+                        "__assert_fail_base",
+                        "llvm::llvm_unreachable_internal",
+                        "llvm::report_fatal_error",
+                        ]
+
+frame_re = re.compile(r"^\s*#\d+\s+0x[0-9a-fA-F]+\s+(?:in\s+)?(.*)$")
+# A trailing "(/path/to/binary+0x1234)" or "/path/to/file.cpp:12:3"
+frame_module_re = re.compile(r"\s*\([^()]*\+0x[0-9a-fA-F]+\)$")
+frame_location_re = re.compile(r"\s+\S+:\d+(:\d+)?$")
+assertion_re = re.compile(r"Assertion `(.*)' failed")
+fatal_error_re = re.compile(r"LLVM ERROR: (.*)$")
+unreachable_re = re.compile(r"UNREACHABLE executed at (?:.*/)?([^/:]+):\d+")
+hex_re = re.compile(r"0x[0-9a-fA-F]+")
+
+# Normalize the frame text of one line of an LLVM (or sanitizer) stack trace
+# by dropping the frame number, addresses, offsets and source locations,
+# none of which are stable across builds (or, without ASLR disabled, runs).
+# Returns None if the line isn't a frame, or the frame has no symbol.
+def normalize_stack_frame(line):
+    m = frame_re.match(line)
+    if None == m:
+        return None
+    frame = frame_module_re.sub("", m.group(1).strip())
+    frame = frame_location_re.sub("", frame).strip()
+    if frame == "" or frame.startswith("("):
+        return None
+    return frame
+
+# Extract a crash signature from (the tail of) a failing test's stderr: the
+# assertion or fatal error message, plus the top CRASH_SIGNATURE_FRAMES
+# normalized stack frames.  Failures with the same signature are (very
+# likely) the same bug.  Returns None if there's nothing crash like in the
+# output.
+def get_crash_signature(stderr):
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors="replace")
+        pass
+    parts = []
+    frames = []
+    for line in stderr.splitlines():
+        m = assertion_re.search(line)
+        if None != m:
+            parts.append("assert: " + m.group(1))
+            continue
+        m = fatal_error_re.search(line)
+        if None != m:
+            parts.append("error: " + hex_re.sub("0x?", m.group(1)))
+            continue
+        m = unreachable_re.search(line)
+        if None != m:
+            parts.append("unreachable: " + m.group(1))
+            continue
+        frame = normalize_stack_frame(line)
+        if None == frame or len(frames) >= CRASH_SIGNATURE_FRAMES:
+            continue
+        name = frame.split("(")[0]
+        if name in crash_handler_frames:
+            continue
+        frames.append(frame)
+        pass
+    if 0 == len(parts) and 0 == len(frames):
+        return None
+    return hashlib.sha1("\n".join(parts + frames).encode()).hexdigest()
+
+# Bounds, and the multiple of the 95th percentile of past runtimes, for
+# get_test_timeout.
+MIN_TIMEOUT = 5
+MAX_TIMEOUT = 300
+TIMEOUT_RUNTIME_MULTIPLE = 4
+MIN_TIMEOUT_SAMPLES = 3
+
+# Pick the timeout for a test from how long it has taken to complete in the
+# past.  Tests we know are fast fail fast if they hang, and tests which are
+# known to be slow (but do complete) get enough time to do so.  Without
+# enough history, use DEFAULT_TIMEOUT.
+#
+# Note: this uses the runs on every build.  A test which completes isn't run
+# again on the same build (see observe_test), so there's only ever one such
+# run per build to go on.
+def get_test_timeout(store, testsig):
+    runtimes = store.get_runtimes(testsig)
+    if len(runtimes) < MIN_TIMEOUT_SAMPLES:
+        return DEFAULT_TIMEOUT
+    runtimes.sort()
+    p95 = runtimes[min(len(runtimes) - 1, int(0.95 * len(runtimes)))]
+    timeout = p95 * TIMEOUT_RUNTIME_MULTIPLE
+    return min(MAX_TIMEOUT, max(MIN_TIMEOUT, timeout))
+
+# Run the test and return an Observation describing the run.  If a store is
+# given, a previous observation of the same test on the same build and
+# machine is returned instead of running the test again, and new runs are
+# recorded in it.  A previous timeout is only kept as long as the test
+# wouldn't now be given any longer to run.
+def observe_test(builddir, test, store=None, revision=None):
+    env = get_run_environment(builddir)
+    machinesig = env.get_machine_signature()
+    testsig = sha1_of_files([test])
+    buildsig = env.get_test_build_signature(test)
+
+    timeout = DEFAULT_TIMEOUT
+    if store != None:
+        timeout = get_test_timeout(store, testsig)
+        obs = store.lookup(testsig, buildsig, machinesig)
+        if obs != None and (obs.outcome != "timeout" or
+                            obs.runtime >= timeout):
+            print("Using known outcome (%s) of %s" % (obs.outcome, test))
+            return obs._replace(revision=revision)
+        if obs != None:
+            print("Rerunning %s, which timed out after %.1fs, with a %.1fs "
+                  "timeout" % (test, obs.runtime, timeout))
+            pass
+        pass
+
+    start = time.monotonic()
+    result = run_test_hashed(test, builddir, timeout=timeout)
+    runtime = time.monotonic() - start
+
+    crashsig = None
+    if result.returncode == None:
+        outcome = "timeout"
+    else:
+        outcome = outcome_for_returncode(result.returncode)
+        if outcome == "fail":
+            crashsig = get_crash_signature(result.stderr_tail)
+            pass
+        pass
+    obs = Observation(revision, testsig, result.outputsig, buildsig,
+                      machinesig, outcome, result.returncode, runtime,
+                      crashsig, env.get_build_signature())
+    if store != None:
+        store.record(obs)
+        pass
+    return obs
+
+# The observation log record for obs, a run of test on builddir.  The
+# record ends with the fingerprint of the tool the test ran (see
+# get_tool_fingerprint), or "-" if there was none.
+def form_record(obs, builddir, test):
+    _, toolsig = get_run_environment(builddir).get_test_tool(test)
+    return ["+1", obs.revision, obs.testsig, obs.outputsig, obs.buildsig,
+            obs.machinesig, toolsig or "-"]
+
+def run_and_form_record(revision, builddir, test, store=None):
+    obs = observe_test(builddir, test, store, revision)
+    return form_record(obs, builddir, test)
 
 def get_comment_prefix(test):
-    if test.endswith(".ll"):
+    ext = get_test_ext(test)
+    if ext == ".ll":
         return ";"
-    for ext in [".c", ".cc", ".cpp", ".cxx"]:
-        if test.endswith(ext):
-            return "//"
-    if test.endswith(".s"):
+    if ext in [".c", ".cc", ".cpp", ".cxx"]:
+        return "//"
+    if ext == ".s":
         return "#"
     return None
 
-def get_runline_prefix(test):
+# Parsed test headers (see testheader.py) by path, along with the stat key
+# of the file they were parsed from.  Rewrites replace the file (see
+# rewrite_file), which changes the key, so a stale entry is never used.
+test_headers = {}
+MAX_CACHED_TEST_HEADERS = 4096
+
+def cache_test_header(test, key, header):
+    if len(test_headers) >= MAX_CACHED_TEST_HEADERS:
+        test_headers.clear()
+        pass
+    test_headers[test] = (key, header)
+    pass
+
+# The TestHeader of test, or None if it isn't a kind of test we know.
+def get_test_header(test):
     comment_prefix = get_comment_prefix(test)
     if None == comment_prefix:
         return None
-    return comment_prefix + " RUN:"
+    key = get_stat_key(test)
+    cached = test_headers.get(test)
+    if None != cached and cached[0] == key:
+        return cached[1]
+    with open_test(test, 'r') as f:
+        header = parse_header(f, comment_prefix)
+        pass
+    cache_test_header(test, key, header)
+    return header
+
+# Given the first RUN command in test (or None), return the command to run,
+# or None if there's no usable RUN line.
+def normalize_run_line(test, runline, verbose=False):
+    if runline == None:
+        if verbose:
+            print ("No runtime found in test %s" % test)
+            pass
+        return None
+    # For ease, allow a normal filechecked test, and just drop the
+    # irrelevant bits
+    runline = runline.split("|")[0].strip()
+    if "%s" not in runline:
+        if verbose:
+            print ("No %%s found in runline for %s" % test)
+            pass
+        return None
+    return runline
 
 def get_valid_run_line(test, verbose=False):
-    run_prefix = get_runline_prefix(test)
-    if None == run_prefix:
+    header = get_test_header(test)
+    if None == header:
         return None
-    with open(test,'r') as f:
-        runline = None;
-        for line in f.readlines():
-            line = line.strip()
-            if line.startswith(run_prefix):
-                runline = line
-                break;
+    runline = None
+    if 0 != len(header.runs):
+        runline = header.runs[0]
+        pass
+    return normalize_run_line(test, runline, verbose)
+
+# The lines of a test as str, read a line at a time.
+def read_test_lines(path):
+    with open_test(path) as f:
+        for line in f:
+            yield line.decode(errors="replace")
             pass
-        if runline == None:
-            if verbose:
-                print ("No runtime found in test %s" % test)
+        pass
+    pass
+
+# Read the test, and produce a CorpusEntry describing it.  IR is read a
+# second time for its canonical hash (see canonical_ir.py), but neither read
+# keeps the whole test in memory.
+def parse_corpus_file(path, st):
+    comment_prefix = get_comment_prefix(path)
+    hash = hashlib.sha1()
+    size = 0
+    header = None
+    if None != comment_prefix:
+        header = HeaderParser(comment_prefix)
+        pass
+    ir_scan = None
+    if get_test_ext(path) == ".ll":
+        ir_scan = IRScan()
+        pass
+    with open_test(path) as f:
+        for line in f:
+            hash.update(line)
+            size += len(line)
+            if None != ir_scan:
+                ir_scan.feed(line.decode(errors="replace"))
                 pass
-            return None
-        # For ease, allow a normal filechecked test, and just drop the
-        # irrelevant bits
-        runline = runline.split("|")[0]
-        # drop the RUN prefix
-        runline = runline[len(run_prefix):].strip()
-        if "%s" not in runline:
-            if verbose:
-                print ("No %\s found in runline for %s" % test)
+            if None != header and not header.done:
+                header.feed(line.decode(errors="replace"))
                 pass
-            return None
-        return runline
+            pass
+        pass
+    runline = None
+    if None != header:
+        header = header.result()
+        cache_test_header(path, (st.st_ino, st.st_size, st.st_mtime_ns),
+                          header)
+        if 0 != len(header.runs):
+            runline = header.runs[0]
+            pass
+        runline = normalize_run_line(path, runline)
+        pass
+    if is_compressed_test(path):
+        cache_test_size(path, (st.st_ino, st.st_size, st.st_mtime_ns), size)
+        pass
+    canonical_sha1 = hash.hexdigest()
+    if None != ir_scan:
+        canonical_sha1 = ir_scan.hexdigest(read_test_lines(path))
+        pass
+    return CorpusEntry(path, st.st_size, st.st_mtime_ns, hash.hexdigest(),
+                       runline, canonical_sha1, size)
+
+# The hash used to recognize equivalent tests (see canonical_ir.py), which
+# for anything but IR is simply the content hash.
+def get_canonical_hash(path):
+    if get_test_ext(path) != ".ll":
+        return sha1_of_files([path])
+    return scan_ir(read_test_lines(path)).hexdigest(read_test_lines(path))
+
+def index_corpus_file(index, path):
+    entry = parse_corpus_file(path, os.stat(path))
+    index.update(entry)
+    return entry
+
+# Bring the corpus index up to date with the contents of root, only reading
+# files which are new or have changed since the last refresh.  With
+# trust_dir_mtimes, directories whose mtime hasn't changed are not listed at
+# all, and files already in the index are not stat-ed.  That's safe for the
+# content addressed files the reducers add (which are never modified in
+# place), and makes a rescan after a reduction proportional to the number
+# of new files.
+def refresh_corpus_index(index, root, trust_dir_mtimes=False):
+    with timed_event("scan", root=root, trusted=trust_dir_mtimes) as event:
+        parsed = refresh_corpus_index_impl(index, root, trust_dir_mtimes)
+        event["parsed"] = parsed
+        pass
     pass
 
+# Returns the number of files (re)parsed.
+def refresh_corpus_index_impl(index, root, trust_dir_mtimes):
+    parsed = 0
+    known = index.load_stats()
+    dir_mtimes = index.load_dir_mtimes()
+    listed = set()
+    seen = set()
+    stack = [os.path.abspath(root)]
+    while 0 != len(stack):
+        dirpath = stack.pop()
+        try:
+            dir_mtime = os.stat(dirpath).st_mtime_ns
+        except FileNotFoundError:
+            index.remove_dir(dirpath)
+            continue
+        if trust_dir_mtimes and dir_mtimes.get(dirpath) == dir_mtime:
+            # Nothing added or removed here, but subdirectories may
+            # still have changed.
+            stack.extend(index.load_subdirs(dirpath))
+            continue
+        listed.add(dirpath)
+        subdirs = []
+        with os.scandir(dirpath) as it:
+            for dentry in it:
+                # Skip the in-flight files from add_candidate_to_corpus
+                # (and anything else hidden) just like glob does.
+                if dentry.name.startswith('.'):
+                    continue
+                if dentry.is_dir():
+                    subdirs.append(dentry.path)
+                    continue
+                path = dentry.path
+                # Only tests are indexed, not e.g. reductions.log
+                if None == get_comment_prefix(path):
+                    continue
+                seen.add(path)
+                if trust_dir_mtimes and path in known:
+                    continue
+                st = dentry.stat()
+                if known.get(path) == (st.st_size, st.st_mtime_ns):
+                    continue
+                index.update(parse_corpus_file(path, st))
+                parsed += 1
+                pass
+            pass
+        index.set_dir(dirpath, dir_mtime, subdirs)
+        stack.extend(subdirs)
+        pass
+    for path in known:
+        if os.path.dirname(path) in listed and path not in seen:
+            index.remove(path)
+            pass
+        pass
+    return parsed
+
+def get_corpus_index(corpusdir):
+    return CorpusIndex(corpusdir)
+
 def add_candidate_to_corpus(corpusdir, cand, verbose = False):
     runline = get_valid_run_line(cand)
     assert runline != None
 
     hash = sha1_of_files([cand])
-    ext = os.path.splitext(cand)[1]
+    ext = get_test_ext(cand)
     fname = corpusdir + "/%s%s" % (hash, ext)
-    if os.path.exists(fname):
+    # The same content may already be there, stored either way
+    for suffix in [""] + list(compressors):
+        if os.path.exists(fname + suffix):
+            if verbose:
+                print("%s already in corpus" % (fname + suffix))
+                pass
+            return None
+        pass
+    # Nor do we want a test which differs from one already there only in
+    # e.g. the names of types or values, as reducing it again is just as
+    # likely to rename things again, and so on.
+    index = get_corpus_index(corpusdir)
+    equivalent = index.lookup_equivalent(get_canonical_hash(cand))
+    if None != equivalent:
         if verbose:
-            print("%s already in corpus" % fname)
+            print("Equivalent of %s already in corpus" % equivalent.path)
             pass
         return None
+    fname += get_storage_suffix(get_test_size(cand))
     if verbose:
         print("Added %s to corpus" % fname)
         pass
-    shutil.copy(cand, fname)
+    # Several reducers may be running in parallel (see manage-corpus.py -j),
+    # and may produce the same candidate.  Copy to a private name first, and
+    # then atomically rename so that no one ever observes a partial file.
+    suffix = get_compression_suffix(fname)
+    fd, tmpname = tempfile.mkstemp(dir=corpusdir, prefix=".candidate-",
+                                   suffix=suffix)
+    os.close(fd)
+    write_test(cand, tmpname)
+    shutil.copymode(cand, tmpname)
+    os.replace(tmpname, fname)
+    index_corpus_file(index, os.path.abspath(fname))
     return fname
 
-
-@contextlib.contextmanager
-def scoped_cd(newdir):
-    prevdir = os.getcwd()
-    os.chdir(newdir)
-    try:
-        yield
-    finally:
-        os.chdir(prevdir)
-        pass
-    return
-
 def make_exec(fname):
     old = os.stat(fname)
     os.chmod(fname, old.st_mode | stat.S_IEXEC)
@@ -198,56 +1195,38 @@ def make_exec(fname):
 # Given a .ll candidate test, remove the source_filename and ModuleID lines,
 # then prepend the specified comments (which are expected to have e.g. RUN line)
 def rewrite_candidate(comments, fname):
-    lines = []
-    for line in comments:
-        lines.append(line)
-        pass
-    with open(fname, 'r') as original:
-        for line in original.readlines():
+    def transform(original):
+        for line in comments:
+            yield line
+            pass
+        for line in original:
             if not line.startswith("source_filename") and not line.startswith("; ModuleID"):
-                lines.append(line)
+                yield line
                 pass
             pass
         pass
-    
-    with open(fname, 'w') as modified:
-        modified.write("".join(lines))
-        pass
+    rewrite_file(fname, transform)
     pass
 
+# Replace the RUN line(s) in the header of fname with new_runline.
 def replace_runline(new_runline, fname):
-    lines = []
-    run_prefix = get_runline_prefix(fname)
-    with open(fname, 'r') as original:
-        for line in original.readlines():
-            if line.startswith(run_prefix):
-                lines.append(new_runline)
-                continue
-            lines.append(line)
-            pass
-        pass
-    
-    with open(fname, 'w') as modified:
-        modified.write("".join(lines))
-        pass
+    comment_prefix = get_comment_prefix(fname)
+    rewrite_file(fname, lambda original: replace_header_runs(
+        original, comment_prefix, new_runline))
     pass
 
 
-# Given an .ll test file, read all the user comment lines and return them
+# Given an .ll test file, read the user comment lines in its header and
+# return them
 def read_comment_lines(fname):
     lines = []
-    comment_prefix = get_comment_prefix(fname)
-    with open(fname, 'r') as f:
-        for line in f.readlines():
-            if not line.strip().startswith(comment_prefix):
-                continue
-            # strip comments introduced by IR printer itself
-            if line.strip().startswith("; Function Attrs"):
-                continue
-            if line.strip().startswith("; ModuleID"):
-                continue
-            lines.append(line)
-            pass
+    for line in get_test_header(fname).comments:
+        # strip comments introduced by IR printer itself
+        if line.strip().startswith("; Function Attrs"):
+            continue
+        if line.strip().startswith("; ModuleID"):
+            continue
+        lines.append(line)
         pass
     return lines
 
@@ -260,17 +1239,121 @@ def log_reduction(corpusdir, toolname, test, to):
         pass
     pass
 
+def read_reduction_log(corpusdir):
+    logfile = corpusdir + "/reductions.log"
+    if not os.path.exists(logfile):
+        return []
+    entries = []
+    with open(logfile, 'r') as f:
+        for line in f:
+            entries.append(json.loads(line))
+            pass
+        pass
+    return entries
+
+# Reduction log entries are tagged by the reducer, and the technique used.
+# Map a tag back to the reducer's name (see reducer_names).
+def get_reducer_name_for_tag(toolname):
+    if toolname.startswith("clang-to-llc"):
+        return "clang-to-opt"
+    for name in reducer_names.values():
+        if toolname.startswith(name + "-"):
+            return name
+        pass
+    return None
+
+# For each (reducer name, test file extension), how many new corpus entries
+# the reduction log says it has produced.
+def load_reduction_counts(corpusdir):
+    counts = {}
+    for toolname, test, to in read_reduction_log(corpusdir):
+        key = (get_reducer_name_for_tag(toolname), get_test_ext(test))
+        counts[key] = counts.get(key, 0) + 1
+        pass
+    return counts
+
+# For each test file extension, the average number of new corpus entries
+# produced per test which reductions have produced anything from.
+def load_reduction_yields(corpusdir):
+    outputs = {}
+    sources = {}
+    for toolname, test, to in read_reduction_log(corpusdir):
+        ext = get_test_ext(test)
+        outputs[ext] = outputs.get(ext, 0) + 1
+        sources.setdefault(ext, set()).add(test)
+        pass
+    return dict((ext, outputs[ext] / len(sources[ext])) for ext in outputs)
+
+# What came of running a reducer on a test.  outcome is one of:
+#   new - produced outputs, at least one of which is new to the corpus
+#   duplicate - produced outputs, but all were already in the corpus
+#   no-progress - ran, but nothing reproducing came of it
+#   no-crash - the test didn't fail to begin with
+#   unsupported - the reducer can't handle this test (e.g. its RUN line)
+#   failed - the reducer itself failed
+#   timeout - the reducer timed out
+# outputs holds the content hashes of the outputs, and output_size is the
+# size of the smallest of them (or None).
+ReducerResult = collections.namedtuple("ReducerResult",
+                                       ["outcome", "outputs", "output_size"])
+
+def no_reduction(outcome):
+    return ReducerResult(outcome, [], None)
+
+# Add a reducer's candidate to the corpus (logging the reduction if it's new)
+# and return the ReducerResult for it.
+def finish_reduction(corpusdir, reducertag, test, candidate):
+    outputsig = sha1_of_files([candidate])
+    size = os.path.getsize(candidate)
+    res = add_candidate_to_corpus(corpusdir, candidate, True)
+    if None == res:
+        return ReducerResult("duplicate", [outputsig], size)
+    log_reduction(corpusdir, reducertag, test, res)
+    return ReducerResult("new", [outputsig], size)
+
+# Combine the results of several candidates from one reducer run.
+def merge_reductions(results):
+    outputs = []
+    sizes = []
+    for result in results:
+        outputs += result.outputs
+        if None != result.output_size:
+            sizes.append(result.output_size)
+            pass
+        pass
+    if 0 == len(outputs):
+        return no_reduction("no-progress")
+    outcome = "duplicate"
+    if any(result.outcome == "new" for result in results):
+        outcome = "new"
+        pass
+    return ReducerResult(outcome, outputs, min(sizes))
+
+# The most job tokens (see jobserver.py) a reducer takes beyond its own.
+MAX_EXTRA_JOB_TOKENS = max((os.cpu_count() or 1) - 1, 0)
+
+# Does the tool's --help-hidden output list option?
+@functools.lru_cache(maxsize=None)
+def tool_has_option(tool, option):
+    try:
+        completed = run_tool(shlex.quote(tool) + " --help-hidden", 20)
+    except subprocess.TimeoutExpired:
+        return False
+    pattern = r"^\s*%s\b" % re.escape(option)
+    return None != re.search(pattern, completed.stdout.decode(errors="replace"),
+                             re.MULTILINE)
+
 def reduce_with_bugpoint(builddir, corpusdir, test):
-    assert test.endswith(".ll")
-    with tempfile.TemporaryDirectory() as workingdir, scoped_cd(workingdir):
+    assert get_test_ext(test) == ".ll"
+    with tempfile.TemporaryDirectory() as workingdir:
         print("Running bugpoint in %s" % workingdir)
         runline = get_valid_run_line(test)
         assert runline != None
         if not runline.startswith("opt"):
             print("Can't (yet?) reduce with bugpoint")
-            return
+            return no_reduction("unsupported")
         runline = builddir + "/bin/bugpoint" + runline[3:]
-        runline = runline.replace("< %s", test)
+        runline = runline.replace("< %s", get_plain_test(test, workingdir))
         # message the arguments so that a standard opt runline will cause
         # bugpoint to reduce the opt crash
         runline = runline.replace("-S", "")
@@ -282,16 +1365,28 @@ def reduce_with_bugpoint(builddir, corpusdir, test):
         runline = "setarch `uname -m` -R " + runline
         
         print(runline)
-        subprocess.run(runline, capture_output=True,
-                       timeout=60*5, shell=True, check=True)
+        try:
+            run_tool(runline, 60*5, check=True, cwd=workingdir)
+        except subprocess.CalledProcessError:
+            # Most often, bugpoint couldn't make sense of the runline.
+            print ("bugpoint failed, unable to reduce %s" % test)
+            return no_reduction("failed")
+        except subprocess.TimeoutExpired:
+            print ("bugpoint timed out on %s" % test)
+            return no_reduction("timeout")
 
         # Now that we've run bugpoint, convert the simplified output into
         # a standalone test case.
+        candidate = os.path.join(workingdir, "candidate.ll")
         cmd = builddir + "/bin/opt -S bugpoint-reduced-simplified.bc -o candidate.ll"
-        subprocess.run(cmd, timeout=30, shell=True)
+        try:
+            run_tool(cmd, 30, capture_output=False, cwd=workingdir)
+        except subprocess.TimeoutExpired:
+            print ("opt -S timed out on bugpoint's output for %s" % test)
+            return no_reduction("timeout")
 
         comments = read_comment_lines(test)
-        rewrite_candidate(comments, "candidate.ll")
+        rewrite_candidate(comments, candidate)
 
         # Note: We treat reduction as somewhat of a canonicalization step.  That
         # is, we always add the "reduced" output to the corpus even if we don't
@@ -300,17 +1395,13 @@ def reduce_with_bugpoint(builddir, corpusdir, test):
         # will cause this routine to eventually be invoked on the reduced
         # result.
 
-        res = add_candidate_to_corpus(corpusdir, "candidate.ll", True)
-        if None != res:
-            log_reduction(corpusdir, "bugpoint-crash-unconstrained", test, res)
-            pass
-        pass
-    return
+        return finish_reduction(corpusdir, "bugpoint-crash-unconstrained",
+                                test, candidate)
 
 
 def reduce_with_llvm_reduce(builddir, corpusdir, test):
-    assert test.endswith(".ll")
-    with tempfile.TemporaryDirectory() as workingdir, scoped_cd(workingdir):
+    assert get_test_ext(test) == ".ll"
+    with tempfile.TemporaryDirectory() as workingdir:
         print("Running llvm-reduce in %s" % workingdir)
         runline = get_valid_run_line(test)
         assert runline != None
@@ -320,7 +1411,8 @@ def reduce_with_llvm_reduce(builddir, corpusdir, test):
         # ~/llvm-dev/build/bin/opt -early-cse -S $@ && exit -1 || exit 0
         runline = get_full_runline(builddir, test, "$@")
         runline += " && exit -1 || exit 0"
-        with open("interestingness.sh", "w") as f:
+        script = os.path.join(workingdir, "interestingness.sh")
+        with open(script, "w") as f:
             # The first line is not optional, llvm-reduce fails with an
             # unhelpful message if left out.
             f.write("#!/bin/bash\n")
@@ -328,29 +1420,44 @@ def reduce_with_llvm_reduce(builddir, corpusdir, test):
             f.write(runline + "\n")
             pass
 
-        make_exec("interestingness.sh")
+        make_exec(script)
         
-        runline = "%s/bin/llvm-reduce -test=./interestingness.sh %s" % (builddir, test)
+        tool = "%s/bin/llvm-reduce" % builddir
+        runline = "%s -test=./interestingness.sh %s" % (
+            tool, get_plain_test(test, workingdir))
         
-        print(runline)
-
+        # Use as many threads as there are cores free in the job budget
+        # (if this llvm-reduce is new enough to support it).
+        limit = 0
+        if tool_has_option(tool, "-j"):
+            limit = MAX_EXTRA_JOB_TOKENS
+            pass
         try:
-            subprocess.run(runline, capture_output=True,
-                           timeout=60*5, shell=True, check=True)
+            with extra_job_tokens(limit) as extra:
+                if 0 != extra:
+                    runline += " -j=%d" % (1 + extra)
+                    pass
+                print(runline)
+                run_tool(runline, 60*5, check=True, cwd=workingdir)
+                pass
         except subprocess.CalledProcessError:
             # This means either the original test did not crash (i.e. there's
             # nothing to reduce, or that during reduction llvm_reduce itself
             # crashed.  The later is generally because it internally produced
             # invalid IR.  Help with fixing these bugs is appreciated.
             print ("llvm_reduce failed, unable to reduce %s" % test)
-            return
+            return no_reduction("failed")
+        except subprocess.TimeoutExpired:
+            print ("llvm_reduce timed out on %s" % test)
+            return no_reduction("timeout")
 
         # Now that we've run bugpoint, convert the simplified output into
         # a standalone test case.
-        shutil.copy("reduced.ll", "candidate.ll")
+        candidate = os.path.join(workingdir, "candidate.ll")
+        shutil.copy(os.path.join(workingdir, "reduced.ll"), candidate)
 
         comments = read_comment_lines(test)
-        rewrite_candidate(comments, "candidate.ll")
+        rewrite_candidate(comments, candidate)
 
         # Note: We treat reduction as somewhat of a canonicalization step.  That
         # is, we always add the "reduced" output to the corpus even if we don't
@@ -359,13 +1466,8 @@ def reduce_with_llvm_reduce(builddir, corpusdir, test):
         # will cause this routine to eventually be invoked on the reduced
         # result.
 
-        res = add_candidate_to_corpus(corpusdir, "candidate.ll", True)
-        if None != res:
-            log_reduction(corpusdir, "llvm-reduce-crash-unconstrained",
-                          test, res)
-            pass
-        pass
-    return
+        return finish_reduction(corpusdir, "llvm-reduce-crash-unconstrained",
+                                test, candidate)
 
 all_passes = ["-simplify-cfg",
               "-sroa",
@@ -397,86 +1499,493 @@ simple_passes = ["-instsimplify",
 # the relevant analysis code is involved in the runline. This does not reduce
 # a pass list, it simply checks to see if the sole pass used can be replaced.
 def vary_opt_pass(builddir, corpusdir, test):
-    assert test.endswith(".ll")
+    assert get_test_ext(test) == ".ll"
     runline = get_valid_run_line(test)
     assert runline != None
     cmd = runline.split(' ')[0]
     if cmd != "opt":
-        return None
+        return no_reduction("unsupported")
 
     origpass = None
     for passoption in all_passes:
         if passoption not in runline:
             continue;
         if None != origpass:
-            return None
+            return no_reduction("unsupported")
         origpass = passoption
         pass
     if origpass == None:
-        return
+        return no_reduction("unsupported")
     print("vary_opt_pass found %s pass used in %s" % (origpass, test))
 
-    with tempfile.TemporaryDirectory() as workingdir, scoped_cd(workingdir):
+    with tempfile.TemporaryDirectory() as workingdir:
         print("Running vary_opt_pass in %s" % workingdir)
 
         # Make sure that the original test fails unmodified, and passes
         # if we drop the single pass from the command line.
-        result = run_test(test, builddir)
-        if result.returncode == 0:
-            return None
-        candidate = "candidate.ll"
-        shutil.copy(test, candidate)
+        if not test_fails(test, builddir, corpusdir):
+            return no_reduction("no-crash")
+        candidate = os.path.join(workingdir, "candidate.ll")
+        write_test(test, candidate)
         new_runline = "; RUN: " + runline.replace(origpass, "") + "\n"
         replace_runline(new_runline, candidate)
-        result = run_test(candidate, builddir)
+        result = run_test_hashed(candidate, builddir)
         if result.returncode != 0:
-            return None
+            return no_reduction("no-progress")
         
+        results = []
         for passoption in simple_passes:
             if origpass == passoption:
                 continue;
             print("Trying test with pass %s" % passoption)
-            shutil.copy(test, candidate)
+            write_test(test, candidate)
             new_runline = "; RUN: " + runline.replace(origpass, passoption) + "\n"
             replace_runline(new_runline, candidate)
             #with open(candidate, 'r') as original:
             #    print(original.read())
             #    pass
-            result = run_test(candidate, builddir)
-            if result.returncode == 0:
+            result = run_test_hashed(candidate, builddir)
+            if not is_failure(result):
                 continue
-            res = add_candidate_to_corpus(corpusdir, candidate, True)
-            if None != res:
-                reducertag = "opt-analysis-isolate-crash-unconstrained"
-                log_reduction(corpusdir, reducertag, test, res)
-                pass
+            reducertag = "opt-analysis-isolate-crash-unconstrained"
+            results.append(finish_reduction(corpusdir, reducertag, test,
+                                            candidate))
+            pass
+        return merge_reductions(results)
+
+# Split a pass pipeline (as printed by opt -print-pipeline-passes) on the
+# commas at its top level.
+def split_pipeline(pipeline):
+    elements = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(pipeline):
+        if c in "(<":
+            depth += 1
+        elif c in ")>":
+            depth -= 1
+        elif c == "," and 0 == depth:
+            elements.append(pipeline[start:i])
+            start = i + 1
             pass
         pass
-    return
+    if start < len(pipeline):
+        elements.append(pipeline[start:])
+        pass
+    return elements
+
+# Flatten a pass pipeline into a list of individual passes, each wrapped in
+# the adaptors (e.g. function(...), cgscc(devirt<4>(...))) it was nested
+# in, so that any sublist joined with commas is itself a valid pipeline.
+def flatten_pipeline(pipeline):
+    passes = []
+    for element in split_pipeline(pipeline):
+        # An adaptor is name(...), where the name may have <parameters>
+        depth = 0
+        paren = -1
+        for i, c in enumerate(element):
+            if c == "<":
+                depth += 1
+            elif c == ">":
+                depth -= 1
+            elif c == "(" and 0 == depth:
+                paren = i
+                break
+            pass
+        if -1 == paren or not element.endswith(")"):
+            passes.append(element)
+            continue
+        adaptor = element[:paren]
+        for inner in flatten_pipeline(element[paren + 1:-1]):
+            passes.append("%s(%s)" % (adaptor, inner))
+            pass
+        pass
+    return passes
+
+# The names of all the passes the opt in tool knows about.  Raises
+# subprocess.TimeoutExpired (which isn't cached) if opt hangs.
+@functools.lru_cache(maxsize=None)
+def get_opt_pass_names(tool):
+    completed = run_tool(shlex.quote(tool) + " -print-passes", 20,
+                         stdin=subprocess.DEVNULL)
+    names = set()
+    for line in completed.stdout.decode(errors="replace").splitlines():
+        if line.startswith("  "):
+            names.add(line.strip().split("<")[0])
+            pass
+        pass
+    return names
+
+opt_level_re = re.compile(r"^-O[0-3sz]$")
+
+# Split the arguments of an opt RUN line into those which determine the pass
+# pipeline (e.g. -O2, -passes=..., or -instcombine) and the rest.
+def split_pipeline_options(tool, args):
+    pass_names = get_opt_pass_names(tool)
+    pipeline_options = []
+    other = []
+    for arg in args:
+        if (arg.startswith("-passes=") or arg.startswith("--passes=") or
+            None != opt_level_re.match(arg) or
+            arg.lstrip("-") in pass_names):
+            pipeline_options.append(arg)
+        else:
+            other.append(arg)
+            pass
+        pass
+    return pipeline_options, other
+
+# Ask opt what pipeline a RUN line's options amount to, and return it as a
+# flat list of passes (without the verifier runs opt adds itself), or None.
+# Raises subprocess.TimeoutExpired if opt hangs.
+def expand_pipeline(tool, options):
+    cmd = "%s %s -print-pipeline-passes -disable-output < /dev/null" % (
+        shlex.quote(tool), " ".join(options))
+    completed = run_tool(cmd, 20)
+    if completed.returncode != 0:
+        return None
+    lines = completed.stdout.decode(errors="replace").splitlines()
+    if 0 == len(lines):
+        return None
+    passes = flatten_pipeline(lines[0].strip())
+    while 0 != len(passes) and passes[0] == "verify":
+        passes = passes[1:]
+        pass
+    while 0 != len(passes) and passes[-1] == "verify":
+        passes = passes[:-1]
+        pass
+    return passes
+
+# Return the smallest sublist of items for which is_interesting (which takes
+# a list of lists, and returns a list of results) holds, per Zeller's ddmin.
+# items is assumed to be interesting.  Each round's candidates are
+# evaluated in a single call, so that they can be run in parallel.
+def ddmin(items, is_interesting):
+    n = 2
+    while len(items) >= 2:
+        size = len(items)
+        bounds = [(i * size // n, (i + 1) * size // n) for i in range(n)]
+        subsets = [items[start:end] for start, end in bounds]
+        complements = []
+        if n > 2:
+            complements = [items[:start] + items[end:] for start, end in bounds]
+            pass
+        results = is_interesting(subsets + complements)
+        if any(results[:n]):
+            items = subsets[results.index(True)]
+            n = 2
+        elif any(results[n:]):
+            items = complements[results[n:].index(True)]
+            n = max(n - 1, 2)
+        elif n < len(items):
+            n = min(2 * n, len(items))
+        else:
+            break
+        pass
+    return items
+
+# Reduce the pass pipeline of a crashing opt test to a minimal list of passes
+# which still produces the same crash.  Any way of giving the pipeline
+# (-O2, -passes=..., or individual pass flags) is expanded into the list of
+# passes it runs, and the result is written as -passes=...
+def reduce_pass_pipeline(builddir, corpusdir, test):
+    assert get_test_ext(test) == ".ll"
+    runline = get_valid_run_line(test)
+    assert runline != None
+    args = runline.split()
+    if args[0] != "opt" or "-enable-new-pm=0" in args:
+        return no_reduction("unsupported")
+    tool = os.path.join(builddir, "bin", "opt")
+    try:
+        pipeline_options, other = split_pipeline_options(tool, args[1:])
+        options = [arg for arg in other if arg.startswith("-") and
+                   arg not in ["-", "-S", "-o"]]
+        passes = expand_pipeline(tool, pipeline_options + options)
+    except subprocess.TimeoutExpired:
+        return no_reduction("timeout")
+    if None == passes or len(passes) < 2:
+        return no_reduction("unsupported")
+
+    store = get_observation_store(corpusdir)
+    obs = observe_test(builddir, test, store)
+    if obs.outcome != "fail":
+        return no_reduction("no-crash")
+    timeout = get_test_timeout(store, obs.testsig)
+
+    with tempfile.TemporaryDirectory() as workingdir:
+        print("Running pass pipeline reduction of %d passes in %s" %
+              (len(passes), workingdir))
+
+        def make_runline(passes):
+            return " ".join([args[0], "-passes='%s'" % ",".join(passes)] +
+                            other)
+
+        # Is this the same failure?  Results are memoized, as ddmin can ask
+        # about the same pass list more than once.
+        probes = {}
+        def probe(passes, name):
+            candidate = os.path.join(workingdir, name)
+            write_test(test, candidate)
+            replace_runline("; RUN: " + make_runline(passes) + "\n",
+                            candidate)
+            result = run_test_hashed(candidate, builddir, timeout=timeout)
+            if not is_failure(result):
+                return False
+            if None != obs.crashsig:
+                return get_crash_signature(result.stderr_tail) == obs.crashsig
+            return result.returncode == obs.returncode
+
+        with extra_job_tokens(MAX_EXTRA_JOB_TOKENS) as extra, \
+             concurrent.futures.ThreadPoolExecutor(1 + extra) as executor:
+            def is_interesting(candidates):
+                futures = {}
+                for passes in candidates:
+                    key = tuple(passes)
+                    if key in probes or key in futures:
+                        continue
+                    name = "probe%d.ll" % (len(probes) + len(futures))
+                    futures[key] = executor.submit(probe, passes, name)
+                    pass
+                for key, future in futures.items():
+                    probes[key] = future.result()
+                    pass
+                return [probes[tuple(passes)] for passes in candidates]
+
+            # Make sure the flattened pipeline still fails the same way
+            if not is_interesting([passes])[0]:
+                print("Flattened pipeline doesn't reproduce the failure")
+                return no_reduction("no-progress")
+            reduced = ddmin(passes, is_interesting)
+            pass
+        print("Reduced pipeline to %d of %d passes after %d probes" %
+              (len(reduced), len(passes), len(probes)))
+        if len(reduced) == len(passes):
+            return no_reduction("no-progress")
+
+        candidate = os.path.join(workingdir, "candidate.ll")
+        write_test(test, candidate)
+        replace_runline("; RUN: " + make_runline(reduced) + "\n", candidate)
+        return finish_reduction(corpusdir, "pass-pipeline-ddmin", test,
+                                candidate)
+
+bisect_line_re = re.compile(r"^BISECT: running pass \((\d+)\) (\S+) on (.*)$")
+# How opt-bisect-limit describes a loop, e.g. "loop %for.body in function
+# f" (capitalized by the legacy pass manager)
+bisect_loop_unit_re = re.compile(r"^loop %\S+ in function ", re.IGNORECASE)
+
+# Pass class names (as opt-bisect-limit reports them) which the heuristic in
+# get_pass_name_for_class doesn't get right.
+pass_class_names = {
+    "PromotePass": "mem2reg",
+    "InlinerPass": "inline",
+    "PostOrderFunctionAttrsPass": "function-attrs",
+    "DeadArgumentEliminationPass": "deadargelim",
+    "IndVarSimplifyPass": "indvars",
+    "LoopIdiomRecognizePass": "loop-idiom",
+    "LoopFullUnrollPass": "loop-unroll-full",
+    "CorrelatedValuePropagationPass": "correlated-propagation",
+    "SLPVectorizerPass": "slp-vectorizer",
+    "TailCallElimPass": "tailcallelim",
+}
+
+# Guess the -passes= name of a pass from its class name, e.g. InstCombinePass
+# is instcombine, and LoopRotatePass is loop-rotate.  Returns None if there's
+# no such pass.
+def get_pass_name_for_class(tool, class_name):
+    if class_name in pass_class_names:
+        return pass_class_names[class_name]
+    def simplify(name):
+        return re.sub(r"[^a-z0-9]", "", name.lower())
+    wanted = simplify(re.sub(r"Pass$", "", class_name))
+    for name in get_opt_pass_names(tool):
+        if simplify(name) == wanted:
+            return name
+        pass
+    return None
+
+# The -passes= pipeline for running just the named pass, on the kind of unit
+# opt-bisect-limit said it ran on.  Prefer the form (adaptors and
+# parameters) it has in the test's own pipeline, if it's there.
+def get_single_pass_pipeline(name, unit, pipeline):
+    for element in pipeline:
+        innermost = re.sub(r"\)*$", "", element).split("(")[-1]
+        if innermost.split("<")[0] == name:
+            return element
+        pass
+    if unit == "[module]":
+        return name
+    if unit.startswith("("):
+        return "cgscc(%s)" % name
+    if None != bisect_loop_unit_re.match(unit):
+        return "function(loop(%s))" % name
+    return "function(%s)" % name
+
+# Isolate the pass which crashes on an opt test, and write a test which runs
+# just that pass on the IR as it was just before that pass ran.  The first
+# pass execution which crashes is found by binary search on
+# -opt-bisect-limit (in about log2 of the number of pass executions runs).
+# If running the pass alone doesn't reproduce the crash, falls back to the
+# original test with the bisect limit added to its RUN line.
+def isolate_crashing_pass(builddir, corpusdir, test):
+    assert get_test_ext(test) == ".ll"
+    runline = get_valid_run_line(test)
+    assert runline != None
+    args = runline.split()
+    if args[0] != "opt" or "-enable-new-pm=0" in args:
+        return no_reduction("unsupported")
+    if any(arg.startswith("-opt-bisect-limit") for arg in args):
+        return no_reduction("unsupported")
+    tool = os.path.join(builddir, "bin", "opt")
+
+    store = get_observation_store(corpusdir)
+    obs = observe_test(builddir, test, store)
+    if obs.outcome != "fail" or None == obs.crashsig:
+        return no_reduction("no-crash")
+    timeout = get_test_timeout(store, obs.testsig)
+
+    # The RUN line, without any output options
+    other = []
+    skip = False
+    for arg in args[1:]:
+        if skip:
+            skip = False
+            continue
+        if arg == "-o":
+            skip = True
+            continue
+        if arg != "-S":
+            other.append(arg)
+            pass
+        pass
+    def make_runline(options):
+        return " ".join([args[0]] + options + other)
+
+    with tempfile.TemporaryDirectory() as workingdir:
+        print("Running opt-bisect-limit isolation in %s" % workingdir)
+
+        probe_count = [0]
+        def make_probe(runline):
+            probe = os.path.join(workingdir, "probe%d.ll" % probe_count[0])
+            probe_count[0] += 1
+            write_test(test, probe)
+            replace_runline("; RUN: " + runline + "\n", probe)
+            return probe
+
+        # Does running only the first limit pass executions crash the same
+        # way?
+        def crashes(limit):
+            probe = make_probe(make_runline(["-opt-bisect-limit=%d" % limit]))
+            result = run_test_hashed(probe, builddir, timeout=timeout)
+            return (is_failure(result) and
+                    get_crash_signature(result.stderr_tail) == obs.crashsig)
+
+        # Every pass execution is reported until the crash, so the last
+        # one reported bounds the search.
+        probe = make_probe(make_runline(["-opt-bisect-limit=-1"]))
+        try:
+            completed = run_tool(get_full_runline(builddir, probe, probe),
+                                 timeout, cwd=workingdir)
+        except subprocess.TimeoutExpired:
+            return no_reduction("timeout")
+        executions = {}
+        for line in completed.stderr.decode(errors="replace").splitlines():
+            m = bisect_line_re.match(line)
+            if None != m:
+                executions[int(m.group(1))] = (m.group(2), m.group(3))
+                pass
+            pass
+        if 0 == len(executions):
+            print("No passes reported by -opt-bisect-limit")
+            return no_reduction("unsupported")
+        hi = max(executions)
+        lo = 0
+        if not crashes(hi) or crashes(lo):
+            # The crash isn't in a pass which can be skipped (or isn't
+            # deterministic)
+            print("Crash not isolated by -opt-bisect-limit")
+            return no_reduction("no-progress")
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if crashes(mid):
+                hi = mid
+            else:
+                lo = mid
+                pass
+            pass
+        class_name, unit = executions[hi]
+        print("Pass execution %d (%s on %s) crashes" % (hi, class_name, unit))
+
+        # Capture the IR just before the crashing pass runs
+        before = os.path.join(workingdir, "before.ll")
+        probe = make_probe(make_runline(["-opt-bisect-limit=%d" % (hi - 1),
+                                         "-S", "-o", before]))
+        try:
+            completed = run_tool(get_full_runline(builddir, probe, probe),
+                                 timeout, cwd=workingdir)
+        except subprocess.TimeoutExpired:
+            completed = None
+            pass
+
+        try:
+            name = get_pass_name_for_class(tool, class_name)
+            pipeline_options, options = split_pipeline_options(tool, other)
+            pipeline = expand_pipeline(tool, pipeline_options) or []
+        except subprocess.TimeoutExpired:
+            return no_reduction("timeout")
+        if (None != completed and completed.returncode == 0 and
+            None != name):
+            passes = get_single_pass_pipeline(name, unit, pipeline)
+            candidate = os.path.join(workingdir, "candidate.ll")
+            shutil.copy(before, candidate)
+            rewrite_candidate(read_comment_lines(test), candidate)
+            replace_runline("; RUN: " + " ".join(
+                [args[0], "-S", "-passes='%s'" % passes] + options) + "\n",
+                            candidate)
+            result = run_test_hashed(candidate, builddir, timeout=timeout)
+            if (is_failure(result) and
+                get_crash_signature(result.stderr_tail) == obs.crashsig):
+                return finish_reduction(corpusdir, "opt-bisect-isolate",
+                                        test, candidate)
+            print("Running %s alone doesn't reproduce the crash" % passes)
+            pass
+
+        # Fall back to limiting the original pipeline
+        candidate = os.path.join(workingdir, "candidate.ll")
+        write_test(test, candidate)
+        replace_runline("; RUN: " + " ".join(
+            [args[0], "-opt-bisect-limit=%d" % hi] + args[1:]) + "\n",
+                        candidate)
+        return finish_reduction(corpusdir, "opt-bisect-limit", test,
+                                candidate)
 
 # Specifically, reduce a compiler crash.
 def reduce_with_creduce(builddir, corpusdir, test):
-    with tempfile.TemporaryDirectory() as workingdir, scoped_cd(workingdir):
+    with tempfile.TemporaryDirectory() as workingdir:
         print("Running creduce in %s" % workingdir)
         runline = get_valid_run_line(test)
         assert runline != None
 
-        ext = os.path.splitext(test)[1]
-        candidate = "candidate" + ext
+        ext = get_test_ext(test)
+        # Note: creduce runs the interestingness test on a copy of the
+        # candidate in a directory of its own, so the script must refer to
+        # the candidate by the relative name.
+        candidate_name = "candidate" + ext
+        candidate = os.path.join(workingdir, candidate_name)
 
         # Note: CReduce reduces *in place* by default
-        shutil.copy(test, candidate)
+        write_test(test, candidate)
     
         # First, write the interestingness script.  To get creduce to reduce
         # assertion failures, we need to make return code 134 interesting, and
         # all others not.  This avoids e.g. reducing any input which doesn't
         # parse as C/C++. Why 134 is the magic crash ret code, I have no idea
-        runline = get_full_runline(builddir, test, candidate) + "\n";
+        runline = get_full_runline(builddir, test, candidate_name) + "\n";
         runline += "if [ $? -eq 134 ]; then\n"
         runline += "  exit 0\n"
         runline += "fi;\n"
         runline += "exit 1\n"
-        with open("interestingness.sh", "w") as f:
+        script = os.path.join(workingdir, "interestingness.sh")
+        with open(script, "w") as f:
             # The first line is not optional, llvm-reduce fails with an
             # unhelpful message if left out.
             f.write("#!/bin/bash\n")
@@ -484,28 +1993,30 @@ def reduce_with_creduce(builddir, corpusdir, test):
             f.write(runline + "\n")
             pass
 
-        make_exec("interestingness.sh")
-        #with open("interestingness.sh", 'r') as f:
+        make_exec(script)
+        #with open(script, 'r') as f:
         #    print(f.readlines())
 
-        runline = "creduce ./interestingness.sh %s" % candidate
+        runline = "creduce ./interestingness.sh %s" % candidate_name
         if ext not in [".c", ".cc", ".cpp", ".cxx"]:
             runline += " --not-c"
             pass
-        print(runline)
 
         try:
-            subprocess.run(runline, capture_output=True,
-                           timeout=60*5, shell=True, check=True)
+            with extra_job_tokens(MAX_EXTRA_JOB_TOKENS) as extra:
+                runline += " --n %d" % (1 + extra)
+                print(runline)
+                run_tool(runline, 60*5, check=True, cwd=workingdir)
+                pass
         except subprocess.CalledProcessError:
             # This means either the original test did not crash (i.e. there's
             # nothing to reduce, or that during reduction creduce itself
             # crashed.
             print ("creduce failed, unable to reduce %s" % test)
-            return
+            return no_reduction("failed")
         except subprocess.TimeoutExpired:
             print ("creduce timed out on %s" % test)
-            return
+            return no_reduction("timeout")
 
         # Now that we've run creduce, convert the simplified output into
         # a standalone test case.
@@ -513,19 +2024,17 @@ def reduce_with_creduce(builddir, corpusdir, test):
             # CReduce doesn't know how to pretty print IR, so run it through
             # opt -S to normalize whitespace.
             cmd = builddir + "/bin/opt -S %s -o temp.ll && cp temp.ll %s" % (candidate, candidate)
-            subprocess.run(cmd, capture_output=True,
-                           timeout=20, shell=True)
+            try:
+                run_tool(cmd, 20, cwd=workingdir)
+            except subprocess.TimeoutExpired:
+                print ("opt -S timed out on creduce's output for %s" % test)
+                return no_reduction("timeout")
             pass
 
         comments = read_comment_lines(test)
         rewrite_candidate(comments, candidate)
-        res = add_candidate_to_corpus(corpusdir, candidate, True)
-        if None != res:
-            reducertag = "creduce-crash-unconstrained"
-            log_reduction(corpusdir, reducertag, test, res)
-            pass
-        pass
-    return
+        return finish_reduction(corpusdir, "creduce-crash-unconstrained",
+                                test, candidate)
 
 # Given a clang crash, see if we can produce a standalone opt/llc test
 # case.
@@ -534,26 +2043,28 @@ def convert_clang_test_to_opt_test(builddir, corpusdir, test):
     assert runline != None
     cmd = runline.split(' ')[0]
     if cmd != "clang":
-        return None
+        return no_reduction("unsupported")
 
-    with tempfile.TemporaryDirectory() as workingdir, scoped_cd(workingdir):
+    with tempfile.TemporaryDirectory() as workingdir:
         print("Running clang-to-opt in %s" % workingdir)
 
         # Make sure that the original test fails unmodified.
-        result = run_test(test, builddir)
-        if result.returncode == 0:
-            return None
+        if not test_fails(test, builddir, corpusdir):
+            return no_reduction("no-crash")
 
         # Extract the IR to be passed to opt
         opt_runline = runline
         opt_runline += " -emit-llvm -disable-llvm-optzns"
         opt_runline += " -o candidate.ll"
-        opt_runline = substitute_runline(opt_runline, builddir, test)
-        completed = subprocess.run(opt_runline, capture_output=True,
-                                   timeout=30, shell=True)
+        opt_runline = substitute_runline(opt_runline, builddir,
+                                         get_plain_test(test, workingdir))
+        try:
+            completed = run_tool(opt_runline, 30, cwd=workingdir)
+        except subprocess.TimeoutExpired:
+            return no_reduction("timeout")
         if completed.returncode != 0:
             print("Unable to extract IR - probably a frontend crash")
-            return None;
+            return no_reduction("unsupported")
 
         # TODO: Need to do better than just blindly assume O2, but need
         # some real examples to play with.
@@ -562,37 +2073,228 @@ def convert_clang_test_to_opt_test(builddir, corpusdir, test):
         # case and add it to the corpus
         opt_runline = "opt -S -O2 < candidate.ll -o llc-candidate.ll \n"
         opt_runline = substitute_runline(opt_runline, builddir, test)
-        completed = subprocess.run(opt_runline, capture_output=True,
-                                   timeout=30, shell=True)
+        try:
+            completed = run_tool(opt_runline, 30, cwd=workingdir)
+        except subprocess.TimeoutExpired:
+            return no_reduction("timeout")
         if completed.returncode != 0:
-            candidate = "candidate.ll"
+            candidate = os.path.join(workingdir, "candidate.ll")
             new_runline = "; RUN: opt -S -O2 < %s \n"
             rewrite_candidate(new_runline, candidate)
-            result = run_test(candidate, builddir)
-            assert result.returncode != 0
-            res = add_candidate_to_corpus(corpusdir, candidate, True)
-            if None != res:
-                reducertag = "clang-to-opt-crash-unconstrained"
-                log_reduction(corpusdir, reducertag, test, res)
-                pass
-            return
+            result = run_test_hashed(candidate, builddir)
+            if not is_failure(result):
+                return no_reduction("no-progress")
+            reducertag = "clang-to-opt-crash-unconstrained"
+            return finish_reduction(corpusdir, reducertag, test, candidate)
 
         # If opt didn't fail, try piping the output of opt to LLC, and
         # see if we can create a backend test case.
-        candidate = "llc-candidate.ll"
+        candidate = os.path.join(workingdir, "llc-candidate.ll")
         new_runline = "; RUN: llc -O2 < %s \n"
         rewrite_candidate(new_runline, candidate)
-        result = run_test(candidate, builddir)
-        if result.returncode == 0:
+        result = run_test_hashed(candidate, builddir)
+        if not is_failure(result):
             # Can't make progress
-            return None;
-        res = add_candidate_to_corpus(corpusdir, candidate, True)
-        if None != res:
-            reducertag = "clang-to-llc-crash-unconstrained"
-            log_reduction(corpusdir, reducertag, test, res)
+            return no_reduction("no-progress")
+        reducertag = "clang-to-llc-crash-unconstrained"
+        return finish_reduction(corpusdir, reducertag, test, candidate)
+
+# The reducers manage-corpus.py applies to a failing test.  Each reducer works
+# in a private directory and only communicates through the corpus, so any
+# of these may be run in parallel with each other (and with the reducers
+# for other tests).
+def get_reducers_for_test(test):
+    ext = get_test_ext(test)
+    if ext in [".c", ".cc", ".cpp", ".cxx"]:
+        # Note: creduce can be applied to other input types, but it is
+        # *slow* compared to other reducers.  Given that, if we have a
+        # dedicated reducer for the input language, we chose not to.
+        return [reduce_with_creduce]
+    if ext == ".ll":
+        return [reduce_with_bugpoint, reduce_with_llvm_reduce, vary_opt_pass,
+                reduce_pass_pipeline, isolate_crashing_pass]
+    return []
+
+# The names reducers are known by in the reducer-attempt ledger.
+reducer_names = {
+    reduce_with_bugpoint: "bugpoint",
+    reduce_with_llvm_reduce: "llvm-reduce",
+    vary_opt_pass: "opt-analysis-isolate",
+    reduce_pass_pipeline: "pass-pipeline",
+    isolate_crashing_pass: "opt-bisect",
+    reduce_with_creduce: "creduce",
+    convert_clang_test_to_opt_test: "clang-to-opt",
+}
+reducers_by_name = dict((name, reducer) for reducer, name in
+                        reducer_names.items())
+
+# The reducers for the test (whose content hash is testsig) which haven't
+# already been tried on it with this build.
+def get_untried_reducers(ledger, test, testsig, buildsig):
+    reducers = []
+    for reducer in get_reducers_for_test(test):
+        attempt = ledger.lookup(reducer_names[reducer], testsig, buildsig)
+        if None != attempt:
+            print ("Skipping %s on %s: already tried (%s)" %
+                   (reducer_names[reducer], test, attempt.outcome))
+            continue
+        reducers.append(reducer)
+        pass
+    return reducers
+
+# CPU seconds used by this process and its (finished) children so far.
+def get_cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime + children.ru_utime +
+            children.ru_stime)
+
+# Inputs are grouped into classes, by extension, the tool the RUN line runs,
+# and size band (below 1K, below 4K, ... below 256K, and larger), for
+# learning how well each reducer does on each kind of input.
+def get_reducer_input_class(test):
+    ext = get_test_ext(test)
+    runline = get_valid_run_line(test)
+    tool = "none"
+    if None != runline:
+        tool = runline.split(' ')[0]
+        pass
+    return "%s %s %d" % (ext, tool, get_size_band(get_test_size(test)))
+
+# Until a reducer has been tried this many times on a class of input, it's
+# tried first.  After that, it's ordered by bytes of reduction per CPU
+# second, and skipped if it never produced anything.  Skipped reducers are
+# still tried now and then, at REDUCER_EXPLORATION_RATE.
+MIN_REDUCER_SAMPLES = 3
+REDUCER_EXPLORATION_RATE = 0.1
+
+# Order the reducers for the test from most to least promising, dropping any
+# which (as far as the ledger knows) are a waste of time.  reduction_counts
+# is from load_reduction_counts, and breaks ties between reducers which
+# haven't been tried enough.
+def choose_reducers(ledger, test, reducers, reduction_counts):
+    input_class = get_reducer_input_class(test)
+    stats = ledger.get_class_stats(input_class)
+    ext = get_test_ext(test)
+    untried = []
+    ranked = []
+    exploring = []
+    for reducer in reducers:
+        name = reducer_names[reducer]
+        s = stats.get(name)
+        if None == s or s.attempts < MIN_REDUCER_SAMPLES:
+            untried.append((-reduction_counts.get((name, ext), 0), reducer))
+            continue
+        if 0 == s.gain:
+            if random.random() < REDUCER_EXPLORATION_RATE:
+                exploring.append(reducer)
+            else:
+                print ("Skipping %s on %s: nothing from %d attempts on %s" %
+                       (name, test, s.attempts, input_class))
+                pass
+            continue
+        ranked.append((-s.gain / max(s.cpu, 0.01), reducer))
+        pass
+    # Note: sort on the key alone, so the original order breaks ties
+    untried.sort(key=lambda item: item[0])
+    ranked.sort(key=lambda item: item[0])
+    return ([reducer for key, reducer in untried] +
+            [reducer for key, reducer in ranked] + exploring)
+
+# Run the reducer on the test (holding a job token), and record what came of
+# it in the reducer-attempt ledger in corpusdir.
+def run_reducer(reducer, builddir, corpusdir, test):
+    inputsig = sha1_of_files([test])
+    input_size = get_test_size(test)
+    input_class = get_reducer_input_class(test)
+    buildsig = get_run_environment(builddir).get_test_build_signature(test)
+    with job_token(), timed_event("reducer", reducer=reducer_names[reducer],
+                                  test=test, ext=get_test_ext(test),
+                                  input_size=input_size) as event:
+        start = time.monotonic()
+        start_cpu = get_cpu_time()
+        result = reducer(builddir, corpusdir, test)
+        duration = time.monotonic() - start
+        cpu = get_cpu_time() - start_cpu
+        event["outcome"] = result.outcome
+        event["output_size"] = result.output_size
+        if None != result.output_size and 0 != input_size:
+            event["reduction_ratio"] = result.output_size / input_size
             pass
-        return
-    return
+        pass
+    ReducerLedger(corpusdir).record(
+        ReducerAttempt(reducer_names[reducer], inputsig, buildsig,
+                       result.outcome, result.outputs, duration, input_size,
+                       result.output_size, input_class, cpu))
+    return result
+
+# Does the test fail on this build?  (A timeout is not a failure.)  If a
+# corpusdir is given, the observation store in it is consulted first, and
+# updated if the test had to be run.
+def test_fails(test, builddir, corpusdir=None, revision=None):
+    store = None
+    if corpusdir != None:
+        store = get_observation_store(corpusdir)
+        pass
+    obs = observe_test(builddir, test, store, revision)
+    return obs.outcome == "fail"
+
+def observe_corpus_test(test, builddir, corpusdir, revision=None):
+    with job_token():
+        return observe_test(builddir, test, get_observation_store(corpusdir),
+                            revision)
+
+# Limits on reduction effort per crash bucket.  Once a bucket has a
+# reproducer no bigger than SMALL_REPRODUCER_SIZE bytes, larger tests in it
+# aren't reduced.  No bucket gets more than MAX_REDUCTIONS_PER_BUCKET
+# tests reduced per build.  Buckets are per build configuration (see
+# Observation.configsig) rather than per tool, so the same crash reached
+# through e.g. both clang and opt is one bucket.
+SMALL_REPRODUCER_SIZE = 2048
+MAX_REDUCTIONS_PER_BUCKET = 8
+
+# Given the observation of a failing corpus test, return why it shouldn't be
+# reduced (as a string), or None if it should.  Tests without a crash
+# signature are always reduced.
+def get_bucket_skip_reason(buckets, obs, test):
+    if None == obs.crashsig:
+        return None
+    size = get_test_size(test)
+    smallest = buckets.smallest_reproducer(obs.crashsig, obs.configsig,
+                                           obs.testsig)
+    bucket = obs.crashsig[:12]
+    if (None != smallest and smallest <= SMALL_REPRODUCER_SIZE and
+        smallest < size):
+        return "bucket %s already has a %d byte reproducer" % (bucket,
+                                                              smallest)
+    count = buckets.reduction_count(obs.crashsig, obs.configsig)
+    if count >= MAX_REDUCTIONS_PER_BUCKET:
+        return "bucket %s has already had %d reductions" % (bucket, count)
+    return None
+
+# An executor which runs each task immediately in the calling process.  This
+# keeps the default (-j 1) behavior of the drivers identical to the original
+# serial loop, including the ordering of output and exceptions.
+class InlineExecutor(concurrent.futures.Executor):
+    def submit(self, fn, *args, **kwargs):
+        # Note: exceptions propagate straight out of submit
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+    pass
+
+# initializer(*initargs) is run in each worker before its first task (or
+# right away, for the inline executor), e.g. to set per process state such as
+# the event log.
+def make_executor(jobs, initializer=None, initargs=()):
+    if jobs <= 1:
+        if None != initializer:
+            initializer(*initargs)
+            pass
+        return InlineExecutor()
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                  initializer=initializer,
+                                                  initargs=initargs)
 
 def validate_and_canoncalize_config_path(config, key):
     assert key in config
@@ -610,5 +2312,8 @@ def load_and_validate_comfig():
         assert "LLVM_BUILD_REVISION"  in config
         validate_and_canoncalize_config_path(config, "LLVM_SOURCE_DIR")
         validate_and_canoncalize_config_path(config, "CORPUS_DIR")
+        if "CORPUS_COMPRESSION" in config:
+            assert "." + config["CORPUS_COMPRESSION"]["format"] in compressors
+            pass
         return config
 
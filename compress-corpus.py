@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+# compress-corpus.py [--decompress]
+#   Bring the storage of existing corpus entries in line with
+#   CORPUS_COMPRESSION in config.json (new entries are stored that way as
+#   they're added): entries of at least min_size bytes are compressed, and
+#   smaller ones stored as is.  With --decompress, or without
+#   CORPUS_COMPRESSION, every entry is stored uncompressed.
+#
+#   Content hashes are of the uncompressed content, so compressing an entry
+#   doesn't change what it's known by (e.g. in the observation store).
+
+import argparse
+from common import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--decompress", action="store_true")
+args = parser.parse_args()
+
+config = load_and_validate_comfig()
+root = os.path.abspath(config["CORPUS_DIR"])
+if not args.decompress:
+    set_corpus_compression(config.get("CORPUS_COMPRESSION"))
+    pass
+
+index = get_corpus_index(root)
+refresh_corpus_index(index, root)
+changed = 0
+saved = 0
+for _, entry in index.entries_since(0):
+    path = entry.path
+    dest = get_plain_name(path) + get_storage_suffix(entry.content_size)
+    if dest == path:
+        continue
+    # As in add_candidate_to_corpus, write to a hidden name and then rename
+    # so that no one ever observes a partial file.
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   prefix=".candidate-",
+                                   suffix=get_compression_suffix(dest))
+    os.close(fd)
+    write_test(path, tmpname)
+    shutil.copymode(path, tmpname)
+    os.replace(tmpname, dest)
+    saved += entry.size - os.path.getsize(dest)
+    os.unlink(path)
+    changed += 1
+    pass
+refresh_corpus_index(index, root)
+print ("Rewrote %d entries, saving %d bytes" % (changed, saved))
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+# corpus-worker.py [-j N] [--work-dir DIR] address build-dir
+#   Run tests and reducers handed out by a coordinator (manage-corpus.py
+#   --serve address) against the LLVM build in build-dir, until it has
+#   nothing left to do.  The build's signature must match the
+#   coordinator's.  See distributed.py.
+#
+#   With -j N, N tasks are run at a time (sharing a jobserver, as with
+#   manage-corpus.py -j).  Each keeps a scratch corpus (e.g. with the
+#   outcomes of the tests it's run) in DIR, which is a temporary directory
+#   unless --work-dir is given.
+
+import argparse
+from common import *
+from distributed import run_worker
+from jobserver import setup_jobserver
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", dest="jobs", type=int, default=1,
+                    help="number of tasks to run in parallel")
+parser.add_argument("--work-dir", default=None)
+parser.add_argument("address", help="host:port or unix:path")
+parser.add_argument("builddir")
+args = parser.parse_args()
+
+builddir = os.path.abspath(args.builddir)
+setup_jobserver(args.jobs)
+with contextlib.ExitStack() as stack:
+    workdir = args.work_dir
+    if None == workdir:
+        workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        pass
+    workdir = os.path.abspath(workdir)
+    with make_executor(args.jobs) as executor:
+        futures = [executor.submit(run_worker, args.address, builddir,
+                                   os.path.join(workdir, "worker%d" % i))
+                   for i in range(max(args.jobs, 1))]
+        ok = all(future.result() for future in futures)
+        pass
+    pass
+sys.exit(0 if ok else 1)
@@ -0,0 +1,453 @@
+# Running tests and reducers on other machines (or just other processes).
+#
+# manage-corpus.py --serve ADDRESS acts as the coordinator: it still owns
+# the corpus, the worklist and everything in triage.db, but instead of
+# running tests and reducers itself, it hands them out as tasks to
+# corpus-worker.py processes which connect to ADDRESS.  Workers pull one
+# task at a time, run it against their own LLVM_BUILD_DIR, and send back
+# the result, along with any candidates a reducer produced.  The
+# coordinator adds those to the corpus, just as a local reducer would have.
+#
+# ADDRESS is HOST:PORT for TCP, or unix:PATH for a Unix domain socket.
+#
+# IMPORTANT: The protocol is unauthenticated and unencrypted.  Anything which
+# can connect to ADDRESS can act as a worker (and so add files to the
+# corpus), so only listen on localhost, a Unix domain socket, or a network
+# where every host is trusted.
+#
+# The protocol is one JSON object per line, with the test and candidate
+# contents zlib compressed and base64 encoded:
+#   worker: {"type": "hello", "buildsig": ..., "machinesig": ...,
+#            "host": ...}
+#   coordinator: {"type": "welcome"}, or {"type": "error", "message": ...}
+#     if the worker's build signature doesn't match its own
+# and then, until the coordinator has nothing left to do,
+#   worker: {"type": "get"}
+#   coordinator: {"type": "task", "id": N, "kind": "observe" or "reduce",
+#                 "name": ..., "content": ..., ...}, or {"type": "done"}
+#   worker: {"type": "result", "id": N, ...}, or {"type": "failed",
+#           "id": N, "error": ...}, or {"type": "error", "id": N,
+#           "message": ...} if the task's build signature doesn't match its
+#           own
+# A task whose worker disconnects (or breaks the protocol) before answering
+# is handed out again.  One whose worker answers "error" fails.
+#
+# File names (of tasks, and of reducer candidates) are always <sha1>.<ext>,
+# the content hash and extension of the test, and anything else is a
+# protocol error.  They're used as is in the receiver's directories.
+#
+# The hello only compares build configurations (get_build_signature).  Each
+# task also carries the signature the coordinator expects observations of
+# its test to have (get_test_build_signature), which covers the tool the
+# test runs, so a worker whose tools are from another revision gives up
+# rather than mix its results in.
+#
+# Workers are assumed to be the same kind of machine as the coordinator
+# (get_machine_signature), so the observations they send back are recorded
+# under the coordinator's machine signature, which is also what known
+# outcomes are looked up by (here, and in manage-corpus.py).  A worker with
+# a different one is still accepted, but noted.
+#
+# Note: "get" blocks until there's a task, so workers can be started
+# before the coordinator has anything for them.
+
+import os
+import sys
+import json
+import zlib
+import base64
+import socket
+import tempfile
+import threading
+import traceback
+import collections
+import socketserver
+import concurrent.futures
+from common import *
+
+# A peer sent something it shouldn't have.  The connection is dropped.
+class ProtocolError(ValueError):
+    pass
+
+file_name_re = re.compile(r"^[0-9a-f]{40}\.[a-z]+$")
+
+# The name a file is sent under
+def get_sent_name(path):
+    return sha1_of_files([path]) + get_test_ext(path)
+
+# Check a file name from a peer is one get_sent_name could have produced,
+# so can't point outside the directory it's put in.
+def check_sent_name(name):
+    if (not isinstance(name, str) or None == file_name_re.match(name) or
+        None == get_comment_prefix(name)):
+        raise ProtocolError("bad file name %r" % (name,))
+    return name
+
+def parse_address(address):
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+def encode_file(path):
+    with open_test(path) as f:
+        return base64.b64encode(zlib.compress(f.read())).decode()
+
+def decode_file(content, path):
+    with open(path, 'wb') as f:
+        f.write(zlib.decompress(base64.b64decode(content)))
+        pass
+    pass
+
+def send_message(f, message):
+    f.write((json.dumps(message) + "\n").encode())
+    f.flush()
+    pass
+
+# Returns None at end of file
+def receive_message(f):
+    line = f.readline()
+    if 0 == len(line):
+        return None
+    return json.loads(line)
+
+# One handed out (or waiting to be) test run or reduction
+Task = collections.namedtuple("Task", ["id", "kind", "test", "fields",
+                                       "future"])
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        hello = receive_message(self.rfile)
+        if None == hello or hello.get("type") != "hello":
+            return
+        if hello["buildsig"] != coordinator.buildsig:
+            print ("Rejecting worker on %s: build signature %s doesn't "
+                   "match" % (hello.get("host"), hello["buildsig"]))
+            send_message(self.wfile, {
+                "type": "error",
+                "message": "build signature %s doesn't match the "
+                           "coordinator's %s" % (hello["buildsig"],
+                                                  coordinator.buildsig)})
+            return
+        send_message(self.wfile, {"type": "welcome"})
+        print ("Worker connected from %s" % hello.get("host"))
+        if hello.get("machinesig") != coordinator.machinesig:
+            print ("Note: worker on %s has machine signature %s, but its "
+                   "observations are recorded under ours (%s)" %
+                   (hello.get("host"), hello.get("machinesig"),
+                    coordinator.machinesig))
+            pass
+        coordinator.serve_worker(self.rfile, self.wfile)
+        pass
+    pass
+
+# Hands out work to workers, as a concurrent.futures.Executor which
+# manage-corpus.py can use in place of a local pool.  Only
+# observe_corpus_test and run_reducer can be submitted, and their futures
+# give the same results as if they'd been run locally.
+class Coordinator(concurrent.futures.Executor):
+    def __init__(self, address, builddir, corpusdir):
+        self.corpusdir = corpusdir
+        self.runenv = get_run_environment(builddir)
+        self.buildsig = self.runenv.get_build_signature()
+        self.machinesig = self.runenv.get_machine_signature()
+        self.tasks = collections.deque()
+        self.cond = threading.Condition()
+        self.next_id = 0
+        self.workers = 0
+        self.done = False
+        family, self.address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+                pass
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+            pass
+        server_class.allow_reuse_address = True
+        server_class.daemon_threads = True
+        self.server = server_class(self.address, CoordinatorHandler)
+        self.server.coordinator = self
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        print ("Serving tasks on %s" % address)
+        pass
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        if fn == observe_corpus_test:
+            test, builddir, corpusdir, revision = args
+            # Only tests whose outcome isn't already known need a worker
+            store = get_observation_store(self.corpusdir)
+            buildsig = self.runenv.get_test_build_signature(test)
+            obs = store.lookup(sha1_of_files([test]), buildsig,
+                               self.machinesig)
+            if None != obs:
+                print("Using known outcome (%s) of %s" % (obs.outcome, test))
+                future.set_result(obs._replace(revision=revision))
+                return future
+            self.queue("observe", test, {"revision": revision,
+                                         "buildsig": buildsig}, future)
+        elif fn == run_reducer:
+            reducer, builddir, corpusdir, test = args
+            self.queue("reduce", test, {
+                "reducer": reducer_names[reducer],
+                "buildsig": self.runenv.get_test_build_signature(test)},
+                       future)
+        else:
+            raise ValueError("can't hand out %s to workers" % fn.__name__)
+        return future
+
+    def queue(self, kind, test, fields, future, front=False):
+        with self.cond:
+            task = Task(self.next_id, kind, test, fields, future)
+            self.next_id += 1
+            if front:
+                self.tasks.appendleft(task)
+            else:
+                self.tasks.append(task)
+                pass
+            self.cond.notify_all()
+            pass
+        pass
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+            # Give connected workers a chance to hear that we're done
+            self.cond.wait_for(lambda: 0 == self.workers, timeout=10)
+            pass
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str):
+            os.unlink(self.address)
+            pass
+        pass
+
+    # Wait for a task, or None once there'll be no more.
+    def next_task(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.done or 0 != len(self.tasks))
+            if self.done:
+                return None
+            return self.tasks.popleft()
+        pass
+
+    # The next task along with the content of its test, or (None, None).
+    def next_task_content(self):
+        while True:
+            task = self.next_task()
+            if None == task:
+                return None, None
+            try:
+                return task, encode_file(task.test)
+            except OSError as e:
+                # e.g. the test was removed meanwhile
+                task.future.set_exception(e)
+                pass
+            pass
+        pass
+
+    def serve_worker(self, rfile, wfile):
+        with self.cond:
+            self.workers += 1
+            pass
+        task = None
+        try:
+            while True:
+                message = receive_message(rfile)
+                if None == message:
+                    break
+                if message["type"] == "get":
+                    # A worker only has one task at a time
+                    if None != task:
+                        raise ProtocolError("get with task %d outstanding" %
+                                            task.id)
+                    task, content = self.next_task_content()
+                    if None == task:
+                        send_message(wfile, {"type": "done"})
+                        break
+                    send_message(wfile, dict(task.fields, type="task",
+                                             id=task.id, kind=task.kind,
+                                             name=get_sent_name(task.test),
+                                             content=content))
+                    continue
+                if None == task or message.get("id") != task.id:
+                    raise ProtocolError("unexpected %s message" %
+                                        message.get("type"))
+                if message["type"] == "error":
+                    # The task can't be run by this worker, and most likely
+                    # not by any other either, so don't hand it out again.
+                    print ("Dropping worker: %s" % message["message"])
+                    task.future.set_exception(RuntimeError(
+                        "worker refused %s: %s" % (task.test,
+                                                   message["message"])))
+                    task = None
+                    break
+                if message["type"] == "failed":
+                    task.future.set_exception(RuntimeError(
+                        "worker failed on %s: %s" % (task.test,
+                                                     message["error"])))
+                else:
+                    try:
+                        self.finish_task(task, message)
+                    except ProtocolError:
+                        raise
+                    except Exception as e:
+                        task.future.set_exception(e)
+                        pass
+                    pass
+                task = None
+                pass
+        except (OSError, ValueError, KeyError) as e:
+            # Note: ProtocolError is a ValueError
+            print ("Lost worker: %s" % e)
+            pass
+        finally:
+            if None != task and not task.future.done():
+                print ("Requeueing %s" % task.test)
+                self.queue(task.kind, task.test, task.fields, task.future,
+                           front=True)
+                pass
+            with self.cond:
+                self.workers -= 1
+                self.cond.notify_all()
+                pass
+            pass
+        pass
+
+    # Record a worker's result as running the task locally would have, and
+    # complete its future.
+    def finish_task(self, task, message):
+        if task.kind == "observe":
+            obs = Observation(**message["observation"])
+            obs = obs._replace(machinesig=self.machinesig)
+            get_observation_store(self.corpusdir).record(obs)
+            task.future.set_result(obs)
+            return
+        attempt = ReducerAttempt(**message["attempt"])
+        for candidate in message["candidates"]:
+            check_sent_name(candidate["name"])
+            pass
+        added = 0
+        for candidate in message["candidates"]:
+            with tempfile.TemporaryDirectory() as workingdir:
+                path = os.path.join(workingdir, candidate["name"])
+                decode_file(candidate["content"], path)
+                res = add_candidate_to_corpus(self.corpusdir, path, True)
+                if None != res:
+                    log_reduction(self.corpusdir, candidate["tag"], task.test,
+                                  res)
+                    added += 1
+                    pass
+                pass
+            pass
+        # Whether an output is new is up to the coordinator's corpus, not
+        # the worker's
+        outcome = attempt.outcome
+        if outcome in ["new", "duplicate"]:
+            outcome = "duplicate"
+            if 0 != added:
+                outcome = "new"
+                pass
+            pass
+        attempt = attempt._replace(outcome=outcome)
+        ReducerLedger(self.corpusdir).record(attempt)
+        task.future.set_result(ReducerResult(outcome, attempt.outputsigs,
+                                             attempt.output_size))
+        pass
+    pass
+
+# Run one task from the coordinator in workdir, and return the message to
+# answer with.  workdir holds a scratch corpus of the worker's own, which
+# reducers add their candidates to, and whose observation store keeps the
+# outcomes of tests (e.g. for reducers which check a test fails first).
+def run_task(task, builddir, workdir):
+    corpusdir = os.path.join(workdir, "corpus")
+    inputdir = os.path.join(workdir, "inputs")
+    os.makedirs(corpusdir, exist_ok=True)
+    os.makedirs(inputdir, exist_ok=True)
+    test = os.path.join(inputdir, check_sent_name(task["name"]))
+    decode_file(task["content"], test)
+    try:
+        buildsig = get_run_environment(builddir).get_test_build_signature(test)
+        if buildsig != task["buildsig"]:
+            return {"type": "error", "id": task["id"],
+                    "message": "build signature %s for %s doesn't match the "
+                               "coordinator's %s" % (buildsig, task["name"],
+                                                      task["buildsig"])}
+        if task["kind"] == "observe":
+            obs = observe_test(builddir, test,
+                               get_observation_store(corpusdir),
+                               task["revision"])
+            return {"type": "result", "id": task["id"],
+                    "observation": obs._asdict()}
+        # Whatever the reducer adds to the scratch corpus is new as far as
+        # this worker knows, so is sent back.
+        logged = len(read_reduction_log(corpusdir))
+        reducer = reducers_by_name[task["reducer"]]
+        run_reducer(reducer, builddir, corpusdir, test)
+        attempt = ReducerLedger(corpusdir).lookup(
+            task["reducer"], sha1_of_files([test]), buildsig)
+        candidates = []
+        for toolname, _, to in read_reduction_log(corpusdir)[logged:]:
+            path = os.path.join(corpusdir, to)
+            candidates.append({"tag": toolname,
+                               "name": get_sent_name(path),
+                               "content": encode_file(path)})
+            pass
+        return {"type": "result", "id": task["id"],
+                "attempt": attempt._asdict(), "candidates": candidates}
+    except Exception:
+        traceback.print_exc()
+        return {"type": "failed", "id": task["id"],
+                "error": traceback.format_exc(limit=1)}
+    finally:
+        os.unlink(test)
+        pass
+    pass
+
+# Connect to the coordinator at address and run tasks until it's done.
+# Returns False if the coordinator refused us.
+def run_worker(address, builddir, workdir):
+    family, addr = parse_address(address)
+    runenv = get_run_environment(builddir)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(addr)
+        f = sock.makefile('rwb')
+        send_message(f, {"type": "hello",
+                         "buildsig": runenv.get_build_signature(),
+                         "machinesig": runenv.get_machine_signature(),
+                         "host": socket.gethostname()})
+        reply = receive_message(f)
+        if None == reply or reply["type"] != "welcome":
+            message = "connection closed"
+            if None != reply:
+                message = reply.get("message")
+                pass
+            print ("Coordinator refused us: %s" % message)
+            return False
+        while True:
+            send_message(f, {"type": "get"})
+            task = receive_message(f)
+            if None == task or task["type"] == "done":
+                return True
+            print ("Task %d: %s %s %s" % (task["id"], task["kind"],
+                                           task["name"],
+                                           task.get("reducer", "")))
+            try:
+                result = run_task(task, builddir, workdir)
+            except ProtocolError as e:
+                print ("Giving up: %s" % e)
+                return False
+            send_message(f, result)
+            if result["type"] == "error":
+                print ("Giving up: %s" % result["message"])
+                return False
+            pass
+        pass
+    pass
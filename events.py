@@ -0,0 +1,96 @@
+# A structured log of where time goes.  Each test run, reducer run, corpus
+# scan and content hash appends one JSON line to events.log in CORPUS_DIR,
+# recording (besides whatever the caller adds, e.g. sizes and outcomes):
+#   event - what happened ("run_test", "reducer", "scan", "hash")
+#   time - when it started (seconds since the epoch)
+#   pid - of the process it happened in
+#   wall - elapsed seconds
+#   user, sys - CPU seconds used by the process itself
+#   child_user, child_sys - CPU seconds used by child processes which
+#     finished during the event
+#   child_maxrss_kb - the peak RSS of the largest child this process has
+#     had so far (getrusage only offers a high-water mark)
+#
+# Note: the child figures cover all of a process's children, so where one
+# process runs several things at once (i.e. threads), they overlap.  Each
+# worker in manage-corpus.py's pool runs one thing at a time.
+#
+# Nothing is logged until set_event_log is called, which the drivers do (in
+# each worker, too).  See summarize-events.py for making sense of the log.
+
+import os
+import json
+import time
+import resource
+import contextlib
+
+EVENTS_NAME = "events.log"
+
+event_log_path = None
+# (pid, fd) of the open log, so that a forked child opens its own
+event_log_fd = (None, None)
+
+def set_event_log(corpusdir):
+    global event_log_path
+    event_log_path = os.path.join(os.path.abspath(corpusdir), EVENTS_NAME)
+    pass
+
+def get_event_log_fd():
+    global event_log_fd
+    if None == event_log_path:
+        return None
+    pid, fd = event_log_fd
+    if pid != os.getpid():
+        # Note: with O_APPEND, each (small) write lands whole at the end of
+        # the file, even with several processes writing.
+        fd = os.open(event_log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        event_log_fd = (os.getpid(), fd)
+        pass
+    return fd
+
+def is_logging_events():
+    return None != event_log_path
+
+def write_event(record):
+    fd = get_event_log_fd()
+    if None == fd:
+        return
+    os.write(fd, (json.dumps(record, sort_keys=True) + "\n").encode())
+    pass
+
+# Log an event for the body of the with statement.  Yields a dict of the
+# fields to log, which the body can add to.
+@contextlib.contextmanager
+def timed_event(kind, **fields):
+    if not is_logging_events():
+        yield fields
+        return
+    start_self = resource.getrusage(resource.RUSAGE_SELF)
+    start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_time = time.time()
+    start = time.monotonic()
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        wall = time.monotonic() - start
+        end_self = resource.getrusage(resource.RUSAGE_SELF)
+        end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record = dict(fields)
+        record.update({
+            "event": kind,
+            "time": start_time,
+            "pid": os.getpid(),
+            "wall": wall,
+            "user": end_self.ru_utime - start_self.ru_utime,
+            "sys": end_self.ru_stime - start_self.ru_stime,
+            "child_user": end_children.ru_utime - start_children.ru_utime,
+            "child_sys": end_children.ru_stime - start_children.ru_stime,
+            "child_maxrss_kb": end_children.ru_maxrss,
+        })
+        write_event(record)
+        pass
+    pass
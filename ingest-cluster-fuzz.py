@@ -1,29 +1,28 @@
 #!/usr/bin/python3
 # Given a file downloaded from oss-fuzz, use the filename to try to
-# construct a self describing test, and add it to the corpus.
+# construct a self describing test, and add it to the corpus.  The test is
+# disassembled with the opt in LLVM_BUILD_DIR, and added to CORPUS_DIR (see
+# ossfuzz.py).  To add many at once, see ingest-oss-fuzz.py.
 
-import sys
-import os
-import subprocess
-import common
+from common import *
+from ossfuzz import *
 
-bcfile = sys.argv[1]
-chunks = bcfile.split('-')
-testid = chunks[len(chunks)-1]
-passname = chunks[len(chunks)-2].replace('_', '-')
+config = load_and_validate_comfig()
+set_corpus_compression(config.get("CORPUS_COMPRESSION"))
+builddir = config["LLVM_BUILD_DIR"]
+root = os.path.abspath(config["CORPUS_DIR"])
 
-print ([testid, passname])
+bcfile = sys.argv[1]
+parsed = parse_testcase_name(bcfile)
+if None == parsed:
+    print ("Can't tell which pass to run from the name of %s" % bcfile)
+    sys.exit(1)
+print (list(parsed))
 
-testfile = "./example-corpus/oss_fuzz/%s.ll" % testid
-print (testfile)
-if os.path.exists(testfile):
-    print ("Test already ingested?")
-    #sys.exit(1)
-cmd = "~/llvm-dev/build/bin/opt -S %s -o %s" % (bcfile, testfile)
-print (cmd)
-subprocess.run(cmd, #capture_output=True,
-               timeout=30, shell=True)
-header = [ "; RUN: opt -%s -S < %s\n" % (passname, "%s"),
-           "; XFAIL: *\n",
-           "; REQUIRES: asserts\n" ]
-common.rewrite_candidate(header, testfile)
+outcome, result = ingest_testcase_file(bcfile, builddir, root)
+if outcome == "seen":
+    print ("Test already ingested")
+elif outcome == "failed":
+    print ("Failed to ingest %s: %s" % (bcfile, result.strip()))
+    sys.exit(1)
+    pass
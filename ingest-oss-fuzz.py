@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# ingest-oss-fuzz.py [-j N] source...
+#   Add the testcases downloaded from oss-fuzz in each source (a directory,
+#   or a tar or zip archive) to the corpus, as ingest-cluster-fuzz.py does
+#   for a single file.  Archives are read as a stream, so only the
+#   testcases being worked on are ever on disk.  Files which aren't bitcode,
+#   or whose name doesn't say which pass to run, are skipped.
+#
+#   Testcases are deduplicated by content hash before they're disassembled,
+#   both within this run and against every testcase ingested before (see
+#   IngestedTestcases).  Those which fail to disassemble (e.g. as the build
+#   is too old to read them) are tried again next time.
+#
+#   With -j N, up to N testcases are disassembled (with the opt in
+#   LLVM_BUILD_DIR) and added at once, on a pool of worker processes.
+
+import argparse
+import concurrent.futures
+from common import *
+from ossfuzz import *
+from jobserver import setup_jobserver
+from events import set_event_log
+from triage_db import IngestedTestcases
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", dest="jobs", type=int, default=1,
+                    help="number of testcases to convert in parallel")
+parser.add_argument("sources", nargs="+")
+args = parser.parse_args()
+
+config = load_and_validate_comfig()
+builddir = config["LLVM_BUILD_DIR"]
+root = os.path.abspath(config["CORPUS_DIR"])
+set_event_log(root)
+compression = config.get("CORPUS_COMPRESSION")
+set_corpus_compression(compression)
+ingested = IngestedTestcases(root)
+counts = {}
+
+def count(outcome):
+    counts[outcome] = counts.get(outcome, 0) + 1
+    pass
+
+# Each testcase in flight maps to (its name, content hash, file)
+pending = {}
+def finish(future):
+    name, sha1, bcfile = pending.pop(future)
+    outcome, result = future.result()
+    os.unlink(bcfile)
+    count(outcome)
+    if outcome == "failed":
+        print ("Failed to ingest %s: %s" % (name, result.strip()))
+        return
+    ingested.record(sha1, name, outcome, result)
+    pass
+
+# Note: the workers share a budget of -j jobs with any other driver on this
+# machine using the same jobserver.
+setup_jobserver(args.jobs)
+seen = set()
+with tempfile.TemporaryDirectory() as workdir, \
+     make_executor(args.jobs, init_corpus_worker,
+                   (root, compression)) as executor:
+    for source in args.sources:
+        for name, content in read_testcases(source):
+            if not is_bitcode(content) or None == parse_testcase_name(name):
+                count("skipped")
+                continue
+            sha1 = get_testcase_hash(content)
+            if sha1 in seen or ingested.contains(sha1):
+                count("seen")
+                continue
+            seen.add(sha1)
+            # Keep only a few testcases (per job) on disk at a time
+            while len(pending) >= 2 * max(args.jobs, 1):
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+                    pass
+                pass
+            bcfile = os.path.join(workdir, "%s.bc" % sha1)
+            with open(bcfile, 'wb') as f:
+                f.write(content)
+                pass
+            future = executor.submit(ingest_testcase, bcfile, name, builddir,
+                                     root)
+            pending[future] = (name, sha1, bcfile)
+            pass
+        pass
+    for future in concurrent.futures.as_completed(list(pending)):
+        finish(future)
+        pass
+    pass
+
+for outcome in ["added", "duplicate", "seen", "skipped", "failed"]:
+    print ("%s: %d" % (outcome, counts.get(outcome, 0)))
+    pass
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# A machine-wide budget of CPU-heavy jobs, shared by the drivers, their
+# worker processes, and the reducers those launch.
+#
+# This is the GNU make jobserver protocol over a named pipe: the pipe holds
+# one byte (token) per job slot, a job reads a token before starting, and
+# writes it back when done.  The pipe is named by TRIAGE_JOBSERVER (as
+# "fifo:PATH") in the environment, so every process started from a driver
+# shares it.  If there's none, a driver creates its own with -j tokens.  A
+# driver started from make with a fifo jobserver (make 4.4 and later) joins
+# make's instead.  make doesn't put a token in the pipe for the job slot the
+# driver itself was started on, so the driver keeps that one in a pipe of its
+# own (named by TRIAGE_IMPLICIT_TOKEN), which jobs take from first.
+#
+# To share one budget between drivers started separately, run
+#   jobserver.py PATH N
+# and start each driver with TRIAGE_JOBSERVER=fifo:PATH.  (A pipe loses its
+# tokens once nothing has it open, so something has to keep it open.)
+
+import os
+import sys
+import re
+import select
+import atexit
+import shutil
+import tempfile
+import contextlib
+
+JOBSERVER_ENV = "TRIAGE_JOBSERVER"
+IMPLICIT_TOKEN_ENV = "TRIAGE_IMPLICIT_TOKEN"
+
+class JobServer:
+    def __init__(self, path):
+        self.path = path
+        # Open for both reading and writing so that neither blocks waiting
+        # for the other end, and reads can be non-blocking.
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        pass
+
+    # Take up to count tokens without waiting, and return them.
+    def try_acquire(self, count):
+        if count <= 0:
+            return b""
+        try:
+            return os.read(self.fd, count)
+        except BlockingIOError:
+            return b""
+
+    # Wait for a token, and return it.
+    def acquire(self):
+        while True:
+            select.select([self.fd], [], [])
+            tokens = self.try_acquire(1)
+            if 0 != len(tokens):
+                return tokens
+            pass
+
+    def release(self, tokens):
+        if 0 != len(tokens):
+            os.write(self.fd, tokens)
+            pass
+        pass
+    pass
+
+# Create a new pipe holding jobs tokens.  The returned JobServer keeps it
+# open.
+def create_jobserver(path, jobs):
+    os.mkfifo(path)
+    jobserver = JobServer(path)
+    jobserver.release(b"+" * jobs)
+    return jobserver
+
+def get_make_jobserver_path():
+    match = re.search(r"--jobserver-auth=fifo:(\S+)",
+                      os.environ.get("MAKEFLAGS", ""))
+    if None == match:
+        return None
+    return match.group(1)
+
+# Create a pipe holding jobs tokens in a new temporary directory, which is
+# removed on exit, and return its path.
+def create_own_jobserver(jobs):
+    tempdir = tempfile.mkdtemp(prefix="triage-jobserver-")
+    atexit.register(shutil.rmtree, tempdir, True)
+    path = os.path.join(tempdir, "fifo")
+    global own_jobserver
+    own_jobserver = create_jobserver(path, jobs)
+    return path
+
+# Make sure there's a jobserver for this process and its children.  Called by
+# the drivers before starting any workers.
+def setup_jobserver(jobs):
+    if JOBSERVER_ENV in os.environ:
+        return
+    path = get_make_jobserver_path()
+    if None != path:
+        # Note: make counts the token it started us with as already taken,
+        # so the pipe only has tokens for our other jobs.  Without the
+        # implicit one, make -j2 would leave us none at all.
+        print ("Using make's jobserver %s" % path)
+        os.environ[IMPLICIT_TOKEN_ENV] = "fifo:" + create_own_jobserver(1)
+    else:
+        path = create_own_jobserver(max(jobs, 1))
+        pass
+    os.environ[JOBSERVER_ENV] = "fifo:" + path
+    pass
+
+own_jobserver = None
+
+# Each process opens the pipe for itself.
+jobservers = {}
+
+def get_jobserver(env=JOBSERVER_ENV):
+    value = os.environ.get(env)
+    if None == value or not value.startswith("fifo:"):
+        return None
+    key = (os.getpid(), value)
+    if key not in jobservers:
+        jobservers[key] = JobServer(value[len("fifo:"):])
+        pass
+    return jobservers[key]
+
+# Wait for a token, from the implicit token's pipe if there is one and it's
+# free, and otherwise from jobserver.  Returns the token, and the JobServer
+# to give it back to.
+def acquire_token(jobserver):
+    sources = [x for x in [get_jobserver(IMPLICIT_TOKEN_ENV), jobserver]
+               if None != x]
+    while True:
+        for source in sources:
+            token = source.try_acquire(1)
+            if 0 != len(token):
+                return token, source
+            pass
+        select.select([x.fd for x in sources], [], [])
+        pass
+    pass
+
+# Hold a token for the duration of a job.  Without a jobserver, this does
+# nothing.
+@contextlib.contextmanager
+def job_token():
+    jobserver = get_jobserver()
+    if None == jobserver:
+        yield
+        return
+    token, source = acquire_token(jobserver)
+    try:
+        yield
+    finally:
+        source.release(token)
+        pass
+    pass
+
+# Take up to limit tokens beyond the one held by the current job, if they're
+# free right now, for a tool which can use more than one core.  Yields the
+# number taken.
+@contextlib.contextmanager
+def extra_job_tokens(limit):
+    jobserver = get_jobserver()
+    if None == jobserver:
+        yield 0
+        return
+    tokens = jobserver.try_acquire(limit)
+    try:
+        yield len(tokens)
+    finally:
+        jobserver.release(tokens)
+        pass
+    pass
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print ("usage: jobserver.py path jobs")
+        sys.exit(1)
+    jobserver = create_jobserver(sys.argv[1], int(sys.argv[2]))
+    print ("export %s=fifo:%s" % (JOBSERVER_ENV, sys.argv[1]))
+    try:
+        select.select([], [], [])
+    except KeyboardInterrupt:
+        pass
+    os.unlink(sys.argv[1])
+    pass
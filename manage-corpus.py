@@ -1,11 +1,31 @@
 #!/usr/bin/python3
-# manage-corpus.py <list-of-new-files>
+# manage-corpus.py [-j N] [--time-budget SECONDS] <list-of-new-files>
 #   If given a list of files, will try to maximally reduce all examples. If
 #   not given a list of files, will try to maximally reduce all files in the
 #   corpus. Will also print errors for any obvious malformed entiries
 #   encountered.
 #
-#   Uses configuration state from config.json
+#   With -j N, up to N tests (or reducers for the same test) are run at once
+#   on a pool of worker processes.  Each holds a token from a jobserver (see
+#   jobserver.py) while it runs, and reducers which can use several cores
+#   (llvm-reduce, creduce) are given any tokens left over.
+#
+#   Tests are worked on in priority order (see scheduler.py), by default
+#   new and novel crashes first, then smaller tests, and then tests of the
+#   kinds which have given the most reductions.  --priority picks another
+#   policy.  With --time-budget, no new work is started once that many
+#   seconds have passed.
+#
+#   With --serve ADDRESS (host:port or unix:path), tests and reducers are
+#   run by corpus-worker.py processes which connect to ADDRESS, possibly on
+#   other machines, instead (see distributed.py).  -j N then sets how many
+#   tasks are handed out at once, so should be at least the total number
+#   of workers.  The protocol is unauthenticated, so ADDRESS should only be
+#   reachable by trusted hosts (e.g. localhost, or a Unix domain socket).
+#
+#   Uses configuration state from config.json.  What each test run, reducer
+#   run and corpus scan cost is logged to events.log in the corpus (see
+#   summarize-events.py).
 #
 #   IMPORTANT: Assumes (but does not check) that binaries in build-dir
 #   correspond to a build of the source at revision.
@@ -15,8 +35,14 @@
 import hashlib
 import sys
 import os
-import glob
+import argparse
+import concurrent.futures
+import time
 from common import *
+from scheduler import WorkItem, ReductionQueue, priorities
+from jobserver import setup_jobserver
+from events import set_event_log
+from distributed import Coordinator
 
 # We reduce each file with all available reducers, and then iteratively
 # reduce newly produce files until a fixed point is reached.  The idea is
@@ -28,24 +54,82 @@ from common import *
 # reduced was the one you started with.
 
 visited = set()
-worklist = []
+visited_canonical = set()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", dest="jobs", type=int, default=1,
+                    help="number of tests/reducers to run in parallel")
+parser.add_argument("--time-budget", type=float, default=None,
+                    help="stop starting new work after this many seconds")
+parser.add_argument("--priority", choices=sorted(priorities),
+                    default="default",
+                    help="the order to work through tests in")
+parser.add_argument("--serve", default=None, metavar="ADDRESS",
+                    help="hand out work to corpus-worker.py processes; "
+                    "the protocol is unauthenticated, so only use localhost "
+                    "or unix:PATH on untrusted networks")
+parser.add_argument("files", nargs="*")
+args = parser.parse_args()
+deadline = None
+if args.time_budget != None:
+    deadline = time.monotonic() + args.time_budget
+    pass
+worklist = ReductionQueue(priorities[args.priority])
+
+def out_of_time():
+    return None != deadline and time.monotonic() > deadline
 
 config = load_and_validate_comfig()
 revision = config["LLVM_BUILD_REVISION"]
 builddir = config["LLVM_BUILD_DIR"]
 root = os.path.abspath(config["CORPUS_DIR"])
+# Log where the time goes (see events.py and summarize-events.py)
+set_event_log(root)
+# Store large new entries compressed, if so configured
+compression = config.get("CORPUS_COMPRESSION")
+set_corpus_compression(compression)
+
+# The first refresh of the index checks every file in the corpus for changes
+# since the last run.  After that, reducers add their output to the index
+# directly, and rescans only need to look for other newly added files.
+index = get_corpus_index(root)
+buckets = CrashBuckets(root)
+ledger = ReducerLedger(root)
+store = get_observation_store(root)
+runenv = get_run_environment(builddir)
+refresh_corpus_index(index, root)
+last_seen_id = 0
+reduction_counts = {}
 
 targets = None
-if len(sys.argv) > 1:
-    targets = [os.path.abspath(x) for x in sys.argv[1:]]
-    for f in glob.iglob(root + "/**", recursive=True):
-        if os.path.isdir(f):
+if len(args.files) > 0:
+    targets = [os.path.abspath(x) for x in args.files]
+    for _, entry in index.entries_since(last_seen_id):
+        if entry.path in targets:
             continue
-        if f in visited:
-            continue
-        if f in targets:
-            continue
-        visited.add(f)
+        visited.add(entry.path)
+
+# Gather the (cheap) signals the scheduler orders the worklist by.  Note:
+# with --serve, the workers' observations are recorded under this machine's
+# signature too (see distributed.py).
+def make_work_item(entry, yields):
+    obs = store.lookup(entry.sha1, runenv.get_test_build_signature(entry.path),
+                       runenv.get_machine_signature())
+    crashsig = None
+    if None != obs:
+        crashsig = obs.crashsig
+        pass
+    bucket_is_novel = True
+    if None != crashsig:
+        smallest = buckets.smallest_reproducer(crashsig, obs.configsig,
+                                               entry.sha1)
+        bucket_is_novel = (buckets.reduction_count(crashsig, obs.configsig) == 0
+                           and (None == smallest or
+                                smallest > SMALL_REPRODUCER_SIZE))
+        pass
+    ext = get_test_ext(entry.path)
+    return WorkItem(entry.path, entry.content_size, None == obs, crashsig,
+                    bucket_is_novel, yields.get(ext, 0))
 
 rescan_count = 0
 def rescan_corpus():
@@ -55,66 +139,127 @@ def rescan_corpus():
     # new distinct output.  Note that we don't care about alternating cases
     # (since those stablize to a fixed set), only an infinite series of new
     # output files.
-    global rescan_count
+    global rescan_count, last_seen_id, reduction_counts
     assert rescan_count < 50
     rescan_count += 1
-    for f in glob.iglob(root + "/**", recursive=True):
-        if os.path.isdir(f):
-            continue
+    if rescan_count > 1:
+        refresh_corpus_index(index, root, trust_dir_mtimes=True)
+        pass
+    yields = load_reduction_yields(root)
+    reduction_counts = load_reduction_counts(root)
+    for entry_id, entry in index.entries_since(last_seen_id):
+        last_seen_id = entry_id
+        f = entry.path
         if f in visited:
             continue
         visited.add(f)
         # Validate the test, but do nothing else if we can't find a valid
         # runline.  By doing this after the visited check, we only verify
         # each file once, no matter how many times we rescan.
-        if None == get_valid_run_line(f, verbose=True):
+        if None == entry.runline:
+            # Reparse just to report why
+            get_valid_run_line(f, verbose=True)
+            continue
+        # Tests which differ only in e.g. the names of struct types (which
+        # reduction tends to remangle) are the same test, so only the first
+        # is worked on.
+        if entry.canonical_sha1 in visited_canonical:
+            print ("Skipping %s: equivalent to a test already seen" % f)
             continue
-        # Workaround a really annoying 'bug' where reducing a case with a
-        # struct type ends up always remangling the type, and thus always
-        # producing a new distinct output.  Do to this hack, we loose the
-        # ability to cross reduce any test involving struct types.
-        if rescan_count > 0 and " type {" in open(f, 'r').read():
-            continue;
+        visited_canonical.add(entry.canonical_sha1)
         
-        worklist.append(os.path.abspath(f))
+        worklist.push(make_work_item(entry, yields))
         pass
     pass
 
 
-rescan_corpus()
-while 0 != len(worklist):
-    test = worklist.pop()
+# Each task in flight maps to the test it was run on, and the reducer (or
+# None for the initial run of the test itself).  Results are only consumed
+# here in the driver, so visited and worklist are never shared with the
+# workers.  New files produced by reducers are picked up by the rescan once
+# everything in flight has drained.
+pending = {}
+def schedule_test(executor, test):
     print(test)
+    # Note: the run is saved to the observation store, and a test whose
+    # outcome on this build is already known isn't run again.
+    future = executor.submit(observe_corpus_test, test, builddir, root,
+                             revision)
+    pending[future] = (test, None)
+    pass
 
-    # TODO: save a record to the observation log since we had to run it anyway
-    completed = run_test(test, builddir)
-    if completed.returncode == 0:
-        print ("Skipping reduction of test which does not fail")
-        continue
-
-    ext = os.path.splitext(test)[1]
-
-    if ext in [".c", ".cc", ".cpp", ".cxx"]:
-        # Note: creduce can be applied to other input types, but it is
-        # *slow* compared to other reducers.  Given that, if we have a
-        # dedicated reducer for the input language, we chose not to.
-        reduce_with_creduce(builddir, root, test)
-        pass
-
-    if ext == ".ll":
-        reduce_with_bugpoint(builddir, root, test)
-        reduce_with_llvm_reduce(builddir, root, test)
-        vary_opt_pass(builddir, root, test)
+def schedule_reducers(executor, test, obs):
+    if out_of_time():
+        print ("Time budget exhausted, not reducing %s" % test)
+        return
+    # Don't spend reduction effort on yet another copy of a bug we already
+    # have a small reproducer for (or have tried hard enough to reduce).
+    reason = get_bucket_skip_reason(buckets, obs, test)
+    if None != reason:
+        print ("Skipping reduction of %s: %s" % (test, reason))
+        return
+    # Nor on rerunning reducers which have already been tried on this exact
+    # input, whatever came of it.
+    reducers = get_untried_reducers(ledger, test, obs.testsig, obs.buildsig)
+    # And start with the reducers which have done best on this kind of
+    # input, skipping those which have never done anything with it.
+    reducers = choose_reducers(ledger, test, reducers, reduction_counts)
+    if 0 == len(reducers):
+        return
+    if None != obs.crashsig:
+        buckets.note_reduction(obs.crashsig, obs.configsig)
         pass
 
     # TODO
-    # for .ll files:
-    #   add brute force pass reduction
-    #   add crash isolation (e.g. capture IR just before crash)
     # for .c, .cpp extension
     #   use -emit-llvm C-->LL for attempted
+    for reducer in reducers:
+        future = executor.submit(run_reducer, reducer, builddir, root, test)
+        pending[future] = (test, reducer)
+        pass
+    pass
+
+# Note: the workers (and the reducers they run) share a budget of -j jobs with
+# any other driver on this machine using the same jobserver.
+setup_jobserver(args.jobs)
+rescan_corpus()
+if None != args.serve:
+    executor = Coordinator(args.serve, builddir, root)
+else:
+    executor = make_executor(args.jobs, init_corpus_worker,
+                             (root, compression))
+    pass
+with executor:
+    while 0 != len(worklist) or 0 != len(pending):
+        # Keep the pool busy, but don't pull everything off the worklist at
+        # once so that reducers of failing tests get a chance to start.
+        while 0 != len(worklist) and len(pending) < max(args.jobs, 1):
+            if out_of_time():
+                print ("Time budget exhausted, leaving %d tests unreduced" %
+                       len(worklist))
+                worklist = ReductionQueue(priorities[args.priority])
+                break
+            schedule_test(executor, worklist.pop().path)
+            pass
+
+        done, _ = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            test, reducer = pending.pop(future)
+            # Propagate any failure from the worker
+            result = future.result()
+            if reducer != None:
+                continue
+            if result.outcome != "fail":
+                print ("Skipping reduction of test which does not fail")
+                continue
+            schedule_reducers(executor, test, result)
+            pass
 
-    if 0 == len(worklist):
-        rescan_corpus()
+        if 0 == len(worklist) and 0 == len(pending):
+            if out_of_time():
+                break
+            rescan_corpus()
+            pass
         pass
     pass
@@ -0,0 +1,138 @@
+# Turning testcases from oss-fuzz into tests.  LLVM's opt fuzzers report
+# crashes as bitcode files, named after the fuzzer and the pass it ran,
+# e.g.
+#   clusterfuzz-testcase-minimized-llvm-opt-fuzzer--x86_64-instcombine-5094403218341888
+# Each is disassembled with the opt from the build, and given a header with
+# a RUN line running that pass (see get_testcase_header).
+#
+# Testcases come one at a time, or in bulk as the files in a directory or
+# the members of a tar or zip archive (see read_testcases), which are read
+# one at a time rather than extracted all at once.
+
+import os
+import stat
+import tarfile
+import zipfile
+import hashlib
+import subprocess
+from common import *
+from triage_db import IngestedTestcases
+
+# Bitcode, either raw or in the wrapper (see llvm/Bitcode/BitcodeReader.h)
+bitcode_magics = [b"BC\xc0\xde", b"\xde\xc0\x17\x0b"]
+
+# Long enough to check for a magic
+MAGIC_SIZE = 4
+
+# How long opt gets to disassemble one testcase
+DISASSEMBLE_TIMEOUT = 30
+
+def is_bitcode(data):
+    return data[:MAGIC_SIZE] in bitcode_magics
+
+# Returns (testid, pass name) from the name of a testcase, or None if the
+# name doesn't say.
+def parse_testcase_name(name):
+    chunks = os.path.basename(name).split('-')
+    if len(chunks) < 2 or chunks[-2] == "":
+        return None
+    return chunks[-1], chunks[-2].replace('_', '-')
+
+def get_testcase_header(passname):
+    return ["; RUN: opt -%s -S < %s\n" % (passname, "%s"),
+            "; XFAIL: *\n",
+            "; REQUIRES: asserts\n"]
+
+# Yields (name, content) for each (regular) file in source, which is a
+# directory or a tar or zip archive (compressed or not), in order.  Members
+# are read as they're yielded, so e.g. a compressed tar is only read through
+# once.
+def read_testcases(source):
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if not stat.S_ISREG(os.lstat(path).st_mode):
+                    continue
+                with open(path, 'rb') as f:
+                    yield path, f.read()
+                    pass
+                pass
+            pass
+        return
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as f:
+                    yield info.filename, f.read()
+                    pass
+                pass
+            pass
+        return
+    # Note: "r|*" reads the tar as a stream, without seeking back
+    with tarfile.open(source, "r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            with archive.extractfile(member) as f:
+                yield member.name, f.read()
+                pass
+            pass
+        pass
+    pass
+
+# Disassemble the bitcode in bcfile (a testcase called name) to a test next
+# to it, and add that to the corpus.  Returns ("added", path in the corpus),
+# ("duplicate", None) if the corpus already has it, or ("failed", message).
+def ingest_testcase(bcfile, name, builddir, corpusdir):
+    _, passname = parse_testcase_name(name)
+    testfile = os.path.splitext(bcfile)[0] + ".ll"
+    opt = get_run_environment(builddir).find_tool("opt")
+    try:
+        with job_token():
+            completed = run_with_kill_timer([opt, "-S", bcfile, "-o",
+                                             testfile], DISASSEMBLE_TIMEOUT)
+            pass
+        if completed.returncode != 0:
+            return "failed", completed.stderr.decode(errors="replace")
+        rewrite_candidate(get_testcase_header(passname), testfile)
+        path = add_candidate_to_corpus(corpusdir, testfile, True)
+        if None == path:
+            return "duplicate", None
+        return "added", path
+    except subprocess.TimeoutExpired:
+        return "failed", "opt -S timed out"
+    finally:
+        if os.path.exists(testfile):
+            os.unlink(testfile)
+            pass
+        pass
+    pass
+
+# The content hash by which testcases are deduplicated
+def get_testcase_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+# Ingest the testcase at bcfile (as ingest_testcase does), unless one with
+# the same content was ingested before.  Returns the outcome, as
+# ingest_testcase, or ("seen", None).
+def ingest_testcase_file(bcfile, builddir, corpusdir):
+    with open(bcfile, 'rb') as f:
+        sha1 = get_testcase_hash(f.read())
+        pass
+    ingested = IngestedTestcases(corpusdir)
+    if ingested.contains(sha1):
+        return "seen", None
+    # Work on a copy, as the test is written next to it
+    with tempfile.TemporaryDirectory() as workdir:
+        copy = os.path.join(workdir, "%s.bc" % sha1)
+        shutil.copyfile(bcfile, copy)
+        outcome, result = ingest_testcase(copy, bcfile, builddir, corpusdir)
+        pass
+    if outcome != "failed":
+        ingested.record(sha1, bcfile, outcome, result)
+        pass
+    return outcome, result
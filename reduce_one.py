@@ -1,17 +1,18 @@
 #!/usr/bin/python3
 # reduce_one.py reducer testfile
 #   Reduce a single standalone test via the specified reducer, and add the
-#   fully reduced result back to the corpus.  Uses configuration state from
-#   config.json
+#   fully reduced result back to the corpus.  reducer is any of the names in
+#   reducer_names (e.g. llvm-reduce, pass-pipeline or opt-bisect), or a tag
+#   from the reduction log (e.g. llvm-reduce-crash-unconstrained).  The
+#   attempt is recorded in the reducer-attempt ledger, as for
+#   manage-corpus.py.  Uses configuration state from config.json
 #
 #   IMPORTANT: Assumes (but does not check) that binaries in build-dir
 #   correspond to a build of the source at revision.
 
-import tempfile
 from common import *
 
 import os
-import shutil
 
 reducer = sys.argv[1]
 test = os.path.abspath(sys.argv[2])
@@ -20,21 +21,17 @@ config = load_and_validate_comfig()
 revision = config["LLVM_BUILD_REVISION"]
 builddir = config["LLVM_BUILD_DIR"]
 corpusdir = os.path.abspath(config["CORPUS_DIR"])
+set_corpus_compression(config.get("CORPUS_COMPRESSION"))
 
-if reducer.endswith("-crash-unconstrained"):
-    reducer = reducer[0:len(reducer)-len("-crash-unconstrained")]
+if (reducer not in reducers_by_name and
+    None != get_reducer_name_for_tag(reducer)):
+    reducer = get_reducer_name_for_tag(reducer)
     print (reducer)
     pass
+if reducer not in reducers_by_name:
+    print ("Unsupported reducer: %s (expected one of %s)" %
+           (reducer, ", ".join(sorted(reducers_by_name))))
+    sys.exit(1)
 
-if reducer == "llvm-reduce":
-    reduce_with_llvm_reduce(builddir, corpusdir, test)
-elif reducer == "bugpoint":
-    reduce_with_bugpoint(builddir, corpusdir, test)
-elif reducer == "creduce":
-    reduce_with_creduce(builddir, corpusdir, test)
-elif reducer == "opt-analysis-isolate-crash-unconstrained":
-    vary_opt_pass(builddir, corpusdir, test)
-elif reducer == "clang-to-opt":
-    convert_clang_test_to_opt_test(builddir, corpusdir, test)
-else:
-    print ("Unsupported reducer: %s" % reducer)
+result = run_reducer(reducers_by_name[reducer], builddir, corpusdir, test)
+print ("%s: %s" % (reducer, result.outcome))
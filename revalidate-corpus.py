@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# revalidate-corpus.py [-j N] [--previous-revision REV] [--output FILE]
+#   Run every test in the corpus against the build in config.json (e.g.
+#   after moving LLVM_BUILD_DIR to a new revision), and compare each outcome
+#   with the test's outcome on the previous build.  An observation log
+#   record (see run-one.py) is printed for each test as its run completes.
+#
+#   Tests whose outcome on this build is already known, i.e. whose content
+#   and the tool they run (see get_tool_fingerprint) are unchanged since
+#   they were last run, aren't run again.
+#
+#   Each test is compared with how it did in the last revalidation of
+#   another build on this machine (or with --previous-revision, of a build
+#   of REV).  Before there's been one, it's compared with the test's most
+#   recent run on a build of REV; without --previous-revision, that's the
+#   one other build anything has been run on, and it's an error if there's
+#   more than one (e.g. from bisect-builds.py).  Each test is put in one of
+#   these categories:
+#     new - never run on another build
+#     newly-fixed - failed before, passes now
+#     newly-failing - passed before, fails now
+#     still-failing - fails with the same crash signature
+#     changed-crash - still fails, but with a different crash signature
+#     changed-outcome - any other change, e.g. to or from a timeout
+#     unchanged - same outcome as before, other than a failure
+#   The paths in each (other than unchanged), along with the outcome before
+#   and now, are written as JSON to FILE (revalidation.json in CORPUS_DIR
+#   by default), and the number in each category is printed at the end.
+#
+#   With -j N, up to N tests are run at once, as with manage-corpus.py.
+
+import argparse
+import concurrent.futures
+from common import *
+from jobserver import setup_jobserver
+from events import set_event_log
+from triage_db import Revalidations
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", dest="jobs", type=int, default=1,
+                    help="number of tests to run in parallel")
+parser.add_argument("--previous-revision", default=None, metavar="REV")
+parser.add_argument("--output", default=None, metavar="FILE")
+args = parser.parse_args()
+
+config = load_and_validate_comfig()
+revision = config["LLVM_BUILD_REVISION"]
+builddir = config["LLVM_BUILD_DIR"]
+root = os.path.abspath(config["CORPUS_DIR"])
+set_event_log(root)
+compression = config.get("CORPUS_COMPRESSION")
+
+index = get_corpus_index(root)
+refresh_corpus_index(index, root)
+store = get_observation_store(root)
+runenv = get_run_environment(builddir)
+machinesig = runenv.get_machine_signature()
+configsig = runenv.get_build_signature()
+if None == args.output:
+    args.output = os.path.join(root, "revalidation.json")
+    pass
+
+# What to compare against: the tests' builds in the last revalidation, or
+# failing that, their runs on some build of previous_revision.
+revalidations = Revalidations(root)
+last_revalidation = None
+previous_revision = args.previous_revision
+last = revalidations.last(revision, configsig, machinesig,
+                          args.previous_revision)
+if None != last:
+    last_revalidation, previous_revision = last
+    print ("Comparing with revalidation of %s" % previous_revision)
+elif None == previous_revision:
+    others = store.get_other_builds(revision, configsig, machinesig)
+    if len(others) > 1:
+        print ("Tests have been run on %d other builds, but none has been "
+               "revalidated; use --previous-revision to pick one" %
+               len(others))
+        sys.exit(1)
+    if 1 == len(others):
+        previous_revision = others[0][0]
+        pass
+    pass
+
+categories = ["new", "newly-fixed", "newly-failing", "still-failing",
+              "changed-crash", "changed-outcome", "unchanged"]
+
+def categorize(previous, current):
+    if None == previous:
+        return "new"
+    if previous.outcome == "fail" and current.outcome == "fail":
+        if previous.crashsig == current.crashsig:
+            return "still-failing"
+        return "changed-crash"
+    if previous.outcome == "fail" and current.outcome == "pass":
+        return "newly-fixed"
+    if previous.outcome == "pass" and current.outcome == "fail":
+        return "newly-failing"
+    if previous.outcome == current.outcome:
+        return "unchanged"
+    return "changed-outcome"
+
+def describe(obs):
+    return {"revision": obs.revision, "outcome": obs.outcome,
+            "outputsig": obs.outputsig, "crashsig": obs.crashsig}
+
+def lookup_previous(obs):
+    if None != last_revalidation:
+        buildsig = revalidations.lookup(last_revalidation, obs.testsig)
+        if None == buildsig:
+            return None
+        return store.lookup(obs.testsig, buildsig, machinesig)
+    return store.lookup_previous(obs.testsig, obs.buildsig, machinesig,
+                                 previous_revision)
+
+diff = dict((category, []) for category in categories)
+revalidated = []
+def compare(test, obs):
+    print (", ".join(form_record(obs, builddir, test)), flush=True)
+    revalidated.append((obs.testsig, obs.buildsig))
+    previous = lookup_previous(obs)
+    category = categorize(previous, obs)
+    if category == "unchanged":
+        diff[category].append(test)
+        return
+    entry = {"path": test, "now": describe(obs)}
+    if None != previous:
+        entry["before"] = describe(previous)
+        pass
+    diff[category].append(entry)
+    pass
+
+# Only tests whose outcome isn't known yet go to the pool
+tests = []
+known = 0
+for _, entry in index.entries_since(0):
+    if None == entry.runline:
+        continue
+    obs = store.lookup(entry.sha1, runenv.get_test_build_signature(entry.path),
+                       machinesig)
+    if None != obs:
+        known += 1
+        compare(entry.path, obs._replace(revision=revision))
+        continue
+    tests.append(entry.path)
+    pass
+print ("%d tests to run, %d already known on this build" % (len(tests),
+                                                            known))
+
+# Note: the workers share a budget of -j jobs with any other driver on this
+# machine using the same jobserver.
+setup_jobserver(args.jobs)
+with make_executor(args.jobs, init_corpus_worker,
+                   (root, compression)) as executor:
+    futures = {}
+    for test in tests:
+        futures[executor.submit(observe_corpus_test, test, builddir, root,
+                                revision)] = test
+        pass
+    for future in concurrent.futures.as_completed(futures):
+        compare(futures[future], future.result())
+        pass
+    pass
+
+revalidations.record(revision, configsig, machinesig, revalidated)
+with open(args.output, 'w') as f:
+    json.dump({"revision": revision, "previous_revision":
+               previous_revision, "diff": diff}, f, indent=2)
+    pass
+for category in categories:
+    print ("%s: %d" % (category, len(diff[category])))
+    pass
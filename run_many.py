@@ -1,30 +1,70 @@
 #!/usr/bin/python3
-# run-many.py revision build-dir N testfile
+# run-many.py [-j jobs] [--adaptive K] revision build-dir N testfile
 #   Run a single standalone test multiple times on the binaries available in
-#   build-dir, and output a minimal set of observation log records reflecting
-#   those run.  Useful for checking whether a particular test is deterministic
-#   for a given environment.
+#   build-dir, and output an observation log record for each run as it
+#   completes.  Useful for checking whether a particular test is
+#   deterministic for a given environment.
+#
+#   With -j, up to jobs runs are done concurrently.  With --adaptive, stop
+#   early once K runs have all produced the same output signature (by the
+#   rule of three, that bounds the chance of any other output at 3/K with
+#   95% confidence), or as soon as two distinct output signatures are seen.
+#   A summary is printed to stderr at the end.
 #
 #   IMPORTANT: Assumes (but does not check) that binaries in build-dir
 #   correspond to a build of the source at revision.
 
+import argparse
+import concurrent.futures
 from common import *
-    
-revision = sys.argv[1]
-builddir = sys.argv[2]
-count = int(sys.argv[3])
-test = sys.argv[4]
 
-records = {}
-for i in range(0, count):
-    record = tuple(run_and_form_record(revision, builddir, test))
-    if record not in records:
-        records[record] = 0
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", dest="jobs", type=int, default=1)
+parser.add_argument("--adaptive", type=int, default=None, metavar="K")
+parser.add_argument("revision")
+parser.add_argument("builddir")
+parser.add_argument("count", type=int)
+parser.add_argument("test")
+args = parser.parse_args()
+
+# Note: tests are run with ASLR disabled (as setarch -R does), which
+# run_test sets up separately in each thread that runs them.
+outputsigs = {}
+completed = 0
+submitted = 0
+stop = False
+pending = set()
+with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    while (not stop and submitted < args.count) or 0 != len(pending):
+        while (not stop and submitted < args.count and
+               len(pending) < args.jobs):
+            pending.add(executor.submit(run_and_form_record, args.revision,
+                                        args.builddir, args.test))
+            submitted += 1
+            pass
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            record = future.result()
+            print (", ".join(record), flush=True)
+            outputsig = record[3]
+            outputsigs[outputsig] = outputsigs.get(outputsig, 0) + 1
+            completed += 1
+            pass
+        if args.adaptive != None:
+            if len(outputsigs) > 1 or completed >= args.adaptive:
+                stop = True
+                pass
+            pass
         pass
-    records[record] += 1
     pass
 
-for record in records.keys():
-    out = list(record)
-    out[0] = "+" + str(records[record])
-    print (", ".join(out))
+if len(outputsigs) > 1:
+    verdict = "nondeterministic"
+elif args.adaptive != None and completed >= args.adaptive:
+    verdict = "deterministic (p(other output) < %.3f)" % (3.0 / completed)
+else:
+    verdict = "no variation seen"
+    pass
+print ("%d runs, %d distinct output signatures: %s" %
+       (completed, len(outputsigs), verdict), file=sys.stderr)
@@ -1,16 +1,30 @@
 #!/usr/bin/python3
-# run-one.py revision build-dir testfile
+# run-one.py [--corpus-dir dir] revision build-dir testfile
 #   Run a single standalone test on the binaries available in build-dir,
-#   and output a single observation log record reflecting that run.
+#   and output a single observation log record reflecting that run.  If
+#   given a corpus directory, the observation store in it is consulted
+#   first, and the test is only run if its outcome on this build is not
+#   already known.
 #
 #   IMPORTANT: Assumes (but does not check) that binaries in build-dir
 #   correspond to a build of the source at revision.
 
+import argparse
 from common import *
-    
-revision = sys.argv[1]
-builddir = sys.argv[2]
-test = sys.argv[3]
+from events import set_event_log
 
-record = run_and_form_record(revision, builddir, test)
+parser = argparse.ArgumentParser()
+parser.add_argument("--corpus-dir", default=None)
+parser.add_argument("revision")
+parser.add_argument("builddir")
+parser.add_argument("test")
+args = parser.parse_args()
+
+store = None
+if args.corpus_dir != None:
+    store = get_observation_store(args.corpus_dir)
+    set_event_log(args.corpus_dir)
+    pass
+
+record = run_and_form_record(args.revision, args.builddir, args.test, store)
 print (", ".join(record))
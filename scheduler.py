@@ -0,0 +1,79 @@
+# The order in which manage-corpus.py works through the tests to reduce.
+#
+# The worklist is a priority queue ordered by a priority function over cheap
+# per-test signals, so that when time is limited (see --time-budget), the
+# work most likely to help gets done first.  The priority function can be
+# replaced to experiment with other policies (see priorities, and
+# manage-corpus.py --priority).
+
+import heapq
+import itertools
+import collections
+
+# What we know about a test, without running it.
+#   is_new - there's no observation of this test on this build yet
+#   size - in bytes
+#   crashsig - the crash signature from a previous run on this build, or
+#     None if unknown (or not a crash)
+#   bucket_is_novel - no test with this crash signature has been reduced, or
+#     has a small reproducer, yet (always true if crashsig is None)
+#   class_yield - average number of corpus entries a reduction of a test of
+#     this kind (i.e. extension) has produced in the past
+WorkItem = collections.namedtuple("WorkItem",
+                                  ["path", "size", "is_new", "crashsig",
+                                   "bucket_is_novel", "class_yield"])
+
+# Sizes are compared in bands of a factor of 4 from 1KB up (as reducer input
+# classes are, see get_reducer_input_class), so that tests of about the same
+# size are ordered by other signals.
+def get_size_band(size):
+    band = 0
+    limit = 1024
+    while size >= limit and band < 5:
+        band += 1
+        limit *= 4
+        pass
+    return band
+
+# New tests first, then tests whose crash is not yet reduced, then smaller
+# tests (so fast reductions land early), preferring among tests of about the
+# same size those whose kind has historically given the most reductions.
+def default_priority(item):
+    return (not item.is_new, not item.bucket_is_novel,
+            get_size_band(item.size), -item.class_yield, item.size)
+
+# As default_priority, but strictly smallest first.
+def smallest_first_priority(item):
+    return (not item.is_new, not item.bucket_is_novel, item.size,
+            -item.class_yield)
+
+# As default_priority, but by yield before size.
+def yield_first_priority(item):
+    return (not item.is_new, not item.bucket_is_novel, -item.class_yield,
+            item.size)
+
+priorities = {
+    "default": default_priority,
+    "smallest-first": smallest_first_priority,
+    "yield-first": yield_first_priority,
+}
+
+class ReductionQueue:
+    def __init__(self, priority=default_priority):
+        self.priority = priority
+        self.heap = []
+        # Ties are broken by insertion order
+        self.counter = itertools.count()
+        pass
+
+    def push(self, item):
+        heapq.heappush(self.heap,
+                       (self.priority(item), next(self.counter), item))
+        pass
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self):
+        return len(self.heap)
+    pass
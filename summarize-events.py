@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# summarize-events.py [--since SECONDS] [events.log]
+#   Summarize where time went according to the event log written by the
+#   drivers (see events.py): totals per kind of event, test runs per file
+#   extension and per outcome, and reducer runs per reducer.  Defaults to
+#   the events.log in the CORPUS_DIR from config.json.  With --since, only
+#   events from the last that many seconds are included.
+#
+#   Note: events nest (e.g. the test runs done by a reducer are also part of
+#   the reducer's event), so totals for different kinds overlap.
+
+import argparse
+import time
+from common import *
+from events import EVENTS_NAME
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--since", type=float, default=None)
+parser.add_argument("log", nargs="?", default=None)
+args = parser.parse_args()
+
+path = args.log
+if None == path:
+    config = load_and_validate_comfig()
+    path = os.path.join(config["CORPUS_DIR"], EVENTS_NAME)
+    pass
+
+start = 0
+if None != args.since:
+    start = time.time() - args.since
+    pass
+
+events = []
+with open(path, 'r') as f:
+    for line in f:
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            # e.g. a partial line from a process which was killed
+            continue
+        if event["time"] >= start:
+            events.append(event)
+            pass
+        pass
+    pass
+
+class Totals:
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.input_size = 0
+        self.output_size = 0
+        self.ratios = []
+        self.outcomes = {}
+        pass
+
+    def add(self, event):
+        self.count += 1
+        self.wall += event["wall"]
+        self.cpu += (event["user"] + event["sys"] + event["child_user"] +
+                     event["child_sys"])
+        self.input_size += event.get("input_size") or 0
+        self.output_size += event.get("output_size") or 0
+        if "reduction_ratio" in event:
+            self.ratios.append(event["reduction_ratio"])
+            pass
+        outcome = event.get("outcome")
+        if None != outcome:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            pass
+        pass
+    pass
+
+def group_by(kind, key):
+    groups = {}
+    for event in events:
+        if event["event"] != kind:
+            continue
+        group = key(event)
+        if group not in groups:
+            groups[group] = Totals()
+            pass
+        groups[group].add(event)
+        pass
+    return groups
+
+def format_outcomes(outcomes):
+    return ", ".join("%s %d" % (outcome, count) for outcome, count in
+                     sorted(outcomes.items(), key=lambda item: -item[1]))
+
+# Print a table of groups, most expensive first.
+def print_table(title, groups, ratios=False):
+    if 0 == len(groups):
+        return
+    print (title)
+    header = "  %-24s %8s %10s %10s %10s" % ("", "count", "wall s", "cpu s",
+                                              "mean s")
+    if ratios:
+        header += " %8s" % "ratio"
+        pass
+    print (header + "  outcomes")
+    for name, totals in sorted(groups.items(), key=lambda item: -item[1].wall):
+        line = "  %-24s %8d %10.2f %10.2f %10.4f" % (
+            name, totals.count, totals.wall, totals.cpu,
+            totals.wall / totals.count)
+        if ratios:
+            ratio = "-"
+            if 0 != len(totals.ratios):
+                ratio = "%.3f" % (sum(totals.ratios) / len(totals.ratios))
+                pass
+            line += " %8s" % ratio
+            pass
+        print (line + "  " + format_outcomes(totals.outcomes))
+        pass
+    print ()
+    pass
+
+print ("%d events from %s" % (len(events), path))
+print ()
+kinds = sorted(set(event["event"] for event in events))
+totals = {}
+for kind in kinds:
+    totals.update(group_by(kind, lambda event: event["event"]))
+    pass
+print_table("By kind of event:", totals)
+print_table("Test runs by extension:",
+            group_by("run_test", lambda event: event.get("ext") or "(none)"))
+print_table("Test runs by outcome:",
+            group_by("run_test", lambda event: event.get("outcome") or
+                     event.get("error") or "(unknown)"))
+print_table("Reducer runs by reducer:",
+            group_by("reducer", lambda event: event["reducer"]), ratios=True)
+print_table("Reducer runs by extension:",
+            group_by("reducer", lambda event: event.get("ext") or "(none)"),
+            ratios=True)
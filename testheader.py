@@ -0,0 +1,124 @@
+# The header of a test: the comment (and blank) lines it starts with, up to
+# the first line of anything else.  That's where the RUN lines are, along
+# with the lit style REQUIRES, XFAIL and UNSUPPORTED lines, e.g.
+#   ; RUN: opt -S -gvn < %s
+#   ; XFAIL: *
+#   ; REQUIRES: asserts
+# Only the header is ever read, so finding the RUN line of a huge test
+# costs the same as for a small one.
+#
+# A RUN line ending in a backslash continues on the next RUN line, as with
+# lit.
+
+import os
+import re
+import shutil
+import tempfile
+import collections
+
+# comments holds the header's comment lines as is (with line endings), runs
+# the commands from the RUN lines, and requires, xfails and unsupported the
+# comma separated entries of the other directives.
+TestHeader = collections.namedtuple("TestHeader",
+                                    ["comments", "runs", "requires",
+                                     "xfails", "unsupported"])
+
+directive_re = re.compile(r"^(RUN|REQUIRES|XFAIL|UNSUPPORTED):(.*)$")
+
+# Parses a header a line at a time, for callers which read the whole file
+# anyway (see parse_corpus_file).
+class HeaderParser:
+    def __init__(self, comment_prefix):
+        self.comment_prefix = comment_prefix
+        self.done = False
+        self.continued = False
+        # The directive on the last line fed, if any
+        self.kind = None
+        self.comments = []
+        self.directives = {"RUN": [], "REQUIRES": [], "XFAIL": [],
+                           "UNSUPPORTED": []}
+        pass
+
+    # Returns whether line (a str) is still part of the header.  Once one
+    # line isn't, nothing after it is either.
+    def feed(self, line):
+        self.kind = None
+        if self.done:
+            return False
+        stripped = line.strip()
+        if stripped == "":
+            return True
+        if not stripped.startswith(self.comment_prefix):
+            self.done = True
+            return False
+        self.comments.append(line)
+        m = directive_re.match(stripped[len(self.comment_prefix):].strip())
+        if None == m:
+            self.continued = False
+            return True
+        kind, value = m.group(1), m.group(2).strip()
+        self.kind = kind
+        runs = self.directives["RUN"]
+        if kind == "RUN" and self.continued:
+            runs[-1] = runs[-1][:-1].rstrip() + " " + value
+        elif kind == "RUN":
+            runs.append(value)
+        else:
+            self.directives[kind] += [item.strip() for item in
+                                      value.split(",") if item.strip() != ""]
+            pass
+        self.continued = kind == "RUN" and runs[-1].endswith("\\")
+        return True
+
+    def result(self):
+        return TestHeader(self.comments, self.directives["RUN"],
+                          self.directives["REQUIRES"],
+                          self.directives["XFAIL"],
+                          self.directives["UNSUPPORTED"])
+    pass
+
+# Parse the header from f (an iterable of str lines), reading no further
+# than its end.
+def parse_header(f, comment_prefix):
+    parser = HeaderParser(comment_prefix)
+    for line in f:
+        if not parser.feed(line):
+            break
+        pass
+    return parser.result()
+
+# Rewrite the file at path as the lines transform yields, given the
+# original open for reading.  The new content is streamed to a (hidden)
+# temporary file in the same directory, which is then renamed over the
+# original, so no one ever observes a partial file.
+def rewrite_file(path, transform):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                   prefix=".rewrite-")
+    try:
+        with open(path, 'r') as original, os.fdopen(fd, 'w') as modified:
+            for line in transform(original):
+                modified.write(line)
+                pass
+            pass
+        shutil.copymode(path, tmpname)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+    pass
+
+# Yield the lines of f with the RUN lines in its header replaced by
+# new_runline (a whole line, prefix and all), and the rest as is.
+def replace_header_runs(f, comment_prefix, new_runline):
+    parser = HeaderParser(comment_prefix)
+    replaced = False
+    for line in f:
+        if parser.feed(line) and parser.kind == "RUN":
+            if not replaced:
+                replaced = True
+                yield new_runline
+                pass
+            continue
+        yield line
+        pass
+    pass
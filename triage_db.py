@@ -0,0 +1,590 @@
+# Persistent state kept alongside the corpus.  Everything lives in a single
+# SQLite file in CORPUS_DIR so that it can be shared by concurrent drivers
+# (and their worker processes) on the same machine.
+
+import os
+import sqlite3
+import threading
+import time
+import collections
+
+DB_NAME = "triage.db"
+
+schema = [
+    # The observation log.  Each run of a test appends a row; the most
+    # recent row for a (testsig, buildsig, machinesig) triple is taken as
+    # the known outcome of that test on that build.
+    """CREATE TABLE IF NOT EXISTS observations (
+         testsig TEXT NOT NULL,
+         buildsig TEXT NOT NULL,
+         machinesig TEXT NOT NULL,
+         revision TEXT,
+         outcome TEXT NOT NULL,
+         returncode INTEGER,
+         outputsig TEXT NOT NULL,
+         runtime REAL NOT NULL,
+         timestamp REAL NOT NULL)""",
+    """CREATE INDEX IF NOT EXISTS observations_by_key
+         ON observations (testsig, buildsig, machinesig)""",
+]
+
+# Columns added after the table was first created.  Each is added to an
+# existing database the first time it's opened.
+#   (table, column, declaration)
+added_columns = [
+    # See get_crash_signature
+    ("observations", "crashsig", "TEXT"),
+    # See Observation
+    ("observations", "configsig", "TEXT"),
+]
+
+schema_after_columns = [
+    """CREATE INDEX IF NOT EXISTS observations_by_crashsig
+         ON observations (crashsig, buildsig)""",
+]
+
+# buildsig identifies the build as far as the test goes: its configuration
+# and the tool the test ran (see RunEnvironment.get_test_build_signature).
+# configsig is just the configuration, which crash buckets are kept per, as
+# the same crash can be reached through several tools.  Observations from
+# before configsig was recorded have a buildsig which is just that.
+Observation = collections.namedtuple("Observation",
+                                     ["revision", "testsig", "outputsig",
+                                      "buildsig", "machinesig", "outcome",
+                                      "returncode", "runtime", "crashsig",
+                                      "configsig"])
+
+def outcome_for_returncode(returncode):
+    if returncode == 0:
+        return "pass"
+    return "fail"
+
+# Connections can't be shared across a fork (or, by default, between
+# threads), so keep one per process and thread.
+connections = {}
+
+# Open the database at path, creating (or updating) the tables in schema,
+# and adding any of added_columns it lacks, as for triage.db.
+def open_database(path, schema, added_columns=[], schema_after_columns=[]):
+    key = (os.getpid(), threading.get_ident(), path)
+    if key in connections:
+        return connections[key]
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Commits are frequent (e.g. one per indexed file) so avoid an fsync for
+    # each of them.  This is still crash safe in WAL mode.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in schema:
+        conn.execute(statement)
+        pass
+    for table, column, decl in added_columns:
+        existing = [row[1] for row in
+                    conn.execute("PRAGMA table_info(%s)" % table)]
+        if column not in existing:
+            conn.execute("ALTER TABLE %s ADD COLUMN %s %s" %
+                         (table, column, decl))
+            pass
+        pass
+    for statement in schema_after_columns:
+        conn.execute(statement)
+        pass
+    connections[key] = conn
+    return conn
+
+# The triage.db of a corpus
+def connect(corpusdir):
+    return open_database(os.path.join(os.path.abspath(corpusdir), DB_NAME),
+                         schema, added_columns, schema_after_columns)
+
+class ObservationStore:
+    def __init__(self, corpusdir):
+        self.conn = connect(corpusdir)
+        pass
+
+    def lookup(self, testsig, buildsig, machinesig):
+        row = self.conn.execute(
+            """SELECT revision, testsig, outputsig, buildsig, machinesig,
+                      outcome, returncode, runtime, crashsig,
+                      COALESCE(configsig, buildsig)
+               FROM observations
+               WHERE testsig = ? AND buildsig = ? AND machinesig = ?
+               ORDER BY timestamp DESC LIMIT 1""",
+            (testsig, buildsig, machinesig)).fetchone()
+        if row == None:
+            return None
+        return Observation(*row)
+
+    # The most recent observation of the test on the machine on a build of
+    # revision other than buildsig, or None.
+    def lookup_previous(self, testsig, buildsig, machinesig, revision):
+        row = self.conn.execute(
+            """SELECT revision, testsig, outputsig, buildsig, machinesig,
+                      outcome, returncode, runtime, crashsig,
+                      COALESCE(configsig, buildsig)
+               FROM observations
+               WHERE testsig = ? AND buildsig != ? AND machinesig = ?
+                 AND revision IS ?
+               ORDER BY timestamp DESC LIMIT 1""",
+            (testsig, buildsig, machinesig, revision)).fetchone()
+        if row == None:
+            return None
+        return Observation(*row)
+
+    # The (revision, configsig) of each build, other than configsig at
+    # revision, which any test has been run on on the machine.
+    def get_other_builds(self, revision, configsig, machinesig):
+        return self.conn.execute(
+            """SELECT DISTINCT revision, COALESCE(configsig, buildsig)
+               FROM observations
+               WHERE machinesig = ?
+                 AND NOT (revision IS ? AND
+                          COALESCE(configsig, buildsig) = ?)""",
+            (machinesig, revision, configsig)).fetchall()
+
+    def record(self, obs):
+        self.conn.execute(
+            """INSERT INTO observations
+               (testsig, buildsig, machinesig, revision, outcome, returncode,
+                outputsig, runtime, crashsig, configsig, timestamp)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (obs.testsig, obs.buildsig, obs.machinesig, obs.revision,
+             obs.outcome, obs.returncode, obs.outputsig, obs.runtime,
+             obs.crashsig, obs.configsig, time.time()))
+        pass
+
+    # Runtimes of past runs of the test (on any build) which completed (i.e.
+    # did not time out).
+    def get_runtimes(self, testsig):
+        return [row[0] for row in self.conn.execute(
+            """SELECT runtime FROM observations
+               WHERE testsig = ? AND outcome != 'timeout'""", (testsig,))]
+    pass
+
+def get_observation_store(corpusdir):
+    return ObservationStore(corpusdir)
+
+# The corpus index.  This caches what we need to know about each file in the
+# corpus (keyed by stat information) so that rescanning the corpus only needs
+# to read files which are new or have changed.  The id column increases each
+# time an entry is added or updated, which lets a caller ask for just the
+# entries changed since it last looked.
+schema += [
+    """CREATE TABLE IF NOT EXISTS corpus_files (
+         id INTEGER PRIMARY KEY AUTOINCREMENT,
+         path TEXT NOT NULL UNIQUE,
+         dir TEXT NOT NULL,
+         size INTEGER NOT NULL,
+         mtime_ns INTEGER NOT NULL,
+         sha1 TEXT NOT NULL,
+         runline TEXT)""",
+    """CREATE TABLE IF NOT EXISTS corpus_file_dirs (
+         path TEXT PRIMARY KEY,
+         parent TEXT,
+         mtime_ns INTEGER)""",
+]
+
+# See CorpusEntry.  An entry without a canonical_sha1 is treated as stale,
+# and so parsed again.  content_size is only different from size (which is
+# of the file, as stat reports it) for a compressed entry.
+added_columns += [
+    ("corpus_files", "canonical_sha1", "TEXT"),
+    ("corpus_files", "content_size", "INTEGER"),
+]
+
+schema_after_columns += [
+    """CREATE INDEX IF NOT EXISTS corpus_files_by_canonical_sha1
+         ON corpus_files (canonical_sha1)""",
+]
+
+# runline is the result of get_valid_run_line, and thus None for an invalid
+# test.  canonical_sha1 is the content hash modulo differences which don't
+# matter (see canonical_ir.py), and is the same as sha1 for anything but IR.
+# content_size is the size of the (uncompressed) content.
+CorpusEntry = collections.namedtuple("CorpusEntry",
+                                     ["path", "size", "mtime_ns", "sha1",
+                                      "runline", "canonical_sha1",
+                                      "content_size"])
+
+class CorpusIndex:
+    def __init__(self, corpusdir):
+        self.conn = connect(corpusdir)
+        pass
+
+    # (size, mtime_ns) of each entry by path, or None for a stale entry.
+    def load_stats(self):
+        stats = {}
+        for path, size, mtime_ns, canonical_sha1 in self.conn.execute(
+                """SELECT path, size, mtime_ns, canonical_sha1
+                   FROM corpus_files"""):
+            stats[path] = None
+            if canonical_sha1 != None:
+                stats[path] = (size, mtime_ns)
+                pass
+            pass
+        return stats
+
+    def load_dir_mtimes(self):
+        return dict(self.conn.execute(
+            "SELECT path, mtime_ns FROM corpus_file_dirs"))
+
+    def load_subdirs(self, dirpath):
+        return [row[0] for row in self.conn.execute(
+            "SELECT path FROM corpus_file_dirs WHERE parent = ?", (dirpath,))]
+
+    def set_dir(self, dirpath, mtime_ns, subdirs):
+        self.conn.execute(
+            """INSERT INTO corpus_file_dirs (path, mtime_ns) VALUES (?, ?)
+               ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns""",
+            (dirpath, mtime_ns))
+        known = set(self.load_subdirs(dirpath))
+        for subdir in known - set(subdirs):
+            self.remove_dir(subdir)
+            pass
+        for subdir in set(subdirs) - known:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO corpus_file_dirs (path, parent, mtime_ns)
+                   VALUES (?, ?, NULL)""", (subdir, dirpath))
+            pass
+        pass
+
+    def remove_dir(self, dirpath):
+        for subdir in self.load_subdirs(dirpath):
+            self.remove_dir(subdir)
+            pass
+        self.conn.execute("DELETE FROM corpus_files WHERE dir = ?", (dirpath,))
+        self.conn.execute("DELETE FROM corpus_file_dirs WHERE path = ?", (dirpath,))
+        pass
+
+    def update(self, entry):
+        self.conn.execute(
+            """INSERT OR REPLACE INTO corpus_files
+               (path, dir, size, mtime_ns, sha1, runline, canonical_sha1,
+                content_size)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (entry.path, os.path.dirname(entry.path), entry.size,
+             entry.mtime_ns, entry.sha1, entry.runline,
+             entry.canonical_sha1, entry.content_size))
+        pass
+
+    def remove(self, path):
+        self.conn.execute("DELETE FROM corpus_files WHERE path = ?", (path,))
+        pass
+
+    def lookup(self, path):
+        row = self.conn.execute(
+            """SELECT path, size, mtime_ns, sha1, runline, canonical_sha1,
+                      COALESCE(content_size, size)
+               FROM corpus_files WHERE path = ?""", (path,)).fetchone()
+        if row == None:
+            return None
+        return CorpusEntry(*row)
+
+    # Return an entry equivalent to one with canonical hash canonical_sha1,
+    # or None.
+    def lookup_equivalent(self, canonical_sha1):
+        row = self.conn.execute(
+            """SELECT path, size, mtime_ns, sha1, runline, canonical_sha1,
+                      COALESCE(content_size, size)
+               FROM corpus_files WHERE canonical_sha1 = ? LIMIT 1""",
+            (canonical_sha1,)).fetchone()
+        if row == None:
+            return None
+        return CorpusEntry(*row)
+
+    # Return (id, entry) for each entry added or changed after id since,
+    # in order.
+    def entries_since(self, since):
+        result = []
+        for row in self.conn.execute(
+                """SELECT id, path, size, mtime_ns, sha1, runline,
+                          canonical_sha1, COALESCE(content_size, size)
+                   FROM corpus_files WHERE id > ? ORDER BY id""", (since,)):
+            result.append((row[0], CorpusEntry(*row[1:])))
+            pass
+        return result
+    pass
+
+# Crash buckets.  Failing tests are bucketed by crash signature (as recorded
+# in the observation log), which lets the driver limit how much reduction
+# effort goes into any one bug.  The buildsig of a bucket is the configsig
+# of its observations.
+schema += [
+    """CREATE TABLE IF NOT EXISTS bucket_reductions (
+         crashsig TEXT NOT NULL,
+         buildsig TEXT NOT NULL,
+         count INTEGER NOT NULL,
+         PRIMARY KEY (crashsig, buildsig))""",
+]
+
+class CrashBuckets:
+    def __init__(self, corpusdir):
+        self.conn = connect(corpusdir)
+        pass
+
+    # The size of the smallest file in the corpus (other than the one with
+    # content hash exclude) which is known to crash with crashsig on this
+    # build, or None.
+    def smallest_reproducer(self, crashsig, buildsig, exclude=None):
+        row = self.conn.execute(
+            """SELECT MIN(COALESCE(corpus_files.content_size,
+                                   corpus_files.size))
+               FROM corpus_files
+               JOIN observations ON observations.testsig = corpus_files.sha1
+               WHERE observations.crashsig = ?
+                 AND COALESCE(observations.configsig,
+                              observations.buildsig) = ?
+                 AND corpus_files.sha1 != ?""",
+            (crashsig, buildsig, exclude or "")).fetchone()
+        return row[0]
+
+    def reduction_count(self, crashsig, buildsig):
+        row = self.conn.execute(
+            """SELECT count FROM bucket_reductions
+               WHERE crashsig = ? AND buildsig = ?""",
+            (crashsig, buildsig)).fetchone()
+        if row == None:
+            return 0
+        return row[0]
+
+    def note_reduction(self, crashsig, buildsig):
+        self.conn.execute(
+            """INSERT INTO bucket_reductions (crashsig, buildsig, count)
+               VALUES (?, ?, 1)
+               ON CONFLICT(crashsig, buildsig)
+               DO UPDATE SET count = count + 1""", (crashsig, buildsig))
+        pass
+    pass
+
+# The reducer-attempt ledger.  Each run of a reducer on a test records what
+# came of it (including failures and timeouts) so that it isn't rerun on the
+# same input and build.  See ReducerResult for the outcomes.  outputsigs is a
+# space separated list of the content hashes of the outputs.
+schema += [
+    """CREATE TABLE IF NOT EXISTS reducer_attempts (
+         reducer TEXT NOT NULL,
+         inputsig TEXT NOT NULL,
+         buildsig TEXT NOT NULL,
+         outcome TEXT NOT NULL,
+         outputsigs TEXT NOT NULL,
+         duration REAL NOT NULL,
+         input_size INTEGER,
+         output_size INTEGER,
+         timestamp REAL NOT NULL,
+         PRIMARY KEY (reducer, inputsig, buildsig))""",
+]
+
+# input_class groups similar inputs (see get_reducer_input_class), and cpu
+# is the CPU time (of the reducer and everything it ran) in seconds.
+added_columns += [
+    ("reducer_attempts", "input_class", "TEXT"),
+    ("reducer_attempts", "cpu", "REAL"),
+]
+
+schema_after_columns += [
+    """CREATE INDEX IF NOT EXISTS reducer_attempts_by_class
+         ON reducer_attempts (input_class)""",
+]
+
+ReducerAttempt = collections.namedtuple("ReducerAttempt",
+                                        ["reducer", "inputsig", "buildsig",
+                                         "outcome", "outputsigs", "duration",
+                                         "input_size", "output_size",
+                                         "input_class", "cpu"])
+
+# How a reducer has done on one class of inputs: the number of attempts, the
+# total bytes by which its new outputs were smaller than their inputs, and
+# the total CPU seconds spent.  A new output which is no smaller (e.g. from
+# a reducer which isolates rather than shrinks) counts as one byte.
+ReducerStats = collections.namedtuple("ReducerStats",
+                                      ["attempts", "gain", "cpu"])
+
+class ReducerLedger:
+    def __init__(self, corpusdir):
+        self.conn = connect(corpusdir)
+        pass
+
+    def lookup(self, reducer, inputsig, buildsig):
+        row = self.conn.execute(
+            """SELECT reducer, inputsig, buildsig, outcome, outputsigs,
+                      duration, input_size, output_size, input_class, cpu
+               FROM reducer_attempts
+               WHERE reducer = ? AND inputsig = ? AND buildsig = ?""",
+            (reducer, inputsig, buildsig)).fetchone()
+        if row == None:
+            return None
+        return ReducerAttempt(*row[:4], row[4].split(), *row[5:])
+
+    def record(self, attempt):
+        self.conn.execute(
+            """INSERT OR REPLACE INTO reducer_attempts
+               (reducer, inputsig, buildsig, outcome, outputsigs, duration,
+                input_size, output_size, input_class, cpu, timestamp)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (attempt.reducer, attempt.inputsig, attempt.buildsig,
+             attempt.outcome, " ".join(attempt.outputsigs), attempt.duration,
+             attempt.input_size, attempt.output_size, attempt.input_class,
+             attempt.cpu, time.time()))
+        pass
+
+    # Return {reducer: ReducerStats} over all builds for input_class.
+    # Attempts from before CPU time was recorded count their duration.
+    # Attempts on inputs the reducer doesn't handle (e.g. a pass pipeline
+    # reducer given a single pass) say nothing about how it does on those it
+    # does, so aren't counted.
+    def get_class_stats(self, input_class):
+        stats = {}
+        for row in self.conn.execute(
+                """SELECT reducer, COUNT(*),
+                          SUM(CASE WHEN outcome = 'new'
+                                   THEN MAX(input_size - output_size, 1)
+                                   ELSE 0 END),
+                          SUM(COALESCE(cpu, duration))
+                   FROM reducer_attempts
+                   WHERE input_class = ? AND outcome != 'unsupported'
+                   GROUP BY reducer""", (input_class,)):
+            stats[row[0]] = ReducerStats(*row[1:])
+            pass
+        return stats
+    pass
+
+# Tool fingerprints: the content hash of each tool binary a test has run,
+# keyed by what a stat says about it, so a binary (often hundreds of MB) is
+# only hashed again once it changes, e.g. when it's rebuilt.  See
+# get_tool_fingerprint.  These outlive any one corpus, so are kept in a
+# database of their own, which has just this table.
+FINGERPRINTS_DB_NAME = "fingerprints.db"
+
+fingerprint_schema = [
+    """CREATE TABLE IF NOT EXISTS tool_fingerprints (
+         path TEXT PRIMARY KEY,
+         inode INTEGER NOT NULL,
+         size INTEGER NOT NULL,
+         mtime_ns INTEGER NOT NULL,
+         sha1 TEXT NOT NULL)""",
+]
+
+class ToolFingerprints:
+    def __init__(self, dbdir):
+        self.conn = open_database(
+            os.path.join(os.path.abspath(dbdir), FINGERPRINTS_DB_NAME),
+            fingerprint_schema)
+        pass
+
+    # The fingerprint of the binary at path, if it's still as stat_key
+    # (see get_stat_key) says, or None.
+    def lookup(self, path, stat_key):
+        row = self.conn.execute(
+            """SELECT sha1 FROM tool_fingerprints
+               WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ?""",
+            (path,) + tuple(stat_key)).fetchone()
+        if row == None:
+            return None
+        return row[0]
+
+    def record(self, path, stat_key, sha1):
+        self.conn.execute(
+            """INSERT OR REPLACE INTO tool_fingerprints
+               (path, inode, size, mtime_ns, sha1)
+               VALUES (?, ?, ?, ?, ?)""", (path,) + tuple(stat_key) + (sha1,))
+        pass
+    pass
+
+# Testcases ingested from outside (see ossfuzz.py), by the content hash of
+# the testcase as downloaded, so one seen before is skipped before it's
+# converted into a test.  outcome is "added" (as path) or "duplicate".
+schema += [
+    """CREATE TABLE IF NOT EXISTS ingested_testcases (
+         sha1 TEXT PRIMARY KEY,
+         name TEXT NOT NULL,
+         outcome TEXT NOT NULL,
+         path TEXT,
+         timestamp REAL NOT NULL)""",
+]
+
+class IngestedTestcases:
+    def __init__(self, corpusdir):
+        self.conn = connect(corpusdir)
+        pass
+
+    def contains(self, sha1):
+        row = self.conn.execute(
+            "SELECT 1 FROM ingested_testcases WHERE sha1 = ?",
+            (sha1,)).fetchone()
+        return row != None
+
+    def record(self, sha1, name, outcome, path):
+        self.conn.execute(
+            """INSERT OR REPLACE INTO ingested_testcases
+               (sha1, name, outcome, path, timestamp)
+               VALUES (?, ?, ?, ?, ?)""",
+            (sha1, name, outcome, path, time.time()))
+        pass
+    pass
+
+# Runs of revalidate-corpus.py, each with the build (revision and configsig)
+# it ran on, and the buildsig each test ran with, so that the next run can
+# compare against exactly those observations.
+schema += [
+    """CREATE TABLE IF NOT EXISTS revalidations (
+         id INTEGER PRIMARY KEY AUTOINCREMENT,
+         revision TEXT,
+         configsig TEXT NOT NULL,
+         machinesig TEXT NOT NULL,
+         timestamp REAL NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS revalidated_tests (
+         revalidation INTEGER NOT NULL,
+         testsig TEXT NOT NULL,
+         buildsig TEXT NOT NULL,
+         PRIMARY KEY (revalidation, testsig))""",
+]
+
+class Revalidations:
+    def __init__(self, corpusdir):
+        self.conn = connect(corpusdir)
+        pass
+
+    # (id, revision) of the most recent revalidation on the machine of a
+    # build other than configsig at revision (or, if previous_revision is
+    # given, of a build of that), or None.
+    def last(self, revision, configsig, machinesig, previous_revision=None):
+        if previous_revision != None:
+            return self.conn.execute(
+                """SELECT id, revision FROM revalidations
+                   WHERE machinesig = ? AND revision = ?
+                   ORDER BY id DESC LIMIT 1""",
+                (machinesig, previous_revision)).fetchone()
+        return self.conn.execute(
+            """SELECT id, revision FROM revalidations
+               WHERE machinesig = ?
+                 AND NOT (revision IS ? AND configsig = ?)
+               ORDER BY id DESC LIMIT 1""",
+            (machinesig, revision, configsig)).fetchone()
+
+    # The buildsig the test ran with in revalidation, or None if it wasn't
+    # part of it.
+    def lookup(self, revalidation, testsig):
+        row = self.conn.execute(
+            """SELECT buildsig FROM revalidated_tests
+               WHERE revalidation = ? AND testsig = ?""",
+            (revalidation, testsig)).fetchone()
+        if row == None:
+            return None
+        return row[0]
+
+    # Record a complete revalidation, given (testsig, buildsig) for each
+    # test in it.
+    def record(self, revision, configsig, machinesig, tests):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            cursor = self.conn.execute(
+                """INSERT INTO revalidations
+                   (revision, configsig, machinesig, timestamp)
+                   VALUES (?, ?, ?, ?)""",
+                (revision, configsig, machinesig, time.time()))
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO revalidated_tests
+                   (revalidation, testsig, buildsig) VALUES (?, ?, ?)""",
+                [(cursor.lastrowid,) + tuple(test) for test in tests])
+            pass
+        pass
+    pass
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # validate_test.py build-dir corpus-dir
-#   Given a single test, tries to validate it's format.
+#   Given a single test, tries to validate it's format.  Also reports any
+#   REQUIRES, XFAIL and UNSUPPORTED lines it has.
 
 
 import sys
@@ -11,3 +12,13 @@ test = os.path.abspath(sys.argv[1])
 
 runline = get_valid_run_line(test, verbose=True)
 #print (runline)
+header = get_test_header(test)
+if None != header:
+    for name, values in [("REQUIRES", header.requires),
+                         ("XFAIL", header.xfails),
+                         ("UNSUPPORTED", header.unsupported)]:
+        if 0 != len(values):
+            print ("%s: %s" % (name, ", ".join(values)))
+            pass
+        pass
+    pass
@@ -3,14 +3,19 @@
 #   Run a single standalone test on the binaries available in build-dir,
 #   and propagate the output to the output pipes and exit with the
 #   tests return code.  This is useful for checking that a test behaves
-#   as expected when debugging reducer problems.
+#   as expected when debugging reducer problems.  If the test times out,
+#   says so and exits with 124 (as timeout(1) does).
 
 from common import *
 
 builddir = sys.argv[1]
 test = sys.argv[2]
 
-completed = run_test(test, builddir)
+try:
+    completed = run_test(test, builddir)
+except subprocess.TimeoutExpired as e:
+    print ("Test timed out after %d seconds" % e.timeout, file=sys.stderr)
+    sys.exit(124)
 sys.stdout.write(completed.stdout.decode())
 sys.stderr.write(completed.stderr.decode())
 sys.exit(completed.returncode)